@@ -0,0 +1,70 @@
+"""
+Benchmark: loading strategies for the pereval detail endpoint.
+
+Seeds a database and reports round-trips and p50/p99 latency of every
+strategy in pereval.loaders.LOADERS.
+
+    python -m benchmarks.bench_loaders --url sqlite+aiosqlite:///bench.db --passes 2000 --lookups 2000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import event
+
+import database
+from benchmarks.seed import seed_perevals
+from pereval.loaders import LOADERS, load_pereval_detail
+
+
+def percentile(samples, q):
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1] if len(samples) > 1 else samples[0]
+
+
+async def run(args):
+    engine = database.init_engine(args.url)
+    queries = 0
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(*_):
+        nonlocal queries
+        queries += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.drop_all)
+        await conn.run_sync(database.Base.metadata.create_all)
+    async with database.Session() as db:
+        ids = await seed_perevals(db, args.passes, images_per_pass=args.images)
+
+    rng = random.Random(0)
+    lookups = [rng.choice(ids) for _ in range(args.lookups)]
+    print(f"{'loader':>10} {'queries/op':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for strategy in LOADERS:
+        async with database.Session() as db:
+            await load_pereval_detail(db, lookups[0], strategy)  # прогрев
+        queries = 0
+        samples = []
+        for pereval_id in lookups:
+            async with database.Session() as db:
+                started = time.perf_counter()
+                await load_pereval_detail(db, pereval_id, strategy)
+                samples.append((time.perf_counter() - started) * 1000)
+        print(f"{strategy:>10} {queries / len(lookups):>10.1f} {percentile(samples, 50):>8.3f} {percentile(samples, 99):>8.3f}")
+
+    await database.dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    # Таблицы в этой базе пересоздаются — не указывайте рабочую БД
+    parser.add_argument("--url", default="sqlite+aiosqlite:///bench.db")
+    parser.add_argument("--passes", type=int, default=2000)
+    parser.add_argument("--images", type=int, default=3)
+    parser.add_argument("--lookups", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark: pereval detail serialization.
+
+Compares the previous path (PerevalResponse built field by field, validated
+again through response_model and dumped with stdlib json) with the direct
+ORM -> dict -> orjson path used by GET /pereval_id/{id}.
+
+    python -m benchmarks.bench_serialization --images 10 --number 20000
+"""
+import argparse
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+from pereval.models import PerevalAdded, User, Coords, Level, Image, UserPydantic, CoordsPydantic, \
+    LevelPydantic, ImageRefPydantic, PerevalResponse
+from pereval.render import render_pereval_bytes
+
+
+def make_pereval(images: int) -> PerevalAdded:
+    pereval = PerevalAdded(
+        id=1, beauty_title="пер.", title="Пхия", other_titles="Триев", connect="",
+        user=User(email="qwerty@mail.ru", fam="Пупкин", name="Василий", otc="Иванович", phone="+7 555 55 55"),
+        coords=Coords(latitude=45.3842, longitude=7.1525, height=1200),
+        level=Level(winter="", summer="1А", autumn="1А", spring=""),
+    )
+    pereval.images = [
+        Image(title=f"Подъём {i}", hash=f"{i:064x}", size=350_000, mime_type="image/jpeg", status="ready",
+              thumbnail_hash=f"{i + 1:064x}", medium_hash=f"{i + 2:064x}", full_hash=f"{i + 3:064x}")
+        for i in range(images)
+    ]
+    return pereval
+
+
+def previous_path(result: PerevalAdded) -> bytes:
+    response = PerevalResponse(
+        id=result.id,
+        beauty_title=result.beauty_title,
+        title=result.title,
+        other_titles=result.other_titles,
+        connect=result.connect,
+        user=UserPydantic(email=result.user.email, fam=result.user.fam, name=result.user.name, otc=result.user.otc, phone=result.user.phone),
+        coords=CoordsPydantic(latitude=result.coords.latitude, longitude=result.coords.longitude, height=result.coords.height),
+        level=LevelPydantic(winter=result.level.winter, summer=result.level.summer, autumn=result.level.autumn, spring=result.level.spring),
+        images=[ImageRefPydantic(title=image.title, hash=image.hash, size=image.size, mime_type=image.mime_type,
+                                 status=image.status, url=f"/images/{image.medium_hash}",
+                                 thumbnail_url=f"/images/{image.thumbnail_hash}", full_url=f"/images/{image.full_hash}")
+                for image in result.images],
+    )
+    # То, что делает FastAPI для response_model: повторная валидация и jsonable_encoder + json
+    validated = PerevalResponse.model_validate(response.model_dump())
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    pereval = make_pereval(args.images)
+    assert json.loads(previous_path(pereval)) == json.loads(render_pereval_bytes(pereval))
+
+    results = {}
+    for name, func in (("previous", previous_path), ("orjson", render_pereval_bytes)):
+        best = min(timeit.repeat(lambda: func(pereval), number=args.number, repeat=5))
+        results[name] = best / args.number * 1e6
+        print(f"{name:>10}: {results[name]:8.2f} us/op")
+    print(f"{'speedup':>10}: {results['previous'] / results['orjson']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Load test of the pereval API through an in-process ASGI client.
+
+Seeds a database (SQLite/aiosqlite by default, or any SQLAlchemy async URL),
+then drives each scenario with the given concurrency and prints a JSON report
+with throughput, latency percentiles, DB round-trips and allocation peak per
+request. Reports carry the git commit, so they can be compared across commits:
+
+    python -m benchmarks.load_test --passes 5000 --requests 2000 --concurrency 32 --output before.json
+    python -m benchmarks.load_test ... --output after.json --compare before.json
+
+Tables in the target database are dropped and recreated.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+SCENARIOS = ("post_pereval", "get_pereval", "list_pereval", "bbox", "nearest")
+
+
+def make_image(rng: random.Random, size: int) -> str:
+    # Заголовок JPEG + случайные байты: сжимается так же плохо, как настоящее фото
+    return base64.b64encode(b"\xff\xd8\xff\xe0" + rng.randbytes(size - 4)).decode()
+
+
+def make_payload(rng: random.Random, images: int, image_size: int) -> dict:
+    return {
+        "beauty_title": "пер.", "title": f"Перевал {rng.randrange(10 ** 6)}", "other_titles": "Pass", "connect": "",
+        "user": {"email": f"user{rng.randrange(1000)}@example.com", "fam": "Иванов", "name": "Иван",
+                 "otc": "Иванович", "phone": "+7 900 000 00 00"},
+        "coords": {"latitude": rng.uniform(41.0, 44.0), "longitude": rng.uniform(40.0, 47.0),
+                   "height": rng.randrange(1500, 5600)},
+        "level": {"winter": "", "summer": "1А", "autumn": "1А", "spring": ""},
+        "images": [{"title": f"Фото {i}", "data": make_image(rng, image_size)} for i in range(images)],
+    }
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {"p50": value, "p90": value, "p99": value, "max": value}
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": q[49], "p90": q[89], "p99": q[98], "max": max(samples)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    # Импорт после настройки окружения: настройки читаются при импорте
+    import httpx
+    from sqlalchemy import event
+
+    import database
+    from benchmarks.seed import seed_perevals
+    from main import app
+
+    engine = database.init_engine(args.url)
+    queries = 0
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(*_):
+        nonlocal queries
+        queries += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.drop_all)
+        await conn.run_sync(database.Base.metadata.create_all)
+    async with database.Session() as db:
+        ids = await seed_perevals(db, args.passes, images_per_pass=args.images)
+
+    rng = random.Random(args.seed)
+    payloads = [make_payload(rng, args.images, args.image_size) for _ in range(min(args.requests, 50))]
+
+    def request_for(scenario):
+        if scenario == "post_pereval":
+            return "POST", "/Pereval", {"json": rng.choice(payloads)}
+        if scenario == "get_pereval":
+            return "GET", f"/pereval_id/{rng.choice(ids)}", {}
+        if scenario == "list_pereval":
+            return "GET", "/pereval", {"params": {"limit": 50, "after": rng.choice(ids)}}
+        if scenario == "bbox":
+            lat, lon = rng.uniform(41.0, 43.5), rng.uniform(40.0, 46.5)
+            return "GET", "/pereval/bbox", {"params": {"min_lat": lat, "min_lon": lon,
+                                                       "max_lat": lat + 0.5, "max_lon": lon + 0.5}}
+        return "GET", "/pereval/nearest", {"params": {"lat": rng.uniform(41.0, 44.0),
+                                                      "lon": rng.uniform(40.0, 47.0)}}
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "scenarios": {},
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for scenario in args.scenarios:
+            for _ in range(args.warmup):
+                method, url, kwargs = request_for(scenario)
+                await client.request(method, url, **kwargs)
+
+            latencies, errors, remaining = [], 0, args.requests
+
+            async def worker():
+                nonlocal errors, remaining
+                while remaining > 0:
+                    remaining -= 1
+                    method, url, kwargs = request_for(scenario)
+                    started = time.perf_counter()
+                    response = await client.request(method, url, **kwargs)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if response.status_code >= 400:
+                        errors += 1
+
+            queries = 0
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            db_queries = queries
+
+            # Пиковое выделение памяти на запрос — отдельным последовательным прогоном
+            alloc_peaks = []
+            tracemalloc.start()
+            for _ in range(args.alloc_samples):
+                method, url, kwargs = request_for(scenario)
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                await client.request(method, url, **kwargs)
+                alloc_peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+            tracemalloc.stop()
+
+            report["scenarios"][scenario] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "throughput_rps": len(latencies) / elapsed,
+                "latency_ms": percentiles(latencies),
+                "db_queries_per_request": db_queries / len(latencies),
+                "alloc_peak_kib_per_request": statistics.median(alloc_peaks) if alloc_peaks else None,
+            }
+
+    await database.dispose_engine()
+    return report
+
+
+def compare(report, baseline):
+    for scenario, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        rps = current["throughput_rps"] / previous["throughput_rps"] - 1
+        p99 = current["latency_ms"]["p99"] / previous["latency_ms"]["p99"] - 1
+        print(f"{scenario:>14}: throughput {rps:+.1%}, p99 {p99:+.1%}, "
+              f"queries/request {previous['db_queries_per_request']:.1f} -> {current['db_queries_per_request']:.1f}",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="sqlite+aiosqlite:///bench.db")
+    parser.add_argument("--passes", type=int, default=2000, help="passes to seed")
+    parser.add_argument("--images", type=int, default=3, help="images per pass")
+    parser.add_argument("--image-size", type=int, default=256 * 1024, help="bytes per image in POST payloads")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--alloc-samples", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BLOB_STORAGE_PATH", tempfile.mkdtemp(prefix="pereval-bench-blobs-"))
+    # Один клиент шлёт все запросы — лимиты частоты исказили бы замер
+    os.environ.setdefault("RATE_LIMITS", "")
+    if args.no_cache:
+        os.environ["CACHE_BACKEND"] = "none"
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
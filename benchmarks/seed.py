@@ -0,0 +1,58 @@
+"""Synthetic data for benchmarks: passes with users, coords, levels and image rows."""
+import random
+from typing import List
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pereval.identity import upsert_ids
+from pereval.search import search_text
+from pereval.models import User, Coords, Level, Image, PerevalAdded
+
+
+DIFFICULTIES = ("", "1А", "1Б", "2А", "2Б", "3А")
+
+
+async def _insert_ids(db: AsyncSession, model, rows: List[dict]) -> List[int]:
+    result = await db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+    return list(result)
+
+
+async def seed_perevals(db: AsyncSession, count: int, images_per_pass: int = 3, batch_size: int = 1000,
+                        seed: int = 42) -> List[int]:
+    """Insert ``count`` passes in batches and return their ids."""
+    rng = random.Random(seed)
+    ids = []
+    for start in range(0, count, batch_size):
+        n = min(batch_size, count - start)
+        # Пользователи, координаты и уровни уникальны по значению — повторы переиспользуются
+        user_ids, _ = await upsert_ids(db, User, [
+            {"email": f"user{rng.randrange(count // 10 + 1)}@example.com", "fam": "Иванов", "name": "Иван",
+             "otc": "Иванович", "phone": "+7 900 000 00 00"}
+            for _ in range(n)
+        ])
+        coords_ids, _ = await upsert_ids(db, Coords, [
+            {"latitude": rng.uniform(41.0, 44.0), "longitude": rng.uniform(40.0, 47.0), "height": rng.randrange(1500, 5600)}
+            for _ in range(n)
+        ])
+        level_ids, _ = await upsert_ids(db, Level, [
+            {season: rng.choice(DIFFICULTIES) for season in ("winter", "summer", "autumn", "spring")}
+            for _ in range(n)
+        ])
+        pereval_ids = await _insert_ids(db, PerevalAdded, [
+            {"beauty_title": "пер.", "title": f"Перевал {start + i}", "other_titles": f"Pass {start + i}",
+             "connect": "", "search_text": search_text("пер.", f"Перевал {start + i}", f"Pass {start + i}"),
+             "user_id": user_id, "coords_id": coords_id, "level_id": level_id}
+            for i, (user_id, coords_id, level_id) in enumerate(zip(user_ids, coords_ids, level_ids))
+        ])
+        image_rows = [
+            {"pereval_id": pereval_id, "title": f"Фото {j}", "hash": f"{rng.getrandbits(256):064x}",
+             "size": rng.randrange(200_000, 4_000_000), "mime_type": "image/jpeg"}
+            for pereval_id in pereval_ids
+            for j in range(images_per_pass)
+        ]
+        if image_rows:
+            await db.execute(insert(Image), image_rows)
+        ids += pereval_ids
+    await db.commit()
+    return ids
@@ -0,0 +1,86 @@
+"""
+Startup profile: how long a fresh worker takes to import the app, per module.
+
+Imports ``main`` in a clean interpreter under ``python -X importtime`` and
+prints the total import time, the slowest modules (self and cumulative time)
+and the time per top-level package. Run it after touching imports to see
+what a cold worker pays:
+
+    python -m benchmarks.startup_profile --top 25
+    python -m benchmarks.startup_profile --runs 5 --json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+# В дочернем процессе печатается полное время импорта, отдельно от разбивки -X importtime
+CHILD = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def profile_once() -> Tuple[float, List[Tuple[str, int, int, int]]]:
+    """Wall time of ``import main`` and ``(module, self_us, cumulative_us, depth)`` rows."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return float(result.stdout.strip().splitlines()[-1]), modules
+
+
+def by_package(modules: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+    totals: Dict[str, int] = defaultdict(int)
+    for name, self_us, _, _ in modules:
+        totals[name.partition(".")[0]] += self_us
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters; the fastest breakdown is shown")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print a JSON report")
+    args = parser.parse_args()
+
+    runs = [profile_once() for _ in range(args.runs)]
+    wall_times = [wall for wall, _ in runs]
+    _, modules = min(runs, key=lambda run: run[0])
+    slowest_self = sorted(modules, key=lambda row: row[1], reverse=True)[:args.top]
+    slowest_cumulative = sorted(modules, key=lambda row: row[2], reverse=True)[:args.top]
+    packages = by_package(modules)
+
+    if args.json:
+        print(json.dumps({
+            "import_main_s": {"min": min(wall_times), "median": statistics.median(wall_times)},
+            "modules": len(modules),
+            "self_us": {name: self_us for name, self_us, _, _ in slowest_self},
+            "cumulative_us": {name: cumulative_us for name, _, cumulative_us, _ in slowest_cumulative},
+            "packages_us": dict(list(packages.items())[:args.top]),
+        }, indent=2))
+        return
+
+    print(f"import main: min {min(wall_times) * 1000:.1f} ms, median {statistics.median(wall_times) * 1000:.1f} ms, "
+          f"{len(modules)} modules")
+    print(f"\n{'self ms':>9} {'cum ms':>9}  module")
+    for name, self_us, cumulative_us, _ in slowest_self:
+        print(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}")
+    print(f"\n{'cum ms':>9}  module (cumulative)")
+    for name, _, cumulative_us, depth in slowest_cumulative:
+        print(f"{cumulative_us / 1000:9.1f}  {'  ' * depth}{name}")
+    print(f"\n{'self ms':>9}  package")
+    for package, total_us in list(packages.items())[:args.top]:
+        print(f"{total_us / 1000:9.1f}  {package}")
+
+
+if __name__ == "__main__":
+    main()
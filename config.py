@@ -1,11 +1,6 @@
-import os
 from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Access environment variables
+# Переменные окружения и .env читает сам pydantic-settings (Config.env_file), load_dotenv не нужен
 class Settings(BaseSettings):
     DB_HOST: str
     DB_PORT: int
@@ -13,6 +8,108 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASSWORD: str
 
+    # Пул соединений (на один процесс)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_ECHO: bool = False
+    # Запросы дольше порога пишутся в лог pereval.sql.slow (вместо echo всех запросов)
+    DB_SLOW_QUERY_MS: float = 200.0
+    # Общий бюджет соединений на все процессы serve.py (делится поровну между ними);
+    # 0 — у каждого процесса свои DB_POOL_SIZE + DB_MAX_OVERFLOW
+    DB_POOL_TOTAL: int = 0
+
+    # Реплики только для чтения: URL через запятую (postgresql+asyncpg://...), выбор реплики
+    # "round_robin" или "least_connections"; реплика с отставанием больше DB_REPLICA_MAX_LAG (с)
+    # выводится из ротации до следующей проверки. После записи клиент читает с основной БД
+    # DB_READ_PRIMARY_TTL секунд (cookie read_primary или заголовок X-Read-Primary, подписанные
+    # DB_READ_PRIMARY_SECRET; пустой — случайный при запуске, общий для воркеров serve.py)
+    DB_REPLICA_URLS: str = ""
+    DB_REPLICA_STRATEGY: str = "round_robin"
+    DB_REPLICA_MAX_LAG: float = 5.0
+    DB_REPLICA_CHECK_INTERVAL: float = 5.0
+    DB_READ_PRIMARY_TTL: float = 10.0
+    DB_READ_PRIMARY_SECRET: str = ""
+
+    # Запуск в production (serve.py): число процессов (0 — по числу ядер), адрес, время на
+    # завершение запросов при остановке (с) и порог памяти процесса (МБ, 0 — без перезапуска)
+    WEB_WORKERS: int = 0
+    WEB_HOST: str = "0.0.0.0"
+    WEB_PORT: int = 8000
+    WEB_GRACEFUL_TIMEOUT: float = 30.0
+    WEB_MAX_MEMORY_MB: int = 0
+    WEB_MEMORY_CHECK_INTERVAL: float = 5.0
+    # Номер воркера и число воркеров; serve.py задаёт их каждому процессу
+    WEB_WORKER_INDEX: int = 0
+    WEB_WORKER_COUNT: int = 1
+
+    # Сжатие ответов (gzip/br/zstd): минимальный размер тела и порог, с которого сжатие уходит в поток
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_THREAD_MIN_SIZE: int = 64 * 1024
+
+    # Кеш ответов: "memory", "redis" или "none"
+    CACHE_BACKEND: str = "memory"
+    CACHE_TTL: float = 60.0
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    REDIS_URL: str = "redis://localhost:6379/0"
+
+    # Геопоиск: "postgres" (GiST), "memory" (R-tree в памяти) или "auto" по диалекту БД
+    SPATIAL_BACKEND: str = "auto"
+
+    # Поиск по названиям: "postgres" (tsvector + pg_trgm), "memory" (триграммы в памяти) или "auto"
+    SEARCH_BACKEND: str = "auto"
+
+    # Загрузка карточки перевала: "selectin", "joined" или "json_agg" (см. pereval/loaders.py)
+    PEREVAL_LOADER: str = "joined"
+
+    # Размер LRU email/координаты/уровень -> id, чтобы не делать upsert для частых значений
+    IDENTITY_CACHE_SIZE: int = 10000
+
+    # Idempotency-Key: сколько хранить ответ (с), размер LRU в процессе и
+    # через сколько секунд незавершённый запрос с тем же ключом считается брошенным
+    IDEMPOTENCY_TTL: int = 24 * 60 * 60
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    IDEMPOTENCY_LOCK_TIMEOUT: int = 60
+
+    # Приём через журнал (write-behind): "sync" — запись в БД в запросе, "log" — журнал на диске
+    # и групповая запись в фоне; fsync журнала раз в интервал, пачки до INGEST_BATCH_SIZE
+    INGEST_MODE: str = "sync"
+    INGEST_LOG_PATH: str = "ingest"
+    INGEST_SEGMENT_BYTES: int = 64 * 1024 * 1024
+    INGEST_FSYNC_INTERVAL_MS: float = 5.0
+    INGEST_BATCH_SIZE: int = 500
+    INGEST_BATCH_WAIT_MS: float = 50.0
+    # После стольких неудачных попыток пачка делится пополам, а одиночная запись уходит
+    # в INGEST_LOG_PATH/dead-letter.jsonl
+    INGEST_MAX_ATTEMPTS: int = 5
+
+    # Ограничение частоты (token bucket) по клиенту и маршруту: "METHOD /маршрут=N/s[:burst]" через запятую,
+    # "*" вместо маршрута — все запросы клиента; хранилище "memory" (в процессе), "redis" (общее) или "none"
+    RATE_LIMITS: str = "POST /Pereval=10/s:50,POST /Pereval/batch=2/s:10,POST /images=10/s:50"
+    RATE_LIMIT_BACKEND: str = "memory"
+    # Размер тела запроса по маршрутам ("METHOD /маршрут=32MB" через запятую, "*" — остальные);
+    # проверяется по мере чтения, тело сверх лимита не читается
+    BODY_SIZE_LIMITS: str = "*=32MB,POST /Pereval/batch=256MB,POST /images=64MB"
+    # Отказ 503 до начала обработки при перегрузке: запросов в обработке, среднее ожидание
+    # соединения из пула (мс), запросов в очереди за соединением (0 — проверка выключена)
+    ADMISSION_MAX_IN_FLIGHT: int = 1000
+    ADMISSION_MAX_POOL_WAIT_MS: float = 1000.0
+    ADMISSION_MAX_POOL_WAITERS: int = 100
+
+    # Фоновая обработка изображений: число процессов на всю группу воркеров serve.py (0 — выключена)
+    IMAGE_WORKERS: int = 2
+    # Как часто воркер забирает необработанные изображения, и через сколько захват считается брошенным, с
+    IMAGE_SWEEP_INTERVAL: float = 30.0
+    IMAGE_CLAIM_TIMEOUT: float = 600.0
+    # Порог расхождения координат из EXIF с координатами перевала, км
+    IMAGE_EXIF_MISMATCH_KM: float = 5.0
+
+    # Каталог хранилища изображений (content-addressed, по SHA-256)
+    BLOB_STORAGE_PATH: str = "blobs"
+
     class Config:
         env_file = ".env"  # Указываем файл .env для загрузки переменных окружения
 
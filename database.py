@@ -1,7 +1,9 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, declared_attr, DeclarativeBase
 from config import settings
+from pereval.metrics import InstrumentedQueuePool, instrument_engine
 
 
 DATABASE_URL = ( f'postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}' )
@@ -9,17 +11,47 @@ DATABASE_URL = ( f'postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASSWORD
 
 Base = declarative_base()
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
+# Один движок на процесс: создаётся в lifespan приложения и закрывается при остановке
+engine: Optional[AsyncEngine] = None
+Session = async_sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+
+def create_engine(url: str = DATABASE_URL, primary: bool = True) -> AsyncEngine:
+    connect_args = {}
+    if url.startswith("postgresql+asyncpg"):
+        connect_args["statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+
+    engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    instrument_engine(engine, settings.DB_SLOW_QUERY_MS, settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+                      track_pool=primary)
+    return engine
+
+
+def init_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    global engine
+    if engine is None:
+        engine = create_engine(url)
+        Session.configure(bind=engine)
+    return engine
+
+
+async def dispose_engine() -> None:
+    global engine
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with Session() as session:
+        yield session
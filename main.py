@@ -1,151 +1,607 @@
 import logging
-from typing import List
-
-from fastapi import FastAPI, HTTPException
-from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
-from fastapi.openapi.utils import get_openapi
-from pydantic import BaseModel
+import os
+from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Request, UploadFile, Depends, Query, Header
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from sqlalchemy import select
 
-from sqlalchemy.ext.asyncio import async_session, AsyncSession
-from sqlalchemy.orm import sessionmaker, selectinload, joinedload
-from starlette.responses import HTMLResponse, JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 
 
 import database
-from database import Session
-from pereval.models import PerevalAdded, User, Coords, Level, Image, PerevalAddedPydantic, ErrorResponse, DetailItem, \
-    UserPydantic, CoordsPydantic, LevelPydantic, ImagePydantic
-from pereval.serializer import image_pydantic_to_sqlalchemy, perevaladded_pydantic_to_sqlalchemy, \
-    level_pydantic_to_sqlalchemy, user_pydantic_to_sqlalchemy, coords_pydantic_to_sqlalchemy
-
-app = FastAPI()
+from config import settings
+from database import get_session
+from pereval.batch import parse_batch_item, insert_pereval_batch
+from pereval.idempotency import idempotency_store, request_fingerprint
+from pereval.ingest import ingest_log, prepare_item
+from pereval.render import ORJSONResponse, dumps
+from pereval.loaders import load_pereval_detail
+from pereval.moderation import update_pereval, claim_new, decide, TITLE_FIELDS
+from pereval.search import search_perevals, search_index, search_text
+from pereval.listing import list_perevals, parse_fields, stream_perevals, ALL_FIELDS
+from pereval.export import export_perevals, check_available, export_filename, export_media_type
+from pereval.spatial import find_in_bbox, find_nearest, spatial_index
+from pereval.imaging import image_pipeline
+from pereval.metrics import MetricsMiddleware, Gauge, render_metrics
+from pereval.compression import CompressionMiddleware, negotiate, compress_async, compressed_response
+from pereval.cache import ResponseCache, get_response_cache, pereval_cache_key, pereval_version_key, \
+    invalidate_pereval
+from pereval.conditional import make_etag, http_date, is_not_modified, not_modified_response
+from pereval.blobstore import BlobStore, get_blob_store, is_valid_hash, CHUNK_SIZE
+from pereval.models import PerevalAdded, User, Image, PerevalAddedPydantic, ErrorResponse, \
+    BatchResponse, BatchItemResult, BlobInfoPydantic, PerevalListResponse, PerevalGeoItem, PerevalUpdatePydantic, \
+    ModerationDecisionPydantic, PerevalSearchItem, PerevalResponse
+from pereval.openapi import OPENAPI_PATH, build_openapi, request_body
+from pereval.limits import AdmissionMiddleware, RateLimitMiddleware, BodySizeLimitMiddleware, create_rate_limiter, \
+    parse_limits, parse_body_limits
+from pereval.spool import SpooledImages, read_json_spooled
+from pereval.replicas import ReadYourWritesMiddleware, replica_router, get_read_session, reads_from_primary
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.init_engine()
+    await replica_router.start()
+    await image_pipeline.start()
+    await idempotency_store.start()
+    if settings.INGEST_MODE == "log":
+        await ingest_log.start(on_commit=_after_insert)
+    try:
+        yield
+    finally:
+        await ingest_log.stop()
+        await idempotency_store.stop()
+        await image_pipeline.stop()
+        await replica_router.stop()
+        await database.dispose_engine()
+
+
+# Схема OpenAPI собирается при сборке (python -m pereval.openapi) и отдаётся из static/
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse, openapi_url=None, docs_url=None,
+              redoc_url=None)
+app.add_middleware(ReadYourWritesMiddleware, ttl=settings.DB_READ_PRIMARY_TTL)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE,
+                   thread_min_size=settings.COMPRESSION_THREAD_MIN_SIZE)
+app.add_middleware(BodySizeLimitMiddleware, limits=parse_body_limits(settings.BODY_SIZE_LIMITS))
+app.add_middleware(AdmissionMiddleware, max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+                   max_pool_wait_ms=settings.ADMISSION_MAX_POOL_WAIT_MS,
+                   max_pool_waiters=settings.ADMISSION_MAX_POOL_WAITERS)
+app.add_middleware(RateLimitMiddleware, limits=parse_limits(settings.RATE_LIMITS), limiter=create_rate_limiter())
+app.add_middleware(MetricsMiddleware)
+
+for _name in ("hits", "misses", "evictions"):
+    Gauge(f"response_cache_{_name}", f"Response cache {_name}",
+          callback=lambda _name=_name: getattr(get_response_cache(), _name))
 
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-@app.post("/Pereval", response_model=None)
-async def create_pereval(pereval_data: PerevalAddedPydantic):
-    db = Session()
+async def _after_insert(db: AsyncSession, items: List[Optional[PerevalAddedPydantic]],
+                        results: List[BatchItemResult]) -> None:
+    """Сброс кэша, пространственный индекс и очередь обработки изображений для записанных перевалов."""
+    ok = [r for r in results if r.status == "ok"]
+    if not ok:
+        return
+    await invalidate_pereval(*(r.id for r in ok))
+    for r in ok:
+        item = items[r.index]
+        spatial_index.add(r.id, item.coords.latitude, item.coords.longitude)
+        search_index.add(r.id, search_text(item.beauty_title, item.title, item.other_titles))
+    if image_pipeline.enabled:
+        image_pipeline.submit(await db.scalars(
+            select(Image.id).where(Image.pereval_id.in_([r.id for r in ok]), Image.status == "pending")
+        ))
+
+
+async def _create_pereval(db: AsyncSession, pereval_data: PerevalAddedPydantic) -> Response:
+    if ingest_log.enabled:
+        return await _ingest_pereval(pereval_data)
+
+    # Тот же путь записи, что и у пакета: пользователь, координаты и уровень переиспользуются
+    [result] = await insert_pereval_batch(db, [pereval_data], [None])
+    if result.status != "ok":
+        if result.status == "invalid":
+            error = ErrorResponse(error_code="invalid_data", additional_message="Invalid pereval data",
+                                  more_details=result.error)
+            return JSONResponse(status_code=400, content=error.model_dump())
+        logger.error("Error while saving pereval: %s", result.error)
+        error = ErrorResponse(error_code="server_error", additional_message="Error while saving data",
+                              more_details=result.error)
+        return JSONResponse(status_code=500, content=error.model_dump())
+
+    await _after_insert(db, [pereval_data], [result])
+    # Варианты изображений готовятся в фоне; до тех пор ссылки ведут на оригиналы
+    return ORJSONResponse({"status": 200, "message": None, "id": result.id,
+                           "images_status": "pending" if image_pipeline.active and pereval_data.images else "ready"})
+
+
+async def _ingest_pereval(pereval_data: PerevalAddedPydantic) -> Response:
+    # Запись в журнал вместо БД: ответ после fsync, id появится после групповой записи
+    try:
+        prepared = await run_in_threadpool(prepare_item, pereval_data)
+    except ValueError as e:
+        error = ErrorResponse(error_code="invalid_data", additional_message="Invalid pereval data",
+                              more_details=str(e))
+        return JSONResponse(status_code=400, content=error.model_dump())
+    provisional_id = await ingest_log.append(prepared)
+    return ORJSONResponse({"status": 202, "message": None, "id": None, "provisional_id": provisional_id},
+                          status_code=202)
+
+
+async def _read_pereval_body(request: Request, images: SpooledImages) -> PerevalAddedPydantic:
+    # Тело читается потоково: base64 изображений сразу уходит во временные файлы, а не в строки
     try:
-        user = user_pydantic_to_sqlalchemy(pereval_data.user)
-        coords = coords_pydantic_to_sqlalchemy(pereval_data.coords)
-        level = level_pydantic_to_sqlalchemy(pereval_data.level)
+        values = await read_json_spooled(request.stream(), images)
+    except ValueError as e:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": "JSON decode error",
+                                       "input": {}, "ctx": {"error": str(e)}}])
+    if len(values) != 1:
+        raise HTTPException(status_code=400, detail="Expected a single JSON object")
+    try:
+        return PerevalAddedPydantic.model_validate(values[0])
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body",) + tuple(error["loc"])}
+                                      for error in e.errors(include_url=False)])
+
+
+@app.post("/Pereval", response_model=None, openapi_extra=request_body(PerevalAddedPydantic))
+async def create_pereval(
+    request: Request,
+    db: AsyncSession = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
+):
+    """Create a pass; a retry with the same ``Idempotency-Key`` gets the original response back."""
+    # Изображения попадают в хранилище только после проверки и резервирования ключа,
+    # иначе отклонённые запросы и повторы оставляли бы файлы, на которые никто не ссылается
+    images = SpooledImages()
+    try:
+        return await _create_pereval_idempotent(request, db, idempotency_key, images)
+    finally:
+        await images.discard()
+
+
+async def _create_pereval_idempotent(request: Request, db: AsyncSession, idempotency_key: Optional[str],
+                                     images: SpooledImages) -> Response:
+    pereval_data = await _read_pereval_body(request, images)
+    if idempotency_key is None:
+        await images.commit()
+        return await _create_pereval(db, pereval_data)
+
+    fingerprint = request_fingerprint(pereval_data)
+    stored = await idempotency_store.begin(db, idempotency_key, fingerprint)
+    if stored is not None:
+        if stored.fingerprint != fingerprint:
+            error = ErrorResponse(error_code="idempotency_key_reused", additional_message="Idempotency-Key reused",
+                                  more_details="The key was already used for a different request")
+            return JSONResponse(status_code=422, content=error.model_dump())
+        if stored.status_code is None:
+            error = ErrorResponse(error_code="request_in_progress", additional_message="Request in progress",
+                                  more_details="A request with this Idempotency-Key is still being processed")
+            return JSONResponse(status_code=409, content=error.model_dump(), headers={"Retry-After": "1"})
+        return Response(stored.body, status_code=stored.status_code, media_type="application/json",
+                        headers={"Idempotent-Replayed": "true"})
 
-        db.add(user)
-        db.add(coords)
-        db.add(level)
+    try:
+        await images.commit()
+        response = await _create_pereval(db, pereval_data)
+    except Exception:
+        await idempotency_store.abandon(db, idempotency_key)
+        raise
+    # Ошибки сервера не запоминаем — повтор должен выполниться заново
+    if response.status_code >= 500:
+        await idempotency_store.abandon(db, idempotency_key)
+    else:
+        await idempotency_store.complete(db, idempotency_key, fingerprint, response.status_code, response.body)
+    return response
+
+@app.get("/Pereval/provisional/{provisional_id}")
+async def get_provisional_pereval(provisional_id: str, db: AsyncSession = Depends(get_session)):
+    """Id of a pass accepted through the ingest log, once it reached the database."""
+    query = select(PerevalAdded.id).where(PerevalAdded.ingest_key == provisional_id)
+    pereval_id = await db.scalar(query)
+    if pereval_id is None:
+        # Журнал может принадлежать другому воркеру serve.py — is_pending смотрит и его каталог
+        if ingest_log.is_pending(provisional_id):
+            return {"state": "queued", "id": None}
+        # Запись могла уйти в БД между двумя проверками
+        pereval_id = await db.scalar(query)
+    if pereval_id is None:
+        raise HTTPException(status_code=404, detail="Unknown provisional id")
+    return {"state": "committed", "id": pereval_id}
+
+
+async def _read_batch_body(request: Request, images: SpooledImages):
+    """Элементы пакета: JSON-массив или NDJSON (по одному объекту в строке)."""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        # Строка с изображениями в base64 приходит многими чанками: перевод строки ищется
+        # только в новых байтах, иначе длинная строка сканировалась бы заново на каждом чанке
+        buffer = bytearray()
+        async for chunk in request.stream():
+            scanned = len(buffer)
+            buffer += chunk
+            start = 0
+            while (end := buffer.find(b"\n", scanned)) != -1:
+                line = bytes(buffer[start:end])
+                if line.strip():
+                    yield line
+                start = scanned = end + 1
+            del buffer[:start]
+        if buffer.strip():
+            yield bytes(buffer)
+        return
 
-        images = [image_pydantic_to_sqlalchemy(image_data) for image_data in pereval_data.images]
+    try:
+        values = await read_json_spooled(request.stream(), images)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+    if len(values) != 1 or not isinstance(values[0], list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of pereval objects")
+    for raw in values[0]:
+        yield raw
+
+
+@app.post("/Pereval/batch", response_model=BatchResponse)
+async def create_pereval_batch(request: Request, db: AsyncSession = Depends(get_session)) -> BatchResponse:
+    items, errors = [], []
+    images = SpooledImages()
+    try:
+        async for raw in _read_batch_body(request, images):
+            item, error = parse_batch_item(raw)
+            items.append(item)
+            errors.append(error)
+        # В хранилище только изображения элементов, прошедших проверку схемы
+        await images.commit(image.hash for item in items if item is not None for image in item.images)
+    finally:
+        await images.discard()
 
-        for image in images:
-            db.add(image)
+    results = await insert_pereval_batch(db, items, errors)
+    await _after_insert(db, items, results)
 
-        pereval = perevaladded_pydantic_to_sqlalchemy(pereval_data)
+    inserted = sum(1 for r in results if r.status == "ok")
+    return BatchResponse(inserted=inserted, failed=len(results) - inserted, results=results)
 
-        db.add(pereval)
-        await db.commit()
 
-        return pereval
-    except Exception as e:
-        handle_db_error(db)
-        return JSONResponse(status_code=500, content=ErrorResponse.dict())
-    finally:
-        await db.close()
+logger = logging.getLogger(__name__)
+
+async def _pereval_version(db: AsyncSession, cache: ResponseCache, pereval_id: int):
+    """(version, updated_at) of a pass from a shared cache or one primary-key lookup; ``None`` if it does not exist."""
+    # Кэш в памяти процесса не видит сбросов из других воркеров — версия из него могла устареть
+    version_key = pereval_version_key(pereval_id)
+    cached = await cache.get(version_key) if cache.shared else None
+    if cached is not None:
+        version, updated_at = cached.decode().split(" ", 1)
+        return int(version), datetime.fromisoformat(updated_at)
+    row = (await db.execute(
+        select(PerevalAdded.version, PerevalAdded.updated_at).where(PerevalAdded.id == pereval_id)
+    )).first()
+    if row is None:
+        return None
+    if cache.shared:
+        await cache.set(version_key, f"{row.version} {row.updated_at.isoformat()}".encode())
+    return row.version, row.updated_at
+
+
+async def _pereval_body(db: AsyncSession, cache: ResponseCache, pereval_id: int, version: int) -> bytes:
+    """Serialized detail response of the given version, from cache or loaded from the database."""
+    cache_key = pereval_cache_key(pereval_id, version)
+    body = await cache.get(cache_key)
+    if body is None:
+        result = await load_pereval_detail(db, pereval_id, settings.PEREVAL_LOADER)
+
+        if not result:
+            raise HTTPException(status_code=404, detail="Pereval with this ID not found")
 
-def handle_db_error(db):
-    db.rollback()
-    error_height = 42
+        logger.debug(f"Retrieved PerevalAdded object with ID: {result['id']}")
 
-    if not isinstance(error_height, int):
-        raise ValueError("Error: the 'height' value must be an integer")
+        body = dumps(result)
+        await cache.set(cache_key, body)
+    return body
 
-    error_detail = ErrorResponse(
-        detail=[
-            DetailItem(loc="string", msg="Error while saving data", type="server_error", height=error_height)
-        ]
-    )
 
+@app.get("/pereval_id/{pereval_id}", response_model=PerevalResponse)
+async def get_pereval_by_id(pereval_id: int, request: Request, db: AsyncSession = Depends(get_read_session),
+                            cache: ResponseCache = Depends(get_response_cache)) -> Response:
+    encoding = negotiate(request.headers.get("accept-encoding"))
+
+    # Для 304 достаточно версии перевала — полная карточка загружается, только если неизвестно,
+    # сжимается ли ответ
+    current = await _pereval_version(db, cache, pereval_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Pereval with this ID not found")
+    version, updated_at = current
+
+    # Сжатые варианты лежат в кэше рядом с исходным ответом и не пересжимаются на каждом попадании;
+    # пустое значение — пометка, что тело меньше порога сжатия и отдаётся как есть.
+    # Версия входит в ключи: тело, загруженное до записи, не попадёт под новый ETag
+    body = compressed = None
+    if encoding is not None:
+        variant_key = pereval_cache_key(pereval_id, version, encoding)
+        compressed = await cache.get(variant_key)
+        if compressed is None:
+            body = await _pereval_body(db, cache, pereval_id, version)
+            compressed = b""
+            if len(body) >= settings.COMPRESSION_MIN_SIZE:
+                compressed = await compress_async(body, encoding, settings.COMPRESSION_THREAD_MIN_SIZE)
+            await cache.set(variant_key, compressed)
+
+    # Суффикс кодировки в ETag — только у действительно сжатого представления
+    etag = make_etag(pereval_id, version, encoding) if compressed else make_etag(pereval_id, version)
+    headers = {"ETag": etag, "Last-Modified": http_date(updated_at), "Cache-Control": "no-cache",
+               "Vary": "Accept-Encoding"}
+    if is_not_modified(request, etag, updated_at):
+        return not_modified_response(headers)
+    if compressed:
+        return compressed_response(compressed, encoding, headers=headers)
+    if body is None:
+        body = await _pereval_body(db, cache, pereval_id, version)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.patch("/pereval/{pereval_id}", response_model=None)
+async def update_pereval_endpoint(pereval_id: int, pereval_data: PerevalUpdatePydantic,
+                                  db: AsyncSession = Depends(get_session)):
+    """Edit a pass while it is still ``new``; user data cannot be changed."""
+    try:
+        failure = await update_pereval(db, pereval_id, pereval_data)
+    except ValueError as e:
+        await db.rollback()
+        error = ErrorResponse(error_code="invalid_data", additional_message="Invalid pereval data",
+                              more_details=str(e))
+        return JSONResponse(status_code=400, content=error.model_dump())
+    if failure == "not_found":
+        raise HTTPException(status_code=404, detail="Pereval not found")
+    if failure == "not_editable":
+        error = ErrorResponse(error_code="not_editable", additional_message="Only new passes can be edited",
+                              more_details=f"Pereval {pereval_id} is already under moderation")
+        return JSONResponse(status_code=409, content=error.model_dump())
+
+    await invalidate_pereval(pereval_id)
+    if pereval_data.coords is not None:
+        spatial_index.reset()
+    if any(getattr(pereval_data, field) is not None for field in TITLE_FIELDS):
+        search_index.add(pereval_id, await db.scalar(
+            select(PerevalAdded.search_text).where(PerevalAdded.id == pereval_id)
+        ))
+    if pereval_data.images is not None and image_pipeline.enabled:
+        image_pipeline.submit(await db.scalars(
+            select(Image.id).where(Image.pereval_id == pereval_id, Image.status == "pending")
+        ))
+    return {"status": 200, "message": None, "id": pereval_id}
+
+
+@app.get("/pereval", response_model=PerevalListResponse)
+async def list_pereval(
+    after: Optional[int] = Query(None, description="Cursor: id of the last item of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    email: Optional[str] = None,
+    season: Optional[Literal["winter", "summer", "autumn", "spring"]] = None,
+    difficulty: Optional[str] = None,
+    min_height: Optional[int] = None,
+    max_height: Optional[int] = None,
+    status: Optional[Literal["new", "pending", "accepted", "rejected"]] = None,
+    db: AsyncSession = Depends(get_read_session),
+) -> PerevalListResponse:
+    if difficulty is not None and season is None:
+        raise HTTPException(status_code=400, detail="'difficulty' filter requires 'season'")
+    if season is not None and difficulty is None:
+        raise HTTPException(status_code=400, detail="'season' filter requires 'difficulty'")
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    items = await list_perevals(db, selected_fields, limit, after=after, email=email, season=season,
+                                difficulty=difficulty, min_height=min_height, max_height=max_height,
+                                status=status)
+    next_cursor = items[-1]["id"] if len(items) == limit else None
+    # Строки собраны из БД — повторная валидация через PerevalListResponse не нужна
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor})
+
+
+async def _stream_user_items(user_id: int, fields, ndjson: bool, primary: bool):
+    # Свою сессию держим до конца выдачи: курсор живёт дольше обработчика запроса
+    async with replica_router.session(primary) as db:
+        first = True
+        if not ndjson:
+            yield b"["
+        async for item in stream_perevals(db, fields, user_id=user_id):
+            if ndjson:
+                yield dumps(item) + b"\n"
+            else:
+                yield dumps(item) if first else b"," + dumps(item)
+            first = False
+        if not ndjson:
+            yield b"]"
+
+
+@app.get("/users/{email}/pereval", response_model=List[Dict[str, Any]])
+async def list_user_pereval(
+    email: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    db: AsyncSession = Depends(get_read_session),
+):
+    """All passes submitted by a user, streamed as a JSON array or NDJSON (``Accept: application/x-ndjson``)."""
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    user_id = await db.scalar(select(User.id).where(User.email == email))
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    ndjson = "ndjson" in request.headers.get("accept", "")
+    return StreamingResponse(_stream_user_items(user_id, selected_fields, ndjson, reads_from_primary(request)),
+                             media_type="application/x-ndjson" if ndjson else "application/json")
+
+
+@app.get("/pereval/bbox", response_model=List[PerevalGeoItem])
+async def pereval_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_read_session),
+) -> List[PerevalGeoItem]:
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="Bounding box minimum must not exceed maximum")
+    rows = await find_in_bbox(db, min_lat, min_lon, max_lat, max_lon, limit)
+    return [PerevalGeoItem(id=row.id, title=row.title, latitude=row.latitude, longitude=row.longitude,
+                           height=row.height) for row in rows]
+
+
+@app.get("/pereval/nearest", response_model=List[PerevalGeoItem])
+async def pereval_nearest(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(20, ge=1, le=200),
+    db: AsyncSession = Depends(get_read_session),
+) -> List[PerevalGeoItem]:
+    ranked = await find_nearest(db, lat, lon, limit)
+    return [PerevalGeoItem(id=row.id, title=row.title, latitude=row.latitude, longitude=row.longitude,
+                           height=row.height, distance_km=round(distance, 3)) for distance, row in ranked]
+
+
+@app.get("/pereval/search", response_model=List[PerevalSearchItem])
+async def pereval_search(
+    q: str = Query(..., min_length=1, max_length=200, description="Pass name, in Cyrillic or Latin"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_session),
+) -> List[PerevalSearchItem]:
+    ranked = await search_perevals(db, q, limit)
+    return [PerevalSearchItem(id=row.id, beauty_title=row.beauty_title, title=row.title,
+                              other_titles=row.other_titles, score=round(score, 4)) for score, row in ranked]
+
+
+@app.get("/export", response_class=StreamingResponse)
+async def export_pereval(
+    request: Request,
+    format: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    compression: Optional[Literal["gzip", "zstd"]] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to export (default: all)"),
+    status: Optional[Literal["new", "pending", "accepted", "rejected"]] = None,
+):
+    """Dump of all passes; images are exported as URLs only."""
+    try:
+        selected_fields = parse_fields(fields) if fields else ALL_FIELDS
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    unavailable = check_available(format, compression)
+    if unavailable:
+        raise HTTPException(status_code=501, detail=unavailable)
+
+    filename = export_filename(format, compression)
+    return StreamingResponse(export_perevals(selected_fields, format, compression, status=status,
+                                             primary=reads_from_primary(request)),
+                             media_type=export_media_type(format, compression),
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.post("/moderation/claim", response_model=PerevalListResponse)
+async def claim_moderation(
+    limit: int = Query(10, ge=1, le=100),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    db: AsyncSession = Depends(get_session),
+) -> PerevalListResponse:
+    """Take the oldest ``new`` passes into moderation (they become ``pending``)."""
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ids = await claim_new(db, limit)
+    await invalidate_pereval(*ids)
+    items = await list_perevals(db, selected_fields, limit, ids=ids) if ids else []
+    return ORJSONResponse({"items": items, "next_cursor": None})
 
-class PerevalResponse(BaseModel):
-    id: int
-    beauty_title: str
-    title: str
-    other_titles: str
-    connect: str
-    user: UserPydantic
-    coords: CoordsPydantic
-    level: LevelPydantic
-    images: List[ImagePydantic]
 
-Session: sessionmaker = sessionmaker(bind=database.engine, class_=AsyncSession)
+@app.post("/moderation/{pereval_id}/decision", response_model=None)
+async def moderation_decision(pereval_id: int, decision: ModerationDecisionPydantic,
+                              db: AsyncSession = Depends(get_session)):
+    if not await decide(db, pereval_id, decision.status):
+        error = ErrorResponse(error_code="not_pending", additional_message="Pereval is not under moderation",
+                              more_details=f"Pereval {pereval_id} is missing or was not claimed")
+        return JSONResponse(status_code=409, content=error.model_dump())
+    await invalidate_pereval(pereval_id)
+    return {"status": 200, "message": None, "id": pereval_id}
 
-logger = logging.getLogger(__name__)
 
-@app.get("/pereval_id/{pereval_id}", response_model=PerevalResponse)
-async def get_pereval_by_id(pereval_id: int) -> PerevalResponse:
-    async with Session() as db:
-        pereval = await db.execute(
-            select(PerevalAdded)
-            .options(
-                selectinload(PerevalAdded.user),
-                selectinload(PerevalAdded.coords),
-                selectinload(PerevalAdded.level),
-                selectinload(PerevalAdded.images)
-            )
-            .filter(PerevalAdded.id == pereval_id)
-        )
-        result = pereval.scalars().first()
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/cache/stats")
+async def cache_stats(cache: ResponseCache = Depends(get_response_cache)):
+    return cache.stats()
 
-        if not result:
-            raise HTTPException(status_code=404, detail="Pereval with this ID not found")
 
-        logger.debug(f"Retrieved PerevalAdded object with ID: {result.id}")
 
-        images_data = []
-        if result.images:
-            images_data = [ImagePydantic(data=image_data['data'], title=image_data['title']) for image_data in result.images]
 
-        logger.debug(f"Constructed images data: {images_data}")
 
-        return PerevalResponse(
-            id=result.id,
-            beauty_title=result.beauty_title,
-            title=result.title,
-            other_titles=result.other_titles,
-            connect=result.connect,
-            user=UserPydantic(email=result.user.email, fam=result.user.fam, name=result.user.name, otc=result.user.otc, phone=result.user.phone),
-            coords=CoordsPydantic(latitude=result.coords.latitude, longitude=result.coords.longitude, height=result.coords.height),
-            level=LevelPydantic(winter=result.level.winter, summer=result.level.summer, autumn=result.level.autumn, spring=result.level.spring),
-            images=images_data
-        )
+async def _upload_chunks(file: UploadFile):
+    while chunk := await file.read(CHUNK_SIZE):
+        yield chunk
 
 
+@app.post("/images", response_model=BlobInfoPydantic)
+async def upload_image(file: UploadFile, blob_store: BlobStore = Depends(get_blob_store)) -> BlobInfoPydantic:
+    blob = await blob_store.write_stream(_upload_chunks(file), mime_type=file.content_type)
+    return BlobInfoPydantic(hash=blob.hash, size=blob.size, mime_type=blob.mime_type)
 
 
+@app.get("/images/{blob_hash}")
+async def get_image(blob_hash: str, request: Request, blob_store: BlobStore = Depends(get_blob_store)):
+    if not is_valid_hash(blob_hash):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # Содержимое адресуется хешем и никогда не меняется — хеш и есть ETag, файл для 304 не нужен
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": make_etag(blob_hash)}
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+
+    blob = await run_in_threadpool(blob_store.stat, blob_hash)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = await run_in_threadpool(blob_store.local_path, blob_hash)
+    if path is not None:
+        # FileResponse отдаёт файл через sendfile и сам обрабатывает Range
+        return FileResponse(path, media_type=blob.mime_type, headers=headers)
+    return StreamingResponse(blob_store.open(blob_hash), media_type=blob.mime_type,
+                             headers={**headers, "Content-Length": str(blob.size)})
+
 
 def custom_openapi():
-    if app.openapi_schema:
-        return app.openapi_schema
-    openapi_schema = get_openapi(
-        title="FastAPI_Project",
-        version="1.0.0",
-        description="This is a fantastic project",
-        routes=app.routes,
-    )
-    app.openapi_schema = openapi_schema
+    if app.openapi_schema is None:
+        app.openapi_schema = build_openapi(app)
     return app.openapi_schema
 
 app.openapi = custom_openapi
 
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json():
+    if os.path.exists(OPENAPI_PATH):
+        return FileResponse(OPENAPI_PATH, media_type="application/json")
+    # Файла нет (локальный запуск без сборки) — схема строится один раз по маршрутам
+    return ORJSONResponse(custom_openapi())
+
 @app.get("/docs", include_in_schema=False, response_class=HTMLResponse)
 async def custom_swagger_ui_html():
+    from fastapi.openapi.docs import get_swagger_ui_html
     return get_swagger_ui_html(openapi_url="/openapi.json", title="docs")
 
 @app.get("/redoc", include_in_schema=False, response_class=HTMLResponse)
 async def redoc_html():
+    from fastapi.openapi.docs import get_redoc_html
     return get_redoc_html(openapi_url="/openapi.json", title="redoc")
 
 
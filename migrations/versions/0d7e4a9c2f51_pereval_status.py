@@ -0,0 +1,35 @@
+"""Moderation status of pereval
+
+Revision ID: 0d7e4a9c2f51
+Revises: f3a96d1b7c40
+Create Date: 2026-10-17 17:20:46.310592
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d7e4a9c2f51'
+down_revision: Union[str, None] = 'f3a96d1b7c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+pereval_status = sa.Enum('new', 'pending', 'accepted', 'rejected', name='pereval_status')
+
+
+def upgrade() -> None:
+    pereval_status.create(op.get_bind(), checkfirst=True)
+    # Все существующие перевалы попадают в очередь модерации
+    op.add_column('pereval', sa.Column('status', pereval_status, server_default=sa.text("'new'"), nullable=False))
+    op.create_index('ix_pereval_status_new', 'pereval', ['id'], unique=False,
+                    postgresql_where=sa.text("status = 'new'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pereval_status_new', table_name='pereval', postgresql_where=sa.text("status = 'new'"))
+    op.drop_column('pereval', 'status')
+    pereval_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,39 @@
+"""Link images to pereval
+
+Revision ID: 3c9e1f7a2b64
+Revises: 311fa143f33d
+Create Date: 2026-10-17 10:12:41.208311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e1f7a2b64'
+down_revision: Union[str, None] = '311fa143f33d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Изображения ссылаются на перевал, а не перевал на одно изображение
+    op.add_column('image', sa.Column('pereval_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('image_pereval_id_fkey', 'image', 'pereval', ['pereval_id'], ['id'])
+    op.execute(
+        'UPDATE image SET pereval_id = pereval.id FROM pereval WHERE pereval.image_id = image.id'
+    )
+    op.drop_constraint('pereval_image_id_fkey', 'pereval', type_='foreignkey')
+    op.drop_column('pereval', 'image_id')
+
+
+def downgrade() -> None:
+    op.add_column('pereval', sa.Column('image_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('pereval_image_id_fkey', 'pereval', 'image', ['image_id'], ['id'])
+    op.execute(
+        'UPDATE pereval SET image_id = image.id FROM image WHERE image.pereval_id = pereval.id'
+    )
+    op.drop_constraint('image_pereval_id_fkey', 'image', type_='foreignkey')
+    op.drop_column('image', 'pereval_id')
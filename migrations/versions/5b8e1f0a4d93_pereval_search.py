@@ -0,0 +1,55 @@
+"""Full-text and trigram search over pereval titles
+
+Revision ID: 5b8e1f0a4d93
+Revises: 0d7e4a9c2f51
+Create Date: 2026-10-17 18:05:12.774310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from pereval.search import search_text
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8e1f0a4d93'
+down_revision: Union[str, None] = '0d7e4a9c2f51'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.add_column('pereval', sa.Column('search_text', sa.String(), nullable=True))
+
+    # Транслитерация делается в Python, поэтому заполняем search_text здесь же
+    pereval = sa.table('pereval', sa.column('id', sa.Integer), sa.column('beauty_title', sa.String),
+                       sa.column('title', sa.String), sa.column('other_titles', sa.String),
+                       sa.column('search_text', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(pereval.c.id, pereval.c.beauty_title, pereval.c.title, pereval.c.other_titles))
+    updates = [{'pereval_id': row.id, 'text': search_text(row.beauty_title, row.title, row.other_titles)}
+               for row in rows]
+    if updates:
+        bind.execute(
+            pereval.update().where(pereval.c.id == sa.bindparam('pereval_id')).values(search_text=sa.bindparam('text')),
+            updates,
+        )
+
+    op.add_column('pereval', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('simple', coalesce(search_text, ''))", persisted=True),
+    ))
+    op.create_index('ix_pereval_search_vector', 'pereval', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_pereval_search_trgm', 'pereval', ['search_text'], unique=False, postgresql_using='gin',
+                    postgresql_ops={'search_text': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pereval_search_trgm', table_name='pereval')
+    op.drop_index('ix_pereval_search_vector', table_name='pereval')
+    op.drop_column('pereval', 'search_vector')
+    op.drop_column('pereval', 'search_text')
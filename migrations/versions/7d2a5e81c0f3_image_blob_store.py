@@ -0,0 +1,80 @@
+"""Move image payloads to blob store
+
+Revision ID: 7d2a5e81c0f3
+Revises: 3c9e1f7a2b64
+Create Date: 2026-10-17 11:02:17.530964
+
+"""
+import base64
+import binascii
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from pereval.blobstore import get_blob_store
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2a5e81c0f3'
+down_revision: Union[str, None] = '3c9e1f7a2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+image = sa.table(
+    'image',
+    sa.column('id', sa.Integer),
+    sa.column('data', sa.String),
+    sa.column('hash', sa.String),
+    sa.column('size', sa.Integer),
+    sa.column('mime_type', sa.String),
+)
+
+
+def _decode(data: str) -> bytes:
+    if data.startswith('data:'):
+        data = data.partition(',')[2]
+    try:
+        return base64.b64decode(data, validate=True)
+    except binascii.Error:
+        return data.encode()
+
+
+def upgrade() -> None:
+    op.add_column('image', sa.Column('hash', sa.String(length=64), nullable=True))
+    op.add_column('image', sa.Column('size', sa.Integer(), nullable=True))
+    op.add_column('image', sa.Column('mime_type', sa.String(), nullable=True))
+
+    # Переносим содержимое в хранилище по одной строке, чтобы не держать все изображения в памяти
+    blob_store = get_blob_store()
+    bind = op.get_bind()
+    image_ids = bind.execute(sa.select(image.c.id).where(image.c.data.isnot(None))).scalars().all()
+    for image_id in image_ids:
+        data = bind.execute(sa.select(image.c.data).where(image.c.id == image_id)).scalar_one()
+        blob = blob_store.put_bytes(_decode(data))
+        bind.execute(
+            image.update().where(image.c.id == image_id)
+            .values(hash=blob.hash, size=blob.size, mime_type=blob.mime_type)
+        )
+
+    op.create_index(op.f('ix_image_hash'), 'image', ['hash'], unique=False)
+    op.drop_column('image', 'data')
+
+
+def downgrade() -> None:
+    op.add_column('image', sa.Column('data', sa.String(), nullable=True))
+
+    blob_store = get_blob_store()
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(image.c.id, image.c.hash).where(image.c.hash.isnot(None))).all()
+    for image_id, blob_hash in rows:
+        if blob_store.stat(blob_hash) is None:
+            continue
+        data = base64.b64encode(b''.join(blob_store.open(blob_hash))).decode()
+        bind.execute(image.update().where(image.c.id == image_id).values(data=data))
+
+    op.drop_index(op.f('ix_image_hash'), table_name='image')
+    op.drop_column('image', 'mime_type')
+    op.drop_column('image', 'size')
+    op.drop_column('image', 'hash')
@@ -0,0 +1,35 @@
+"""Claimable image processing queue
+
+Revision ID: 9e4c2b7d1f60
+Revises: d7a1c58e3f92
+Create Date: 2026-10-17 21:12:40.517306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4c2b7d1f60'
+down_revision: Union[str, None] = 'd7a1c58e3f92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UNPROCESSED = sa.text("status IN ('pending', 'processing')")
+
+
+def upgrade() -> None:
+    # Изображение захватывается воркером (status = 'processing') вместе со временем захвата
+    op.add_column('image', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_image_status_unprocessed', 'image', ['id'], unique=False,
+                    postgresql_where=UNPROCESSED, sqlite_where=UNPROCESSED)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_image_status_unprocessed', table_name='image', postgresql_where=UNPROCESSED,
+                  sqlite_where=UNPROCESSED)
+    # Захваченные, но не обработанные изображения возвращаются в очередь
+    op.execute("UPDATE image SET status = 'pending' WHERE status = 'processing'")
+    op.drop_column('image', 'claimed_at')
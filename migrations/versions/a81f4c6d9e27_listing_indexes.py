@@ -0,0 +1,41 @@
+"""Indexes for pereval listing filters
+
+Revision ID: a81f4c6d9e27
+Revises: 7d2a5e81c0f3
+Create Date: 2026-10-17 12:20:05.114872
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a81f4c6d9e27'
+down_revision: Union[str, None] = '7d2a5e81c0f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_user_email_id', 'user', ['email', 'id'], unique=False)
+    op.create_index('ix_coords_height_id', 'coords', ['height', 'id'], unique=False)
+    op.create_index('ix_level_winter_id', 'level', ['winter', 'id'], unique=False)
+    op.create_index('ix_level_summer_id', 'level', ['summer', 'id'], unique=False)
+    op.create_index('ix_level_autumn_id', 'level', ['autumn', 'id'], unique=False)
+    op.create_index('ix_level_spring_id', 'level', ['spring', 'id'], unique=False)
+    op.create_index('ix_pereval_user_id_id', 'pereval', ['user_id', 'id'], unique=False)
+    op.create_index('ix_pereval_coords_id_id', 'pereval', ['coords_id', 'id'], unique=False)
+    op.create_index('ix_pereval_level_id_id', 'pereval', ['level_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pereval_level_id_id', table_name='pereval')
+    op.drop_index('ix_pereval_coords_id_id', table_name='pereval')
+    op.drop_index('ix_pereval_user_id_id', table_name='pereval')
+    op.drop_index('ix_level_spring_id', table_name='level')
+    op.drop_index('ix_level_autumn_id', table_name='level')
+    op.drop_index('ix_level_summer_id', table_name='level')
+    op.drop_index('ix_level_winter_id', table_name='level')
+    op.drop_index('ix_coords_height_id', table_name='coords')
+    op.drop_index('ix_user_email_id', table_name='user')
@@ -0,0 +1,28 @@
+"""Version and updated_at of pereval for ETags
+
+Revision ID: b2d94e7f1a08
+Revises: 8c3f5a2e6b17
+Create Date: 2026-10-17 19:31:04.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d94e7f1a08'
+down_revision: Union[str, None] = '8c3f5a2e6b17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('pereval', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('pereval', sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('pereval', 'updated_at')
+    op.drop_column('pereval', 'version')
@@ -0,0 +1,41 @@
+"""Numeric coordinates with spatial index
+
+Revision ID: c4b7e2093d15
+Revises: a81f4c6d9e27
+Create Date: 2026-10-17 13:41:52.672019
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4b7e2093d15'
+down_revision: Union[str, None] = 'a81f4c6d9e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Строки вида "45,123" тоже встречаются; нечисловые значения становятся NULL
+_TO_FLOAT = (
+    "CASE WHEN trim(replace({0}, ',', '.')) ~ '^[-+]?[0-9]*\\.?[0-9]+$' "
+    "THEN trim(replace({0}, ',', '.'))::double precision END"
+)
+
+
+def upgrade() -> None:
+    op.alter_column('coords', 'latitude', type_=sa.Float(), existing_type=sa.String(),
+                    postgresql_using=_TO_FLOAT.format('latitude'))
+    op.alter_column('coords', 'longitude', type_=sa.Float(), existing_type=sa.String(),
+                    postgresql_using=_TO_FLOAT.format('longitude'))
+    op.execute('CREATE INDEX ix_coords_point ON coords USING gist (point(longitude, latitude))')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_coords_point', table_name='coords')
+    op.alter_column('coords', 'longitude', type_=sa.String(), existing_type=sa.Float(),
+                    postgresql_using='longitude::text')
+    op.alter_column('coords', 'latitude', type_=sa.String(), existing_type=sa.Float(),
+                    postgresql_using='latitude::text')
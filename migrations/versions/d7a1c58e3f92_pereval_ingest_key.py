@@ -0,0 +1,28 @@
+"""Ingest log key of pereval
+
+Revision ID: d7a1c58e3f92
+Revises: b2d94e7f1a08
+Create Date: 2026-10-17 20:12:47.093318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a1c58e3f92'
+down_revision: Union[str, None] = 'b2d94e7f1a08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('pereval', sa.Column('ingest_key', sa.String(length=64), nullable=True))
+    op.create_unique_constraint('uq_pereval_ingest_key', 'pereval', ['ingest_key'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_pereval_ingest_key', 'pereval', type_='unique')
+    op.drop_column('pereval', 'ingest_key')
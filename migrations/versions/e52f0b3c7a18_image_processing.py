@@ -0,0 +1,47 @@
+"""Image processing status, variants and EXIF position
+
+Revision ID: e52f0b3c7a18
+Revises: c4b7e2093d15
+Create Date: 2026-10-17 15:08:33.904127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e52f0b3c7a18'
+down_revision: Union[str, None] = 'c4b7e2093d15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Существующие изображения получают статус pending и будут обработаны при старте
+    op.add_column('image', sa.Column('status', sa.String(), server_default=sa.text("'pending'"), nullable=False))
+    op.add_column('image', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('image', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('image', sa.Column('thumbnail_hash', sa.String(length=64), nullable=True))
+    op.add_column('image', sa.Column('medium_hash', sa.String(length=64), nullable=True))
+    op.add_column('image', sa.Column('full_hash', sa.String(length=64), nullable=True))
+    op.add_column('image', sa.Column('exif_latitude', sa.Float(), nullable=True))
+    op.add_column('image', sa.Column('exif_longitude', sa.Float(), nullable=True))
+    op.add_column('image', sa.Column('exif_altitude', sa.Float(), nullable=True))
+    op.add_column('image', sa.Column('exif_distance_km', sa.Float(), nullable=True))
+    op.create_index(op.f('ix_image_pereval_id'), 'image', ['pereval_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_image_pereval_id'), table_name='image')
+    op.drop_column('image', 'exif_distance_km')
+    op.drop_column('image', 'exif_altitude')
+    op.drop_column('image', 'exif_longitude')
+    op.drop_column('image', 'exif_latitude')
+    op.drop_column('image', 'full_hash')
+    op.drop_column('image', 'medium_hash')
+    op.drop_column('image', 'thumbnail_hash')
+    op.drop_column('image', 'height')
+    op.drop_column('image', 'width')
+    op.drop_column('image', 'status')
@@ -0,0 +1,66 @@
+"""Unique natural keys for user, coords and level
+
+Revision ID: f3a96d1b7c40
+Revises: e52f0b3c7a18
+Create Date: 2026-10-17 16:42:10.518307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a96d1b7c40'
+down_revision: Union[str, None] = 'e52f0b3c7a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# таблица, внешний ключ в pereval, естественный ключ, совпадают ли NULL в уникальном индексе
+REFERENCE_TABLES = (
+    ('user', 'user_id', ('email',), False),
+    ('coords', 'coords_id', ('latitude', 'longitude', 'height'), False),
+    ('level', 'level_id', ('winter', 'summer', 'autumn', 'spring'), True),
+)
+
+
+def _merge_duplicates(table: str, fk: str, key: Sequence[str], nulls_not_distinct: bool) -> None:
+    """Перевалы переводятся на последнюю строку с тем же ключом, остальные удаляются."""
+    partition = ', '.join(key)
+    # PARTITION BY сводит NULL в одну группу; для индексов, где NULL различны, такие строки не трогаем
+    where = '' if nulls_not_distinct else 'WHERE ' + ' AND '.join(f'{column} IS NOT NULL' for column in key)
+    op.execute(sa.text(f'''
+        CREATE TEMPORARY TABLE dedupe_map AS
+        SELECT id, max(id) OVER (PARTITION BY {partition}) AS keep_id FROM "{table}" {where}
+    '''))
+    op.execute(sa.text(f'''
+        UPDATE pereval SET {fk} = dedupe_map.keep_id
+        FROM dedupe_map
+        WHERE pereval.{fk} = dedupe_map.id AND dedupe_map.id <> dedupe_map.keep_id
+    '''))
+    op.execute(sa.text(f'''
+        DELETE FROM "{table}"
+        WHERE id IN (SELECT id FROM dedupe_map WHERE id <> keep_id)
+    '''))
+    op.execute(sa.text('DROP TABLE dedupe_map'))
+
+
+def upgrade() -> None:
+    for table, fk, key, nulls_not_distinct in REFERENCE_TABLES:
+        _merge_duplicates(table, fk, key, nulls_not_distinct)
+
+    op.drop_index('ix_user_email_id', table_name='user')
+    op.create_index('uq_user_email', 'user', ['email'], unique=True)
+    op.create_index('uq_coords_position', 'coords', ['latitude', 'longitude', 'height'], unique=True)
+    op.create_index('uq_level_seasons', 'level', ['winter', 'summer', 'autumn', 'spring'], unique=True,
+                    postgresql_nulls_not_distinct=True)
+
+
+def downgrade() -> None:
+    # Объединённые строки не восстанавливаются
+    op.drop_index('uq_level_seasons', table_name='level')
+    op.drop_index('uq_coords_position', table_name='coords')
+    op.drop_index('uq_user_email', table_name='user')
+    op.create_index('ix_user_email_id', 'user', ['email', 'id'], unique=False)
@@ -0,0 +1,129 @@
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from pereval.identity import upsert_ids, remember_ids
+from pereval.search import search_text
+from pereval.models import User, Coords, Level, Image, PerevalAdded, PerevalAddedPydantic, ImagePydantic, \
+    BatchItemResult
+from pereval.serializer import user_pydantic_to_sqlalchemy, coords_pydantic_to_sqlalchemy, \
+    level_pydantic_to_sqlalchemy, image_pydantic_to_sqlalchemy
+
+
+def _row(obj) -> dict:
+    """Значения колонок ORM-объекта без первичного ключа и внешних ключей."""
+    return {
+        column.key: getattr(obj, column.key)
+        for column in obj.__table__.columns
+        if not column.primary_key and not column.foreign_keys
+    }
+
+
+def _image_rows(images: List[ImagePydantic]) -> List[dict]:
+    """Rows of images; inline base64 goes to the blob store, so call it off the event loop."""
+    return [_row(image_pydantic_to_sqlalchemy(image)) for image in images]
+
+
+def parse_batch_item(raw) -> Tuple[Optional[PerevalAddedPydantic], Optional[str]]:
+    """Validate one element of a batch; returns (item, None) or (None, error)."""
+    try:
+        if isinstance(raw, (str, bytes)):
+            return PerevalAddedPydantic.model_validate_json(raw), None
+        return PerevalAddedPydantic.model_validate(raw), None
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+async def _insert_returning_ids(db: AsyncSession, model, rows: List[dict]) -> List[int]:
+    if not rows:
+        return []
+    result = await db.scalars(
+        insert(model).returning(model.id, sort_by_parameter_order=True),
+        rows,
+    )
+    return list(result)
+
+
+def _convert_items(items: List[Optional[PerevalAddedPydantic]], errors: List[Optional[str]],
+                   ingest_keys: Optional[List[str]]) -> Tuple[List[Optional[BatchItemResult]], list]:
+    results: List[Optional[BatchItemResult]] = [None] * len(items)
+    rows = []  # (index, user, coords, level, pereval, images)
+
+    for index, (item, error) in enumerate(zip(items, errors)):
+        if item is None:
+            results[index] = BatchItemResult(index=index, status="invalid", error=error)
+            continue
+        try:
+            user = _row(user_pydantic_to_sqlalchemy(item.user))
+            coords = _row(coords_pydantic_to_sqlalchemy(item.coords))
+            level = _row(level_pydantic_to_sqlalchemy(item.level))
+            images = _image_rows(item.images)
+        except ValueError as e:
+            results[index] = BatchItemResult(index=index, status="invalid", error=str(e))
+            continue
+        pereval = {
+            "beauty_title": item.beauty_title,
+            "title": item.title,
+            "other_titles": item.other_titles,
+            "connect": item.connect,
+            "search_text": search_text(item.beauty_title, item.title, item.other_titles),
+        }
+        if ingest_keys is not None:
+            pereval["ingest_key"] = ingest_keys[index]
+        rows.append((index, user, coords, level, pereval, images))
+    return results, rows
+
+
+async def insert_pereval_batch(db: AsyncSession, items: List[Optional[PerevalAddedPydantic]],
+                               errors: List[Optional[str]],
+                               ingest_keys: Optional[List[str]] = None) -> List[BatchItemResult]:
+    """
+    Insert many passes with one multi-row ``INSERT ... RETURNING id`` per table.
+
+    Users, coords and levels are upserted on their natural keys, so repeated
+    submissions reuse existing rows. ``items`` and ``errors`` are parallel
+    lists: an item that failed parsing is ``None`` and carries its error
+    message. Items that fail conversion are reported as ``invalid``; the
+    remaining ones are written in a single transaction, so a database error
+    fails all of them together. ``ingest_keys`` tags rows written from the
+    ingest log (pereval/ingest.py).
+    """
+    # Проверка хешей и запись base64 в хранилище блобов — файловый ввод-вывод, не в цикле событий
+    results, rows = await run_in_threadpool(_convert_items, items, errors, ingest_keys)
+
+    if rows:
+        try:
+            user_ids, new_users = await upsert_ids(db, User, [r[1] for r in rows])
+            coords_ids, new_coords = await upsert_ids(db, Coords, [r[2] for r in rows])
+            level_ids, new_levels = await upsert_ids(db, Level, [r[3] for r in rows])
+
+            pereval_rows = [
+                {**r[4], "user_id": user_id, "coords_id": coords_id, "level_id": level_id}
+                for r, user_id, coords_id, level_id in zip(rows, user_ids, coords_ids, level_ids)
+            ]
+            pereval_ids = await _insert_returning_ids(db, PerevalAdded, pereval_rows)
+
+            image_rows = [
+                {**image, "pereval_id": pereval_id}
+                for r, pereval_id in zip(rows, pereval_ids)
+                for image in r[5]
+            ]
+            if image_rows:
+                await db.execute(insert(Image), image_rows)
+
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            for r in rows:
+                results[r[0]] = BatchItemResult(index=r[0], status="error", error=f"Database error: {e}")
+        else:
+            remember_ids(User, new_users)
+            remember_ids(Coords, new_coords)
+            remember_ids(Level, new_levels)
+            for r, pereval_id in zip(rows, pereval_ids):
+                results[r[0]] = BatchItemResult(index=r[0], status="ok", id=pereval_id)
+
+    return results
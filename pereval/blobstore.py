@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+
+CHUNK_SIZE = 1024 * 1024
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Сигнатуры форматов: (смещение, байты, mime-тип)
+_MAGIC = [
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypavif", "image/avif"),
+]
+
+
+def is_valid_hash(blob_hash: str) -> bool:
+    return bool(_HASH_RE.match(blob_hash))
+
+
+def sniff_mime_type(head: bytes, default: str = "application/octet-stream") -> str:
+    for offset, signature, mime_type in _MAGIC:
+        if head[offset:offset + len(signature)] == signature:
+            return mime_type
+    return default
+
+
+@dataclass
+class BlobInfo:
+    hash: str
+    size: int
+    mime_type: str
+
+
+class BlobStore:
+    """
+    Content-addressed storage for image payloads, keyed by SHA-256.
+
+    Backends implement ``write_stream``, ``stat`` and ``open``; ``local_path``
+    is optional and lets the API hand the file straight to ``FileResponse``.
+    """
+
+    async def write_stream(self, chunks: AsyncIterator[bytes], mime_type: Optional[str] = None) -> BlobInfo:
+        raise NotImplementedError
+
+    def put_bytes(self, data: bytes, mime_type: Optional[str] = None) -> BlobInfo:
+        raise NotImplementedError
+
+    def put_file(self, path: str, blob_hash: str, size: int, mime_type: str) -> BlobInfo:
+        """Take over a temporary file whose SHA-256 the caller computed while writing it."""
+        raise NotImplementedError
+
+    def stat(self, blob_hash: str) -> Optional[BlobInfo]:
+        raise NotImplementedError
+
+    def open(self, blob_hash: str) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def local_path(self, blob_hash: str) -> Optional[str]:
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs live under ``root/ab/cd/<hash>``; identical content is stored once."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def _tempfile(self):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return tempfile.mkstemp(dir=self.tmp_dir)
+
+    def _path(self, blob_hash: str) -> str:
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def _commit(self, tmp_path: str, blob_hash: str) -> None:
+        path = self._path(blob_hash)
+        if os.path.exists(path):
+            # Такой файл уже есть — дедупликация
+            os.unlink(tmp_path)
+            return
+        # Данные — на диск до переименования: после сбоя под именем-хешем не окажется пустого файла
+        fd = os.open(tmp_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        os.replace(tmp_path, path)
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def write_stream(self, chunks: AsyncIterator[bytes], mime_type: Optional[str] = None) -> BlobInfo:
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        fd, tmp_path = self._tempfile()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await run_in_threadpool(f.write, chunk)
+            blob_hash = digest.hexdigest()
+            await run_in_threadpool(self._commit, tmp_path, blob_hash)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return BlobInfo(hash=blob_hash, size=size, mime_type=sniff_mime_type(head, mime_type or "application/octet-stream"))
+
+    def put_bytes(self, data: bytes, mime_type: Optional[str] = None) -> BlobInfo:
+        blob_hash = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self._path(blob_hash)):
+            fd, tmp_path = self._tempfile()
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self._commit(tmp_path, blob_hash)
+        return BlobInfo(hash=blob_hash, size=len(data), mime_type=sniff_mime_type(data[:16], mime_type or "application/octet-stream"))
+
+    def put_file(self, path: str, blob_hash: str, size: int, mime_type: str) -> BlobInfo:
+        if os.path.exists(self._path(blob_hash)):
+            os.unlink(path)
+        else:
+            fd, tmp_path = self._tempfile()
+            os.close(fd)
+            # В пределах одной ФС — переименование, иначе копирование
+            shutil.move(path, tmp_path)
+            self._commit(tmp_path, blob_hash)
+        return BlobInfo(hash=blob_hash, size=size, mime_type=mime_type)
+
+    def stat(self, blob_hash: str) -> Optional[BlobInfo]:
+        if not is_valid_hash(blob_hash):
+            return None
+        path = self._path(blob_hash)
+        try:
+            size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                head = f.read(16)
+        except FileNotFoundError:
+            return None
+        return BlobInfo(hash=blob_hash, size=size, mime_type=sniff_mime_type(head))
+
+    def open(self, blob_hash: str) -> Iterator[bytes]:
+        with open(self._path(blob_hash), "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+    def local_path(self, blob_hash: str) -> Optional[str]:
+        path = self._path(blob_hash)
+        return path if is_valid_hash(blob_hash) and os.path.exists(path) else None
+
+
+blob_store: BlobStore = LocalBlobStore(settings.BLOB_STORAGE_PATH)
+
+
+def get_blob_store() -> BlobStore:
+    return blob_store
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+from config import settings
+
+
+class ResponseCache:
+    """
+    Cache of serialized response bodies (JSON bytes) keyed by string.
+
+    Backends implement ``_get``, ``_set`` and ``_delete``; hit/miss counting is
+    shared here so every backend exposes the same counters. ``shared`` backends
+    are seen by every worker process, so an invalidation reaches all of them.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        await self._set(key, value)
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._delete(keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    async def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    async def _delete(self, keys: Iterable[str]) -> None:
+        raise NotImplementedError
+
+
+class NullCache(ResponseCache):
+    async def _get(self, key: str) -> Optional[bytes]:
+        return None
+
+    async def _set(self, key: str, value: bytes) -> None:
+        pass
+
+    async def _delete(self, keys: Iterable[str]) -> None:
+        pass
+
+
+class LRUCache(ResponseCache):
+    """In-process LRU bounded by total size in bytes, with a per-entry TTL."""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+
+    def _pop(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self.size -= len(key) + len(value)
+
+    async def _get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: bytes) -> None:
+        entry_size = len(key) + len(value)
+        if entry_size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self.size += entry_size
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def _delete(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            if key in self._entries:
+                self._pop(key)
+
+
+class RedisCache(ResponseCache):
+    """
+    Backend for any client with the ``redis.asyncio`` interface
+    (``get``, ``set(..., ex=)``, ``delete``), so a local stand-in can be passed in tests.
+    """
+
+    shared = True
+
+    def __init__(self, client, ttl: float, prefix: str = "pereval-cache:"):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def _get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def _set(self, key: str, value: bytes) -> None:
+        await self.client.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+
+    async def _delete(self, keys: Iterable[str]) -> None:
+        await self.client.delete(*(self.prefix + key for key in keys))
+
+
+def create_response_cache() -> ResponseCache:
+    if settings.CACHE_BACKEND == "redis":
+        import redis.asyncio as redis
+
+        return RedisCache(redis.from_url(settings.REDIS_URL), ttl=settings.CACHE_TTL)
+    if settings.CACHE_BACKEND == "memory":
+        return LRUCache(max_bytes=settings.CACHE_MAX_BYTES, ttl=settings.CACHE_TTL)
+    return NullCache()
+
+
+response_cache: ResponseCache = create_response_cache()
+
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
+
+
+def pereval_cache_key(pereval_id: int, version: int, encoding: Optional[str] = None) -> str:
+    """Key of the detail response of one version; compressed variants are cached next to it."""
+    key = f"pereval:{pereval_id}:v{version}"
+    return f"{key}:{encoding}" if encoding else key
+
+
+def pereval_version_key(pereval_id: int) -> str:
+    """Key of ``b"<version> <updated_at in ISO format>"``, cached for ETag checks in shared backends only."""
+    return f"pereval:{pereval_id}:version"
+
+
+async def invalidate_pereval(*pereval_ids: int) -> None:
+    """Drop the cached versions after the pass or its images were written.
+
+    Detail responses are keyed by version, so responses of older versions are never read again
+    and simply expire.
+    """
+    keys = [pereval_version_key(pereval_id) for pereval_id in pereval_ids]
+    await response_cache.delete(*keys)
+    if settings.DB_REPLICA_URLS:
+        # Читатель на отстающей реплике мог успеть снова положить в кэш старую версию:
+        # повторное удаление через допустимое отставание реплики
+        task = asyncio.create_task(_invalidate_later(keys, settings.DB_REPLICA_MAX_LAG))
+        _delayed_invalidations.add(task)
+        task.add_done_callback(_delayed_invalidations.discard)
+
+
+_delayed_invalidations: Set[asyncio.Task] = set()
+
+
+async def _invalidate_later(keys, delay: float) -> None:
+    await asyncio.sleep(delay)
+    await response_cache.delete(*keys)
@@ -0,0 +1,214 @@
+import csv
+import io
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import Float, Integer
+
+from pereval.lazy import optional_module
+from pereval.listing import SCALAR_FIELDS, RELATION_FIELDS, STREAM_CHUNK_SIZE, stream_perevals
+from pereval.models import PerevalAdded
+from pereval.render import dumps
+from pereval.replicas import replica_router
+
+# parquet доступен только с pyarrow; сам pyarrow загружается при первой выгрузке в parquet
+pa = optional_module("pyarrow")
+pq = optional_module("pyarrow.parquet")
+
+try:
+    import zstandard
+except ImportError:  # без zstandard остаётся только gzip
+    zstandard = None
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COMPRESSIONS = {"gzip": ("application/gzip", "gz"), "zstd": ("application/zstd", "zst")}
+# Группа строк parquet пишется, когда набралось столько строк или байт в Arrow:
+# мелкие группы хуже сжимаются, а метаданные в футере растут с их числом
+PARQUET_ROW_GROUP_ROWS = 100_000
+PARQUET_ROW_GROUP_BYTES = 64 * 1024 * 1024
+
+
+def check_available(export_format: str, compression: Optional[str]) -> Optional[str]:
+    """Error message if the format or compression needs a package that is not installed."""
+    if export_format == "parquet" and pa is None:
+        return "Parquet export requires pyarrow"
+    if compression == "zstd" and zstandard is None:
+        return "zstd compression requires zstandard"
+    return None
+
+
+def export_filename(export_format: str, compression: Optional[str]) -> str:
+    name = f"pereval.{EXPORT_FORMATS[export_format][1]}"
+    return f"{name}.{COMPRESSIONS[compression][1]}" if compression else name
+
+
+def export_media_type(export_format: str, compression: Optional[str]) -> str:
+    return COMPRESSIONS[compression][0] if compression else EXPORT_FORMATS[export_format][0]
+
+
+def _columns(fields: Sequence[str]) -> List[str]:
+    """Flat column names for tabular formats: ``title``, ``user.email``, ``images``..."""
+    columns = [field for field in SCALAR_FIELDS if field in fields]
+    for name, (_, attrs) in RELATION_FIELDS.items():
+        if name in fields:
+            columns += [f"{name}.{attr}" for attr in attrs]
+    if "images" in fields:
+        columns.append("images")
+    return columns
+
+
+def _flatten(item: Dict[str, Any]) -> Dict[str, Any]:
+    row = {}
+    for key, value in item.items():
+        if key == "images":
+            # Изображения — только ссылками, сами файлы не выгружаются
+            row["images"] = [image["url"] for image in value]
+        elif isinstance(value, dict):
+            row.update((f"{key}.{attr}", attr_value) for attr, attr_value in value.items())
+        else:
+            row[key] = value
+    return row
+
+
+async def _ndjson(items: AsyncIterator[Dict[str, Any]], fields: Sequence[str]) -> AsyncIterator[bytes]:
+    chunk = []
+    async for item in items:
+        chunk.append(dumps(item))
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+async def _csv(items: AsyncIterator[Dict[str, Any]], fields: Sequence[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_columns(fields))
+    writer.writeheader()
+    rows = 0
+    async for item in items:
+        row = _flatten(item)
+        if "images" in row:
+            row["images"] = " ".join(row["images"])
+        writer.writerow(row)
+        rows += 1
+        if rows % STREAM_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _arrow_type(column: str):
+    if column == "images":
+        return pa.list_(pa.string())
+    if "." in column:
+        name, attr = column.split(".", 1)
+        sql_type = getattr(RELATION_FIELDS[name][0], attr).type
+    else:
+        sql_type = getattr(PerevalAdded, column).type
+    if isinstance(sql_type, Integer):
+        return pa.int64()
+    if isinstance(sql_type, Float):
+        return pa.float64()
+    return pa.string()
+
+
+class _ParquetSink(io.RawIOBase):
+    """Write-only file that hands out whatever the Parquet writer has produced so far."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def _parquet(items: AsyncIterator[Dict[str, Any]], fields: Sequence[str]) -> AsyncIterator[bytes]:
+    columns = _columns(fields)
+    schema = pa.schema([(column, _arrow_type(column)) for column in columns])
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    # Порции курсора сразу переводятся в колоночный вид Arrow (компактнее словарей)
+    # и копятся до размера группы строк
+    rows, tables, buffered_rows, buffered_bytes = [], [], 0, 0
+    async for item in items:
+        rows.append(_flatten(item))
+        if len(rows) < STREAM_CHUNK_SIZE:
+            continue
+        table = pa.Table.from_pylist(rows, schema=schema)
+        rows = []
+        tables.append(table)
+        buffered_rows += table.num_rows
+        buffered_bytes += table.nbytes
+        if buffered_rows >= PARQUET_ROW_GROUP_ROWS or buffered_bytes >= PARQUET_ROW_GROUP_BYTES:
+            _write_row_group(writer, tables)
+            tables, buffered_rows, buffered_bytes = [], 0, 0
+            yield sink.drain()
+    if rows:
+        tables.append(pa.Table.from_pylist(rows, schema=schema))
+    if tables:
+        _write_row_group(writer, tables)
+    writer.close()
+    yield sink.drain()
+
+
+def _write_row_group(writer, tables: list) -> None:
+    table = pa.concat_tables(tables)
+    writer.write_table(table, row_group_size=table.num_rows)
+
+
+WRITERS = {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet}
+
+
+def _compressor(compression: str):
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 — формат gzip
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+async def export_perevals(fields: Sequence[str], export_format: str, compression: Optional[str] = None,
+                          status: Optional[str] = None, primary: bool = False) -> AsyncIterator[bytes]:
+    """
+    The whole dataset in ``export_format``, produced chunk by chunk from a server-side cursor.
+
+    Memory use does not grow with the number of rows: NDJSON and CSV hold one
+    cursor chunk, Parquet buffers one row group (``PARQUET_ROW_GROUP_ROWS``
+    rows or ``PARQUET_ROW_GROUP_BYTES`` of Arrow data, whichever comes first).
+    The output is compressed on the fly when ``compression`` is given.
+    """
+    # Своя сессия (на реплике, если она есть): выгрузка живёт дольше обработчика запроса
+    async with replica_router.session(primary) as db:
+        chunks = WRITERS[export_format](stream_perevals(db, fields, status=status), fields)
+        if compression is None:
+            async for chunk in chunks:
+                if chunk:
+                    yield chunk
+            return
+
+        compressor = _compressor(compression)
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
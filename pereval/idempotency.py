@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+from config import settings
+from pereval.identity import dialect_insert
+from pereval.models import IdempotencyKey
+from pereval.render import dumps
+
+
+logger = logging.getLogger(__name__)
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: Optional[int]  # None — запрос с этим ключом ещё выполняется
+    body: Optional[bytes]
+    expires_at: datetime
+
+
+def _utcnow() -> datetime:
+    # В БД время хранится без часового пояса, в UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def request_fingerprint(payload) -> str:
+    """SHA-256 of the validated request body, to detect a key reused for a different request."""
+    return hashlib.sha256(dumps(payload.model_dump())).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Responses of completed requests keyed by the client's ``Idempotency-Key``.
+
+    The key is reserved in the table before the write runs, so concurrent
+    retries see it as in progress instead of writing twice. Completed
+    responses are also kept in a per-process LRU, so most retries are
+    answered without touching the database. Expired rows are purged in the
+    background.
+    """
+
+    def __init__(self, ttl: int, cache_size: int, lock_timeout: int, purge_interval: float = 3600.0):
+        self.ttl = timedelta(seconds=ttl)
+        self.lock_timeout = timedelta(seconds=lock_timeout)
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self._cache: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def _cached(self, key: str) -> Optional[StoredResponse]:
+        stored = self._cache.get(key)
+        if stored is None:
+            return None
+        if stored.expires_at <= _utcnow():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return stored
+
+    def _remember(self, key: str, stored: StoredResponse) -> None:
+        self._cache[key] = stored
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def begin(self, db: AsyncSession, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """
+        Reserve ``key`` for this request.
+
+        Returns ``None`` when the caller owns the key and should run the
+        request, otherwise the stored (or still running) request. An expired
+        key, or one whose request was abandoned longer than the lock timeout
+        ago, is taken over.
+        """
+        stored = self._cached(key)
+        if stored is not None:
+            return stored
+
+        now = _utcnow()
+        insert = dialect_insert(db)
+        stmt = insert(IdempotencyKey).values(key=key, fingerprint=fingerprint, created_at=now,
+                                             expires_at=now + self.ttl)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKey.key],
+            set_={"fingerprint": stmt.excluded.fingerprint, "status_code": None, "body": None,
+                  "created_at": stmt.excluded.created_at, "expires_at": stmt.excluded.expires_at},
+            where=(IdempotencyKey.expires_at <= now)
+            | (IdempotencyKey.status_code.is_(None) & (IdempotencyKey.created_at <= now - self.lock_timeout)),
+        ).returning(IdempotencyKey.key)
+        reserved = await db.scalar(stmt)
+        await db.commit()
+        if reserved is not None:
+            return None
+
+        row = (await db.execute(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.body,
+                   IdempotencyKey.expires_at).where(IdempotencyKey.key == key)
+        )).first()
+        if row is None:
+            # Ключ удалили между двумя запросами (истёк или запрос упал) — пробуем занять снова
+            return await self.begin(db, key, fingerprint)
+        stored = StoredResponse(*row)
+        if stored.status_code is not None:
+            self._remember(key, stored)
+        return stored
+
+    async def complete(self, db: AsyncSession, key: str, fingerprint: str, status_code: int, body: bytes) -> None:
+        expires_at = await db.scalar(
+            update(IdempotencyKey).where(IdempotencyKey.key == key)
+            .values(status_code=status_code, body=body)
+            .returning(IdempotencyKey.expires_at)
+        )
+        await db.commit()
+        if expires_at is not None:
+            self._remember(key, StoredResponse(fingerprint, status_code, body, expires_at))
+
+    async def abandon(self, db: AsyncSession, key: str) -> None:
+        """Release the key after a failed request so a retry can run it again."""
+        await db.rollback()
+        await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+        await db.commit()
+
+    async def purge_expired(self) -> int:
+        async with database.Session() as db:
+            result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= _utcnow()))
+            await db.commit()
+        return result.rowcount
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _purge_loop(self) -> None:
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info("Purged %s expired idempotency keys", purged)
+            except Exception:
+                logger.exception("Failed to purge idempotency keys")
+            await asyncio.sleep(self.purge_interval)
+
+
+idempotency_store = IdempotencyStore(settings.IDEMPOTENCY_TTL, settings.IDEMPOTENCY_CACHE_SIZE,
+                                     settings.IDEMPOTENCY_LOCK_TIMEOUT)
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from pereval.models import User, Coords, Level
+
+
+# Ограничение числа строк в одном INSERT (лимит параметров Postgres — 32767)
+UPSERT_CHUNK = 1000
+
+
+class IdentityCache:
+    """LRU of natural key -> (row values, id) for rows that are known to be committed."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._entries: "OrderedDict[tuple, Tuple[dict, int]]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[Tuple[dict, int]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, row: dict, row_id: int) -> None:
+        self._entries[key] = (row, row_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Естественные ключи таблиц-справочников и соответствующие уникальные индексы
+IDENTITY_KEYS = {
+    User: ("email",),
+    Coords: ("latitude", "longitude", "height"),
+    Level: ("winter", "summer", "autumn", "spring"),
+}
+identity_caches = {model: IdentityCache(settings.IDENTITY_CACHE_SIZE) for model in IDENTITY_KEYS}
+
+
+def dialect_insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _sort_key(key: tuple) -> tuple:
+    # NULL (уровень не указан для сезона) сравнивается только с NULL
+    return tuple((value is None, 0 if value is None else value) for value in key)
+
+
+async def _select_ids(db: AsyncSession, model, key_columns: Sequence[str], keys: Sequence[tuple]) -> list:
+    # IS NOT DISTINCT FROM, а не IN: ключ уровня может содержать NULL
+    columns = [getattr(model, column) for column in key_columns]
+    condition = or_(*(and_(*(column.is_not_distinct_from(value) for column, value in zip(columns, key)))
+                      for key in keys))
+    return list(await db.execute(select(model.id, *columns).where(condition)))
+
+
+async def upsert_ids(db: AsyncSession, model, rows: Sequence[dict]) -> Tuple[List[int], List[tuple]]:
+    """
+    Resolve every row to the id of the existing or newly inserted row.
+
+    Uses ``INSERT ... ON CONFLICT (natural key) DO UPDATE ... RETURNING id``
+    for rows not already in the identity cache with the same values; tables
+    whose rows are nothing but the key use ``DO NOTHING`` and select the ids
+    of the rows that already existed. Rows are inserted in key order, so
+    concurrent batches lock shared rows in the same order and cannot
+    deadlock. Returns the ids and the ``(key, row, id)`` entries to put in
+    the cache once the transaction commits — a rolled-back insert must not
+    leave ids behind.
+    """
+    key_columns = IDENTITY_KEYS[model]
+    cache = identity_caches[model]
+    keys = [tuple(row[column] for column in key_columns) for row in rows]
+
+    resolved: Dict[tuple, int] = {}
+    missing: Dict[tuple, dict] = {}
+    for key, row in zip(keys, rows):
+        if key in resolved or key in missing:
+            continue
+        cached = cache.get(key)
+        if cached is not None and cached[0] == row:
+            resolved[key] = cached[1]
+        else:
+            # Одна строка на ключ: ON CONFLICT не может изменить строку дважды за запрос
+            missing[key] = row
+
+    new_entries = []
+    insert = dialect_insert(db)
+    missing_keys = sorted(missing, key=_sort_key)
+    for start in range(0, len(missing_keys), UPSERT_CHUNK):
+        chunk = missing_keys[start:start + UPSERT_CHUNK]
+        stmt = insert(model).values([missing[key] for key in chunk])
+        update_columns = [column for column in missing[chunk[0]] if column not in key_columns]
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={column: stmt.excluded[column] for column in update_columns},
+            )
+        else:
+            # Обновлять нечего: пустой UPDATE только держал бы блокировку строки до конца транзакции
+            stmt = stmt.on_conflict_do_nothing(index_elements=key_columns)
+        returned = list(await db.execute(stmt.returning(model.id, *(getattr(model, column) for column in key_columns))))
+        if len(returned) < len(chunk):
+            returned_keys = {tuple(key) for _, *key in returned}
+            existing = [key for key in chunk if key not in returned_keys]
+            returned += await _select_ids(db, model, key_columns, existing)
+        for row_id, *key in returned:
+            key = tuple(key)
+            resolved[key] = row_id
+            new_entries.append((key, missing[key], row_id))
+
+    return [resolved[key] for key in keys], new_entries
+
+
+def remember_ids(model, entries: Sequence[tuple]) -> None:
+    cache = identity_caches[model]
+    for key, row, row_id in entries:
+        cache.put(key, row, row_id)
@@ -0,0 +1,269 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select, update
+
+import database
+from config import settings
+from pereval.blobstore import get_blob_store
+from pereval.cache import invalidate_pereval
+from pereval.lazy import optional_module
+from pereval.conditional import utcnow, version_bump
+from pereval.models import Image, PerevalAdded, Coords
+from pereval.spatial import haversine_km
+
+# Без Pillow изображения отдаются как есть; сам Pillow нужен только процессам обработки
+PILImage = optional_module("PIL.Image")
+ImageOps = optional_module("PIL.ImageOps")
+features = optional_module("PIL.features")
+
+
+logger = logging.getLogger(__name__)
+
+# Варианты изображения: имя -> максимальная сторона в пикселях
+VARIANTS = {"thumbnail": 320, "medium": 1280, "full": 2560}
+
+GPS_IFD = 0x8825
+
+
+def _rational(value) -> float:
+    return float(value[0]) / float(value[1]) if isinstance(value, tuple) else float(value)
+
+
+def _gps_degrees(values, ref) -> Optional[float]:
+    if not values or len(values) != 3:
+        return None
+    degrees = _rational(values[0]) + _rational(values[1]) / 60 + _rational(values[2]) / 3600
+    return -degrees if ref in ("S", "W") else degrees
+
+
+def _read_gps(picture) -> Dict[str, Optional[float]]:
+    gps = picture.getexif().get_ifd(GPS_IFD)
+    altitude = gps.get(6)
+    if altitude is not None:
+        altitude = _rational(altitude)
+        if gps.get(5) in (1, b"\x01"):
+            altitude = -altitude
+    return {
+        "exif_latitude": _gps_degrees(gps.get(2), gps.get(1)),
+        "exif_longitude": _gps_degrees(gps.get(4), gps.get(3)),
+        "exif_altitude": altitude,
+    }
+
+
+def process_image(source) -> dict:
+    """
+    Decode an image once and encode every variant; runs in a worker process.
+
+    ``source`` is a file path or the raw bytes. Returns the encoded variants
+    and the GPS position from EXIF, if any.
+    """
+    with PILImage.open(source if isinstance(source, str) else io.BytesIO(source)) as picture:
+        gps = _read_gps(picture)
+        picture = ImageOps.exif_transpose(picture)
+        if picture.mode not in ("RGB", "RGBA"):
+            picture = picture.convert("RGB")
+        width, height = picture.size
+
+        webp = features.check("webp")
+        variants = {}
+        for name, max_side in VARIANTS.items():
+            variant = picture.copy()
+            variant.thumbnail((max_side, max_side))
+            buffer = io.BytesIO()
+            if webp:
+                variant.save(buffer, "WEBP", quality=80, method=4)
+            else:
+                variant.convert("RGB").save(buffer, "JPEG", quality=80, optimize=True, progressive=True)
+            variants[name] = buffer.getvalue()
+
+    return {"width": width, "height": height, "variants": variants, **gps}
+
+
+async def _touch_pereval(db, pereval_id: Optional[int]) -> None:
+    # Ссылки на варианты и статус изображения входят в карточку — меняется и её версия
+    if pereval_id is not None:
+        await db.execute(update(PerevalAdded).where(PerevalAdded.id == pereval_id).values(**version_bump()))
+
+
+def pool_share(total: int, index: int, count: int) -> int:
+    """Processes of worker ``index`` when ``total`` are divided between ``count`` workers."""
+    return total // count + (1 if index < total % count else 0)
+
+
+async def claim_images(db, limit: int, image_ids: Optional[Sequence[int]] = None,
+                       stale_after: float = 0) -> List[int]:
+    """
+    Move up to ``limit`` images to ``processing`` and return their ids.
+
+    Candidates are ``pending`` images and ``processing`` ones claimed more
+    than ``stale_after`` seconds ago (their worker died or was recycled).
+    Rows are picked with ``FOR UPDATE SKIP LOCKED``, like the moderation
+    queue, so every image is processed by exactly one web worker.
+    """
+    claimable = Image.status == "pending"
+    if stale_after:
+        claimable = or_(claimable, and_(Image.status == "processing",
+                                        Image.claimed_at < utcnow() - timedelta(seconds=stale_after)))
+    candidates = select(Image.id).where(claimable)
+    if image_ids is not None:
+        candidates = candidates.where(Image.id.in_(image_ids))
+    candidates = candidates.order_by(Image.id).limit(limit).with_for_update(skip_locked=True)
+    ids = list(await db.scalars(
+        update(Image)
+        .where(Image.id.in_(candidates.scalar_subquery()), claimable)
+        .values(status="processing", claimed_at=utcnow())
+        .returning(Image.id)
+    ))
+    await db.commit()
+    return sorted(ids)
+
+
+class ImagePipeline:
+    """
+    Background processing of uploaded images off the request path.
+
+    Image ids are fed through an asyncio queue to consumer tasks that hand
+    decoding and encoding to a process pool, then store the variants in the
+    blob store and update the image row. An image is claimed (``pending`` ->
+    ``processing``) before it is processed, so with several web workers each
+    image is handled once. ``workers`` processes are shared by the whole
+    process group: each web worker gets its part of them, and workers with a
+    part leave the rest of the queue to the sweep that periodically claims
+    ``pending`` images and ``processing`` ones whose claim went stale.
+    """
+
+    def __init__(self, workers: int, index: int = 0, count: int = 1, sweep_interval: float = 30.0,
+                 claim_timeout: float = 600.0):
+        self.total_workers = workers
+        self.workers = pool_share(workers, index, count)
+        self.sweep_interval = sweep_interval
+        self.claim_timeout = claim_timeout
+        # (id, уже захвачено) — изображения из запросов захватываются при выборке из очереди
+        self.queue: "asyncio.Queue[Tuple[int, bool]]" = asyncio.Queue()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def active(self) -> bool:
+        """Images get processed by some worker of the group (not necessarily this one)."""
+        return self.total_workers > 0 and PILImage is not None
+
+    async def start(self) -> None:
+        if PILImage is None:
+            logger.warning("Pillow is not installed, image processing is disabled")
+            return
+        if self.workers <= 0 or self._tasks:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, image_ids: Iterable[int]) -> None:
+        if not self.enabled:
+            return
+        for image_id in image_ids:
+            self.queue.put_nowait((image_id, False))
+
+    async def _sweep(self) -> None:
+        # Захватываем не больше, чем сразу возьмут потребители: иначе захват устареет в очереди
+        while True:
+            if self.queue.empty():
+                try:
+                    async with database.Session() as db:
+                        claimed = await claim_images(db, self.workers, stale_after=self.claim_timeout)
+                except Exception:
+                    logger.exception("Failed to claim pending images")
+                    claimed = []
+                for image_id in claimed:
+                    self.queue.put_nowait((image_id, True))
+                if len(claimed) == self.workers:
+                    # Очередь не пуста — следующая порция после того, как эту разберут
+                    await self.queue.join()
+                    continue
+            await asyncio.sleep(self.sweep_interval)
+
+    async def _consume(self) -> None:
+        while True:
+            image_id, claimed = await self.queue.get()
+            try:
+                if not claimed:
+                    # Изображение мог уже захватить другой воркер; без БД его позже подберёт обход
+                    async with database.Session() as db:
+                        claimed = bool(await claim_images(db, 1, [image_id]))
+                if claimed:
+                    await self._process(image_id)
+            except Exception:
+                logger.exception("Failed to process image %s", image_id)
+                if not claimed:
+                    continue
+                async with database.Session() as db:
+                    pereval_id = await db.scalar(
+                        update(Image).where(Image.id == image_id, Image.status == "processing")
+                        .values(status="failed").returning(Image.pereval_id)
+                    )
+                    await _touch_pereval(db, pereval_id)
+                    await db.commit()
+                if pereval_id is not None:
+                    await invalidate_pereval(pereval_id)
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, image_id: int) -> None:
+        async with database.Session() as db:
+            row = (await db.execute(
+                select(Image.hash, Image.pereval_id, Coords.latitude, Coords.longitude, Coords.height)
+                .select_from(Image)
+                .outerjoin(PerevalAdded, Image.pereval_id == PerevalAdded.id)
+                .outerjoin(Coords, PerevalAdded.coords_id == Coords.id)
+                .where(Image.id == image_id, Image.status == "processing")
+            )).first()
+        if row is None:
+            return
+
+        blob_store = get_blob_store()
+        source = blob_store.local_path(row.hash) or b"".join(blob_store.open(row.hash))
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, process_image, source)
+
+        values = {"status": "ready", "width": result["width"], "height": result["height"],
+                  "exif_latitude": result["exif_latitude"], "exif_longitude": result["exif_longitude"],
+                  "exif_altitude": result["exif_altitude"]}
+        for name, data in result["variants"].items():
+            blob = await loop.run_in_executor(None, blob_store.put_bytes, data)
+            values[f"{name}_hash"] = blob.hash
+
+        # Сверяем координаты из EXIF с координатами перевала
+        if None not in (result["exif_latitude"], result["exif_longitude"], row.latitude, row.longitude):
+            distance = haversine_km(row.latitude, row.longitude, result["exif_latitude"], result["exif_longitude"])
+            values["exif_distance_km"] = distance
+            if distance > settings.IMAGE_EXIF_MISMATCH_KM:
+                logger.warning("Image %s was taken %.1f km away from its pass coordinates", image_id, distance)
+
+        async with database.Session() as db:
+            await db.execute(update(Image).where(Image.id == image_id).values(**values))
+            await _touch_pereval(db, row.pereval_id)
+            await db.commit()
+        if row.pereval_id is not None:
+            await invalidate_pereval(row.pereval_id)
+
+
+image_pipeline = ImagePipeline(settings.IMAGE_WORKERS, settings.WEB_WORKER_INDEX, settings.WEB_WORKER_COUNT,
+                               settings.IMAGE_SWEEP_INTERVAL, settings.IMAGE_CLAIM_TIMEOUT)
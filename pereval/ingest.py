@@ -0,0 +1,459 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import uuid
+import zlib
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+import database
+from config import settings
+from pereval.batch import insert_pereval_batch
+from pereval.metrics import Counter, Gauge, Histogram, COUNT_BUCKETS
+from pereval.models import PerevalAdded, PerevalAddedPydantic, ImagePydantic
+from pereval.render import dumps
+from pereval.serializer import user_pydantic_to_sqlalchemy, coords_pydantic_to_sqlalchemy, \
+    level_pydantic_to_sqlalchemy, image_pydantic_to_sqlalchemy
+
+
+logger = logging.getLogger(__name__)
+
+# Запись в сегменте: длина и CRC32 полезной нагрузки, затем JSON {"seq": ..., "item": ...}
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".log"
+CHECKPOINT_FILE = "checkpoint"
+HEAD_FILE = "head"
+LOG_ID_FILE = "log.id"
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+# Каталоги журналов воркеров serve.py: INGEST_LOG_PATH/worker-<n>
+WORKER_DIR_PREFIX = "worker-"
+RETRY_DELAY = 1.0
+STOP_TIMEOUT = 10.0
+
+
+def prepare_item(item: PerevalAddedPydantic) -> PerevalAddedPydantic:
+    """
+    Validate a pass the way the write path will, before it is acknowledged.
+
+    Inline base64 images are moved to the blob store here, so the log only
+    holds hash references; this is blocking file I/O, call it in a thread
+    pool. Raises ``ValueError`` like the converters.
+    """
+    user_pydantic_to_sqlalchemy(item.user)
+    coords_pydantic_to_sqlalchemy(item.coords)
+    level_pydantic_to_sqlalchemy(item.level)
+    images = [ImagePydantic(title=image.title, hash=image_pydantic_to_sqlalchemy(image).hash) for image in item.images]
+    return item.model_copy(update={"images": images})
+
+
+class IngestLog:
+    """
+    Write-behind ingestion: passes are appended to a local log, acknowledged
+    with a provisional id and group-committed to the database in background.
+
+    Appends are made durable by one ``fsync`` per ``fsync_interval`` window
+    shared by every request that arrived in it. The consumer inserts records
+    in log order in batches and advances a checkpoint; segments behind the
+    checkpoint are deleted. The checkpoint only moves over a contiguous run
+    of committed records, so a crash never skips an acknowledged one. On
+    start, records after the checkpoint are replayed — the unique ``pereval.ingest_key`` makes the replay of a batch
+    that was committed just before a crash a no-op. A batch that keeps
+    failing is split to isolate the offending records, which are moved to a
+    dead-letter file so they do not hold the checkpoint back.
+    """
+
+    def __init__(self, path: str, segment_bytes: int, fsync_interval: float, batch_size: int, batch_wait: float,
+                 max_attempts: int = 5):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.log_id = ""
+        self.on_commit: Optional[Callable[..., Awaitable[None]]] = None
+
+        self._fd: Optional[int] = None
+        self._segment_size = 0
+        self._segments: List[Tuple[int, str]] = []  # (первый seq, путь)
+        self._next_seq = 1
+        self._checkpoint = 0
+        self._done: Set[int] = set()  # завершённые seq за checkpoint, ждущие непрерывности
+        self._unsynced: List[Tuple[int, PerevalAddedPydantic, asyncio.Future]] = []
+        self._retired_fds: List[int] = []  # предыдущие сегменты, ждущие последнего fsync
+        self._sync_task: Optional[asyncio.Task] = None
+        self._queue: "asyncio.Queue[Tuple[int, float, PerevalAddedPydantic]]" = asyncio.Queue()
+        self._pending: Dict[int, float] = {}  # seq -> время записи, ещё не в БД
+        self._consumer: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._consumer is not None
+
+    def ingest_key(self, seq: int) -> str:
+        return f"{self.log_id}-{seq}"
+
+    def is_pending(self, key: str) -> bool:
+        """
+        True while the pass with this provisional id is in a log but not yet
+        in the database. Keys of other workers' logs are resolved from the
+        checkpoint and head files in their directories.
+        """
+        log_id, _, seq = key.rpartition("-")
+        if not seq.isdigit():
+            return False
+        if log_id == self.log_id:
+            return int(seq) in self._pending
+        path = self._sibling_paths().get(log_id)
+        if path is None:
+            return False
+        checkpoint, head = _read_int(os.path.join(path, CHECKPOINT_FILE)), _read_int(os.path.join(path, HEAD_FILE))
+        return checkpoint < int(seq) <= head
+
+    def _sibling_paths(self) -> Dict[str, str]:
+        root, name = os.path.split(os.path.abspath(self.path))
+        if not name.startswith(WORKER_DIR_PREFIX):
+            return {}
+        paths = {}
+        for entry in os.scandir(root):
+            if entry.is_dir() and entry.name.startswith(WORKER_DIR_PREFIX) and entry.path != os.path.abspath(self.path):
+                try:
+                    with open(os.path.join(entry.path, LOG_ID_FILE)) as f:
+                        paths[f.read().strip()] = entry.path
+                except OSError:
+                    continue
+        return paths
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def lag(self) -> float:
+        return time.time() - min(self._pending.values()) if self._pending else 0.0
+
+    # --- запись ---
+
+    def _open_segment(self) -> None:
+        if self._fd is not None:
+            # Хвост старого сегмента ещё не синхронизирован: его fsync и закрытие делает _flush
+            self._retired_fds.append(self._fd)
+        path = os.path.join(self.path, f"{self._next_seq:020d}{SEGMENT_SUFFIX}")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = 0
+        self._segments.append((self._next_seq, path))
+        _fsync_dir(self.path)
+
+    async def append(self, item: PerevalAddedPydantic) -> str:
+        """Durably append a pass and return its provisional id once the log is fsynced."""
+        seq = self._next_seq
+        self._next_seq += 1
+        payload = dumps({"seq": seq, "item": item.model_dump()})
+        if self._segment_size >= self.segment_bytes:
+            self._open_segment()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        try:
+            os.write(self._fd, record)
+        except OSError:
+            # Запись не попала в журнал и не подтверждена: checkpoint не должен её ждать
+            self._done.add(seq)
+            raise
+        self._segment_size += len(record)
+
+        # В очередь запись ставит _sync после fsync: отмена запроса на ожидании не оставит пропуска в seq
+        future = asyncio.get_running_loop().create_future()
+        self._unsynced.append((seq, item, future))
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync())
+        await future
+        return self.ingest_key(seq)
+
+    async def _sync(self) -> None:
+        # Окно группового fsync: все записи, пришедшие за интервал, ждут одного fsync.
+        # fsync не перекрываются: пришедшие во время fsync ждут следующего окна этой же задачи,
+        # поэтому записи подтверждаются и попадают в очередь строго по порядку seq
+        try:
+            while self._unsynced:
+                await asyncio.sleep(self.fsync_interval)
+                waiters, self._unsynced = self._unsynced, []
+                retired, self._retired_fds = self._retired_fds, []
+                started = time.perf_counter()
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self._flush, retired,
+                                                                     self._next_seq - 1)
+                except OSError as e:
+                    # Клиенты получат ошибку; эти записи не подтверждены и не ждут checkpoint
+                    self._done.update(seq for seq, _, _ in waiters)
+                    for _, _, waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                    continue
+                FSYNC_LATENCY.observe(time.perf_counter() - started)
+                now = time.time()
+                for seq, item, waiter in waiters:
+                    self._pending[seq] = now
+                    APPENDED.inc()
+                    self._queue.put_nowait((seq, now, item))
+                    if not waiter.done():
+                        waiter.set_result(None)
+        finally:
+            self._sync_task = None
+
+    def _flush(self, retired: List[int], head: int) -> None:
+        for fd in retired:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        os.fsync(self._fd)
+        # Для запросов статуса из других воркеров; без fsync — после падения head восстанавливается из сегментов
+        _write_atomic(os.path.join(self.path, HEAD_FILE), str(head), durable=False)
+
+    # --- восстановление ---
+
+    def _read_segment(self, path: str) -> List[Tuple[int, dict]]:
+        records = []
+        with open(path, "rb") as segment:
+            data = segment.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            record = json.loads(payload)
+            records.append((record["seq"], record["item"]))
+            offset += RECORD_HEADER.size + length
+        if offset < len(data):
+            # Хвост, недописанный при падении: подтверждения по нему не отправлялись
+            logger.warning("Truncating %s bytes of a torn record in %s", len(data) - offset, path)
+            with open(path, "r+b") as segment:
+                segment.truncate(offset)
+                os.fsync(segment.fileno())
+        return records
+
+    def _recover(self) -> List[Tuple[int, dict]]:
+        os.makedirs(self.path, exist_ok=True)
+        id_path = os.path.join(self.path, LOG_ID_FILE)
+        if not os.path.exists(id_path):
+            _write_atomic(id_path, uuid.uuid4().hex[:12])
+        with open(id_path) as f:
+            self.log_id = f.read().strip()
+        checkpoint_path = os.path.join(self.path, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self._checkpoint = int(f.read().strip() or 0)
+
+        replay = []
+        last_seq = self._checkpoint
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.path, name)
+            self._segments.append((int(name[:-len(SEGMENT_SUFFIX)]), path))
+            for seq, item in self._read_segment(path):
+                last_seq = max(last_seq, seq)
+                if seq > self._checkpoint:
+                    replay.append((seq, item))
+        self._next_seq = last_seq + 1
+        # Пропуски (записи, не попавшие в журнал из-за ошибки) не должны держать checkpoint
+        replayed = {seq for seq, _ in replay}
+        self._done.update(seq for seq in range(self._checkpoint + 1, self._next_seq) if seq not in replayed)
+        _write_atomic(os.path.join(self.path, HEAD_FILE), str(last_seq), durable=False)
+        return replay
+
+    # --- запись в БД ---
+
+    async def start(self, on_commit: Optional[Callable[..., Awaitable[None]]] = None) -> None:
+        if self._consumer is not None:
+            return
+        self.on_commit = on_commit
+        replay = await asyncio.get_running_loop().run_in_executor(None, self._recover)
+        now = time.time()
+        for seq, item in replay:
+            self._pending[seq] = now
+            self._queue.put_nowait((seq, now, PerevalAddedPydantic.model_validate(item)))
+        if replay:
+            logger.info("Replaying %s ingested passes from %s", len(replay), self.path)
+        self._open_segment()
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self) -> None:
+        """Stop after committing everything that is already in the log."""
+        if self._consumer is None:
+            return
+        if self._sync_task is not None:
+            await self._sync_task
+        try:
+            await asyncio.wait_for(self._queue.join(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Незаписанное останется в журнале и будет проиграно при следующем старте
+            logger.warning("Ingest log: stopping with %s passes not committed", self.depth())
+        self._consumer.cancel()
+        await asyncio.gather(self._consumer, return_exceptions=True)
+        self._consumer = None
+        for fd in self._retired_fds + ([self._fd] if self._fd is not None else []):
+            os.close(fd)
+        self._retired_fds = []
+        self._fd = None
+
+    async def _next_batch(self) -> List[Tuple[int, float, PerevalAddedPydantic]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _consume(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._deliver(batch, self.max_attempts)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _deliver(self, batch: List[Tuple[int, float, PerevalAddedPydantic]], attempts: int) -> None:
+        """Commit a batch, splitting it in halves to isolate records that keep failing."""
+        for attempt in range(attempts):
+            error = await self._commit(batch)
+            if error is None:
+                return
+            if attempt + 1 < attempts:
+                await asyncio.sleep(RETRY_DELAY)
+        if len(batch) > 1:
+            # Половины пробуются по разу, пока не останется одна запись — ей снова все попытки
+            middle = len(batch) // 2
+            for half in (batch[:middle], batch[middle:]):
+                await self._deliver(half, self.max_attempts if len(half) == 1 else 1)
+            return
+        seq, _, item = batch[0]
+        logger.error("Ingest log: moving %s to %s after %s attempts: %s",
+                     self.ingest_key(seq), DEAD_LETTER_FILE, attempts, error)
+        await asyncio.get_running_loop().run_in_executor(None, self._dead_letter, seq, item, error)
+        DEAD_LETTERED.inc()
+        await self._finish(batch, committed=False)
+
+    def _dead_letter(self, seq: int, item: PerevalAddedPydantic, error: str) -> None:
+        record = dumps({"ingest_key": self.ingest_key(seq), "error": error, "item": item.model_dump()})
+        with open(os.path.join(self.path, DEAD_LETTER_FILE), "ab") as f:
+            f.write(record + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _committed_keys(self, keys: List[str]) -> Set[str]:
+        # Недоступность БД — не вина записей: ждём без счёта попыток
+        while True:
+            async with database.Session() as db:
+                try:
+                    return set(await db.scalars(
+                        select(PerevalAdded.ingest_key).where(PerevalAdded.ingest_key.in_(keys))
+                    ))
+                except Exception:
+                    logger.exception("Ingest log: database unavailable, retrying")
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def _commit(self, batch: List[Tuple[int, float, PerevalAddedPydantic]]) -> Optional[str]:
+        """Insert the records not yet in the database; returns the error if the insert failed."""
+        keys = [self.ingest_key(seq) for seq, _, _ in batch]
+        done = await self._committed_keys(keys)
+        todo = [(key, entry) for key, entry in zip(keys, batch) if key not in done]
+        items = [entry[2] for _, entry in todo]
+        async with database.Session() as db:
+            results = await insert_pereval_batch(db, items, [None] * len(items),
+                                                 ingest_keys=[key for key, _ in todo])
+            failed = next((r for r in results if r.status == "error"), None)
+            if failed is not None:
+                logger.error("Ingest log: batch insert of %s passes failed: %s", len(items), failed.error)
+                return failed.error
+            for r in results:
+                if r.status != "ok":
+                    # Данные проверены до подтверждения, сюда попадает только то, что стало невалидным позже
+                    logger.error("Ingest log: dropping %s: %s", todo[r.index][0], r.error)
+            if self.on_commit is not None and results:
+                try:
+                    await self.on_commit(db, items, results)
+                except Exception:
+                    # Перевалы уже в БД: сбой кэша или индексов не должен останавливать приём
+                    logger.exception("Ingest log: post-commit hook failed")
+        await self._finish(batch)
+        return None
+
+    async def _finish(self, batch: List[Tuple[int, float, PerevalAddedPydantic]], committed: bool = True) -> None:
+        checkpoint = self._contiguous_checkpoint(seq for seq, _, _ in batch)
+        if checkpoint > self._checkpoint:
+            await asyncio.get_running_loop().run_in_executor(None, self._advance_checkpoint, checkpoint)
+        now = time.time()
+        for seq, appended_at, _ in batch:
+            self._pending.pop(seq, None)
+            if committed:
+                COMMIT_LAG.observe(now - appended_at)
+        if committed:
+            COMMITTED.inc(amount=len(batch))
+            BATCH_SIZE.observe(len(batch))
+
+    def _contiguous_checkpoint(self, committed: Iterable[int]) -> int:
+        """Highest seq up to which every record is committed (or was never acknowledged)."""
+        self._done.update(committed)
+        checkpoint = self._checkpoint
+        while checkpoint + 1 in self._done:
+            checkpoint += 1
+            self._done.discard(checkpoint)
+        return checkpoint
+
+    def _advance_checkpoint(self, seq: int) -> None:
+        self._checkpoint = seq
+        _write_atomic(os.path.join(self.path, CHECKPOINT_FILE), str(seq))
+        # Сегмент удаляется, когда все его записи в БД и он не текущий
+        while len(self._segments) > 1 and self._segments[1][0] - 1 <= seq:
+            _, path = self._segments.pop(0)
+            os.remove(path)
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path: str, content: str, durable: bool = True) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable:
+        _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _read_int(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+ingest_log = IngestLog(settings.INGEST_LOG_PATH, settings.INGEST_SEGMENT_BYTES,
+                       settings.INGEST_FSYNC_INTERVAL_MS / 1000, settings.INGEST_BATCH_SIZE,
+                       settings.INGEST_BATCH_WAIT_MS / 1000, settings.INGEST_MAX_ATTEMPTS)
+
+APPENDED = Counter("ingest_appended_total", "Passes appended to the ingest log")
+COMMITTED = Counter("ingest_committed_total", "Passes from the ingest log committed to the database")
+DEAD_LETTERED = Counter("ingest_dead_lettered_total", "Passes from the ingest log moved to the dead-letter file")
+FSYNC_LATENCY = Histogram("ingest_fsync_seconds", "Duration of a group fsync of the ingest log")
+BATCH_SIZE = Histogram("ingest_batch_size", "Passes per group commit", buckets=COUNT_BUCKETS + (200, 500, 1000))
+COMMIT_LAG = Histogram("ingest_commit_lag_seconds", "Time from append to database commit")
+QUEUE_DEPTH = Gauge("ingest_queue_depth", "Passes in the ingest log not yet committed", callback=ingest_log.depth)
+QUEUE_LAG = Gauge("ingest_queue_lag_seconds", "Age of the oldest uncommitted pass", callback=ingest_log.lag)
@@ -0,0 +1,31 @@
+import importlib
+import importlib.util
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule(ModuleType):
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module: Optional[ModuleType] = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return getattr(self._module, attr)
+
+
+def optional_module(name: str) -> Optional[LazyModule]:
+    """
+    ``name`` imported lazily, or ``None`` when its package is not installed.
+
+    Only the top-level package is looked up here, so the check itself imports
+    nothing; numpy, pyarrow and Pillow are then loaded by the first request
+    that needs them instead of by every worker at startup.
+    """
+    # find_spec("a.b") импортирует "a", поэтому проверяется только пакет верхнего уровня
+    if importlib.util.find_spec(name.partition(".")[0]) is None:
+        return None
+    return LazyModule(name)
@@ -0,0 +1,331 @@
+import math
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+from config import settings
+from pereval.metrics import Counter, pool_pressure
+from pereval.models import ErrorResponse
+
+
+# Служебные пути не ограничиваются: при перегрузке метрики нужны больше всего
+EXEMPT_PATHS = frozenset({"/metrics"})
+UNITS = {"s": 1, "m": 60, "h": 3600}
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+ROUTE_CACHE_SIZE = 10_000
+
+REJECTED = Counter("http_requests_rejected_total", "Requests rejected before reaching a handler", ("reason",))
+
+
+class Limit(NamedTuple):
+    method: str  # "*" — любой метод
+    route: str  # шаблон пути FastAPI или "*" — все маршруты
+    rate: float  # токенов в секунду
+    burst: int
+
+
+class BodyLimit(NamedTuple):
+    method: str
+    route: str
+    max_bytes: int
+
+
+def _parse_target(target: str) -> Tuple[str, str]:
+    method, _, route = target.strip().rpartition(" ")
+    return method.upper() or "*", route
+
+
+def parse_limits(spec: str) -> List[Limit]:
+    """``"POST /Pereval=10/s:50,*=100/m"`` -> limits; the burst defaults to one second's worth of tokens."""
+    limits = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        target, _, value = part.partition("=")
+        rate, _, burst = value.partition(":")
+        count, _, unit = rate.partition("/")
+        method, route = _parse_target(target)
+        per_second = float(count) / UNITS[unit.strip() or "s"]
+        limits.append(Limit(method, route, per_second, int(burst) if burst else max(1, math.ceil(per_second))))
+    return limits
+
+
+def parse_body_limits(spec: str) -> List[BodyLimit]:
+    """``"*=32MB,POST /Pereval/batch=256MB"`` -> body limits; the most specific matching one applies."""
+    limits = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        target, _, size = part.partition("=")
+        size = size.strip().upper()
+        number = size.rstrip("KMGB")
+        method, route = _parse_target(target)
+        limits.append(BodyLimit(method, route, int(float(number) * SIZE_UNITS[size[len(number):]])))
+    # Сначала точные правила: метод и маршрут, затем только маршрут, затем "*"
+    return sorted(limits, key=lambda limit: (limit.route == "*", limit.method == "*"))
+
+
+class Bucket(NamedTuple):
+    key: str
+    rate: float
+    burst: int
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by string.
+
+    ``take`` spends one token from every bucket and returns ``0``, or spends
+    nothing and returns how many seconds remain until all of them have a
+    token again — a request rejected by one limit does not use up the others.
+    """
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        raise NotImplementedError
+
+
+class NullRateLimiter(RateLimiter):
+    async def take(self, buckets: List[Bucket]) -> float:
+        return 0.0
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets of this process only; with several workers each one enforces the limit separately."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        now = time.monotonic()
+        levels = []
+        for bucket in buckets:
+            tokens, updated = self._buckets.pop(bucket.key, (bucket.burst, now))
+            levels.append(min(bucket.burst, tokens + (now - updated) * bucket.rate))
+        # Сначала проверка всех корзин, затем списание: отказ по одной не тратит токены остальных
+        wait = max([(1 - tokens) / bucket.rate for bucket, tokens in zip(buckets, levels) if tokens < 1], default=0.0)
+        for bucket, tokens in zip(buckets, levels):
+            self._buckets[bucket.key] = (tokens - 1 if wait == 0 else tokens, now)
+        # Давно не обращавшиеся клиенты вытесняются; их корзина и так была бы полной
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Buckets shared by all workers, for any client with the ``redis.asyncio``
+    ``eval`` interface. Each request is one atomic script over all of its
+    buckets, using the Redis clock.
+    """
+
+    # ARGV — пары (rate, burst) в порядке KEYS
+    SCRIPT = """
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local levels = {}
+    local wait = 0
+    for i, key in ipairs(KEYS) do
+        local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+        local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        if tokens < 1 then wait = math.max(wait, (1 - tokens) / rate) end
+        levels[i] = tokens
+    end
+    for i, key in ipairs(KEYS) do
+        local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+        local tokens = levels[i]
+        if wait == 0 then tokens = tokens - 1 end
+        redis.call('HSET', key, 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+    return tostring(wait)
+    """
+
+    def __init__(self, client, prefix: str = "pereval-rate:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        if not buckets:
+            return 0.0
+        args = [value for bucket in buckets for value in (bucket.rate, bucket.burst)]
+        keys = [self.prefix + bucket.key for bucket in buckets]
+        return float(await self.client.eval(self.SCRIPT, len(keys), *keys, *args))
+
+
+def create_rate_limiter() -> RateLimiter:
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        import redis.asyncio as redis
+
+        return RedisRateLimiter(redis.from_url(settings.REDIS_URL))
+    if settings.RATE_LIMIT_BACKEND == "memory":
+        return MemoryRateLimiter()
+    return NullRateLimiter()
+
+
+def _reject(status_code: int, error_code: str, message: str, retry_after: float) -> JSONResponse:
+    error = ErrorResponse(error_code=error_code, additional_message=message,
+                          more_details=f"Retry after {retry_after:.1f} s")
+    return JSONResponse(status_code=status_code, content=error.model_dump(),
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+_route_paths: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+
+def _route_path(scope) -> str:
+    # Маршрут ещё не выбран роутером — ищем его сами, чтобы лимит был на шаблон, а не на путь с id;
+    # результат запоминается, чтобы не перебирать все маршруты на каждый запрос
+    key = (scope["method"], scope["path"])
+    path = _route_paths.pop(key, None)
+    if path is None:
+        path = scope["path"]
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                path = route.path
+                break
+    _route_paths[key] = path
+    while len(_route_paths) > ROUTE_CACHE_SIZE:
+        _route_paths.popitem(last=False)
+    return path
+
+
+class RateLimitMiddleware:
+    """ASGI middleware: token-bucket limits per client and route; 429 with ``Retry-After`` when exceeded."""
+
+    def __init__(self, app, limits: List[Limit], limiter: RateLimiter):
+        self.app = app
+        self.limits = limits
+        self.limiter = limiter
+        self.by_route = any(limit.route != "*" for limit in limits)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limits or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # Адрес клиента; за прокси его подставляет uvicorn (--proxy-headers, --forwarded-allow-ips)
+        client = scope["client"][0] if scope.get("client") else "unknown"
+        route = _route_path(scope) if self.by_route else "*"
+        buckets = [
+            Bucket(f"{client}:{limit.method}:{limit.route}", limit.rate, limit.burst)
+            for limit in self.limits
+            if limit.method in ("*", scope["method"]) and limit.route in ("*", route)
+        ]
+        wait = await self.limiter.take(buckets) if buckets else 0.0
+        if wait > 0:
+            REJECTED.inc("rate_limited")
+            response = _reject(429, "rate_limited", "Too many requests", wait)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware: sheds load with 503 and ``Retry-After`` before a request
+    reaches a handler, while too many requests are in flight or the database
+    pool is saturated (average checkout wait or number of waiting checkouts).
+    Requests that are admitted therefore still get a connection in time.
+    """
+
+    def __init__(self, app, max_in_flight: int, max_pool_wait_ms: float, max_pool_waiters: int):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.max_pool_wait = max_pool_wait_ms / 1000
+        self.max_pool_waiters = max_pool_waiters
+        self.in_flight = 0
+
+    def overloaded(self) -> Optional[float]:
+        """Suggested retry delay in seconds when overloaded, otherwise ``None``."""
+        wait = pool_pressure.average_wait()
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return max(wait, 1.0)
+        if self.max_pool_wait and wait >= self.max_pool_wait:
+            return wait
+        if self.max_pool_waiters and pool_pressure.waiters >= self.max_pool_waiters:
+            return max(wait, 1.0)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.overloaded()
+        if retry_after is not None:
+            REJECTED.inc("overloaded")
+            response = _reject(503, "overloaded", "Service is overloaded", retry_after)
+            await response(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware: 413 for request bodies over the limit of their route.
+
+    A declared ``Content-Length`` over the limit is rejected before anything
+    is read; otherwise the body is counted while it streams in and reading
+    stops as soon as the limit is crossed, so an oversized upload is never
+    held in memory.
+    """
+
+    def __init__(self, app, limits: List[BodyLimit]):
+        self.app = app
+        self.limits = limits
+        self.by_route = any(limit.route != "*" for limit in limits)
+
+    def limit_for(self, scope) -> Optional[int]:
+        route = _route_path(scope) if self.by_route else "*"
+        for limit in self.limits:
+            if limit.method in ("*", scope["method"]) and limit.route in ("*", route):
+                return limit.max_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limits:
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.limit_for(scope)
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            error = ErrorResponse(error_code="body_too_large", additional_message="Request body is too large",
+                                  more_details=f"The limit for this endpoint is {max_bytes} bytes")
+            response = JSONResponse(status_code=413, content=error.model_dump())
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Обработчик получит исключение при чтении тела и ответит 413
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,144 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pereval.models import PerevalAdded, User, Coords, Level, Image
+from pereval.render import IMAGE_COLUMNS, image_urls
+
+
+SEASONS = ("winter", "summer", "autumn", "spring")
+
+# Поля, которые можно запросить через ?fields=
+SCALAR_FIELDS = ("id", "beauty_title", "title", "other_titles", "connect", "status")
+RELATION_FIELDS = {
+    "user": (User, ("email", "fam", "name", "otc", "phone")),
+    "coords": (Coords, ("latitude", "longitude", "height")),
+    "level": (Level, SEASONS),
+}
+ALL_FIELDS = SCALAR_FIELDS + tuple(RELATION_FIELDS) + ("images",)
+DEFAULT_FIELDS = SCALAR_FIELDS + ("user", "coords", "level")
+
+# Сколько строк серверный курсор отдаёт за один раз при потоковой выдаче
+STREAM_CHUNK_SIZE = 500
+
+
+def parse_fields(fields: Optional[str]) -> Sequence[str]:
+    if not fields:
+        return DEFAULT_FIELDS
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(requested) - set(ALL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    # id нужен всегда — по нему строится курсор
+    return ["id"] + [field for field in requested if field != "id"]
+
+
+def _listing_query(fields: Sequence[str], email: Optional[str] = None, season: Optional[str] = None,
+                   difficulty: Optional[str] = None, min_height: Optional[int] = None,
+                   max_height: Optional[int] = None, status: Optional[str] = None,
+                   ids: Optional[Sequence[int]] = None):
+    columns = [getattr(PerevalAdded, field) for field in SCALAR_FIELDS if field in fields]
+    for name, (model, attrs) in RELATION_FIELDS.items():
+        if name in fields:
+            columns += [getattr(model, attr).label(f"{name}.{attr}") for attr in attrs]
+
+    query = select(*columns)
+    joined = set()
+
+    def join(name: str):
+        nonlocal query
+        if name not in joined:
+            model = RELATION_FIELDS[name][0]
+            query = query.join(model, getattr(PerevalAdded, f"{name}_id") == model.id)
+            joined.add(name)
+
+    for name in RELATION_FIELDS:
+        if name in fields:
+            join(name)
+    if email is not None:
+        join("user")
+        query = query.where(User.email == email)
+    if difficulty is not None:
+        join("level")
+        query = query.where(getattr(Level, season) == difficulty)
+    if min_height is not None or max_height is not None:
+        join("coords")
+        if min_height is not None:
+            query = query.where(Coords.height >= min_height)
+        if max_height is not None:
+            query = query.where(Coords.height <= max_height)
+    if status is not None:
+        query = query.where(PerevalAdded.status == status)
+    if ids is not None:
+        query = query.where(PerevalAdded.id.in_(ids))
+    return query.order_by(PerevalAdded.id)
+
+
+def _to_items(rows, fields: Sequence[str]) -> List[Dict[str, Any]]:
+    items = []
+    for row in rows:
+        item = {field: row[field] for field in SCALAR_FIELDS if field in fields}
+        for name, (_, attrs) in RELATION_FIELDS.items():
+            if name in fields:
+                item[name] = {attr: row[f"{name}.{attr}"] for attr in attrs}
+        items.append(item)
+    return items
+
+
+async def _attach_images(db: AsyncSession, items: List[Dict[str, Any]]) -> None:
+    images = {item["id"]: [] for item in items}
+    image_rows = await db.execute(
+        select(Image.pereval_id, *(getattr(Image, column) for column in IMAGE_COLUMNS))
+        .where(Image.pereval_id.in_(images))
+        .order_by(Image.id)
+    )
+    for row in image_rows.mappings():
+        images[row["pereval_id"]].append(image_urls({column: row[column] for column in IMAGE_COLUMNS}))
+    for item in items:
+        item["images"] = images[item["id"]]
+
+
+async def list_perevals(db: AsyncSession, fields: Sequence[str], limit: int, after: Optional[int] = None,
+                        email: Optional[str] = None, season: Optional[str] = None,
+                        difficulty: Optional[str] = None, min_height: Optional[int] = None,
+                        max_height: Optional[int] = None, status: Optional[str] = None,
+                        ids: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+    """
+    One page of passes ordered by id, starting after the ``after`` cursor.
+
+    Only the columns of the requested ``fields`` are selected and related
+    tables are joined only when they are projected or filtered on, so a list
+    view stays a single indexed range scan.
+    """
+    query = _listing_query(fields, email=email, season=season, difficulty=difficulty,
+                           min_height=min_height, max_height=max_height, status=status, ids=ids)
+    if after is not None:
+        query = query.where(PerevalAdded.id > after)
+
+    rows = (await db.execute(query.limit(limit))).mappings().all()
+    items = _to_items(rows, fields)
+    if "images" in fields and items:
+        await _attach_images(db, items)
+    return items
+
+
+async def stream_perevals(db: AsyncSession, fields: Sequence[str], user_id: Optional[int] = None,
+                          status: Optional[str] = None,
+                          chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Passes in id order, read through a server-side cursor.
+
+    Rows arrive ``chunk_size`` at a time, so memory stays flat however many
+    passes are read; images are fetched once per chunk.
+    """
+    query = _listing_query(fields, status=status)
+    if user_id is not None:
+        query = query.where(PerevalAdded.user_id == user_id)
+    result = await db.stream(query.execution_options(yield_per=chunk_size))
+    async for rows in result.mappings().partitions():
+        items = _to_items(rows, fields)
+        if "images" in fields:
+            await _attach_images(db, items)
+        for item in items:
+            yield item
@@ -0,0 +1,82 @@
+from typing import Any, Dict, Optional
+
+from sqlalchemy import JSON, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+from pereval.models import PerevalAdded, User, Coords, Level, Image
+from pereval.render import render_pereval, image_urls, PEREVAL_FIELDS, USER_FIELDS, COORDS_FIELDS, LEVEL_FIELDS, \
+    IMAGE_COLUMNS
+
+
+# Стратегии загрузки карточки перевала и число запросов к БД для каждой
+LOADERS = {
+    "selectin": 5,  # pereval + по selectinload на user, coords, level, images
+    "joined": 2,    # pereval JOIN user/coords/level + selectinload images
+    "json_agg": 1,  # один запрос, изображения собираются в JSON на стороне БД
+}
+
+
+async def _load_orm(db: AsyncSession, pereval_id: int, options) -> Optional[Dict[str, Any]]:
+    result = await db.execute(select(PerevalAdded).options(*options).filter(PerevalAdded.id == pereval_id))
+    pereval = result.scalars().first()
+    return render_pereval(pereval) if pereval is not None else None
+
+
+def _images_json(dialect: str):
+    pairs = [item for column in IMAGE_COLUMNS for item in (column, getattr(Image, column))]
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+        return func.json_agg(aggregate_order_by(func.json_build_object(*pairs), Image.id), type_=JSON)
+    return func.json_group_array(func.json_object(*pairs), type_=JSON)
+
+
+async def _load_json_agg(db: AsyncSession, pereval_id: int) -> Optional[Dict[str, Any]]:
+    images = (
+        select(_images_json(db.bind.dialect.name))
+        .where(Image.pereval_id == PerevalAdded.id)
+        .scalar_subquery()
+    )
+    # Только колонки, без ORM-сущностей: identity map ради одного ответа не нужен
+    related = (("user", User, USER_FIELDS), ("coords", Coords, COORDS_FIELDS), ("level", Level, LEVEL_FIELDS))
+    columns = [getattr(PerevalAdded, field) for field in PEREVAL_FIELDS]
+    for name, model, fields in related:
+        columns += [model.id.label(f"{name}.id")] + [getattr(model, field).label(f"{name}.{field}") for field in fields]
+    query = (
+        select(*columns, images.label("images"))
+        .outerjoin(User, PerevalAdded.user_id == User.id)
+        .outerjoin(Coords, PerevalAdded.coords_id == Coords.id)
+        .outerjoin(Level, PerevalAdded.level_id == Level.id)
+        .where(PerevalAdded.id == pereval_id)
+    )
+    row = (await db.execute(query)).mappings().first()
+    if row is None:
+        return None
+
+    data = {field: row[field] for field in PEREVAL_FIELDS}
+    for name, _, fields in related:
+        data[name] = {field: row[f"{name}.{field}"] for field in fields} if row[f"{name}.id"] is not None else None
+    data["images"] = [image_urls(image) for image in row["images"] or []]
+    return data
+
+
+async def load_pereval_detail(db: AsyncSession, pereval_id: int, strategy: str) -> Optional[Dict[str, Any]]:
+    """Load one pass as a response dict using the given ``LOADERS`` strategy."""
+    if strategy == "selectin":
+        return await _load_orm(db, pereval_id, (
+            selectinload(PerevalAdded.user),
+            selectinload(PerevalAdded.coords),
+            selectinload(PerevalAdded.level),
+            selectinload(PerevalAdded.images),
+        ))
+    if strategy == "joined":
+        return await _load_orm(db, pereval_id, (
+            joinedload(PerevalAdded.user),
+            joinedload(PerevalAdded.coords),
+            joinedload(PerevalAdded.level),
+            selectinload(PerevalAdded.images),
+        ))
+    if strategy == "json_agg":
+        return await _load_json_agg(db, pereval_id)
+    raise ValueError(f"Unknown pereval loader: {strategy}")
@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+slow_query_logger = logging.getLogger("pereval.sql.slow")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Minimal Prometheus metric family; values are keyed by the label values tuple."""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self) -> List[str]:
+        if not self.labels and not self._values:
+            return [f"{self.name} 0"]
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """Gauge that is either set/incremented directly or computed by ``callback`` at scrape time."""
+
+    type = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], Optional[float]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self.callback = callback
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def _samples(self) -> List[str]:
+        if self.callback is not None:
+            value = self.callback()
+            return [] if value is None else [f"{self.name} {value}"]
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple, list] = {}  # labels -> [counts по корзинам..., sum, count]
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, data in self._values.items():
+            for bound, count in zip(self.buckets, data):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {data[-1]}")
+        return lines
+
+
+registry: List[Metric] = []
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served")
+QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements executed per request", ("route",),
+                                buckets=COUNT_BUCKETS)
+QUERY_TIME_PER_REQUEST = Histogram("db_query_seconds_per_request", "Total SQL time per request", ("route",))
+QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency")
+SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than the slow-query threshold")
+POOL_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+
+# Пул текущего движка; задаётся в instrument_engine
+_pool = None
+_max_connections = 0
+
+
+def _checked_out() -> Optional[float]:
+    return _pool.checkedout() if _pool is not None and hasattr(_pool, "checkedout") else None
+
+
+def _utilization() -> Optional[float]:
+    checked_out = _checked_out()
+    return checked_out / _max_connections if checked_out is not None and _max_connections else None
+
+
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", callback=_checked_out)
+POOL_UTILIZATION = Gauge("db_pool_utilization", "Checked-out connections as a share of pool size plus overflow",
+                         callback=_utilization)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class PoolPressure:
+    """Checkouts currently waiting for a connection and a time-decayed average of checkout waits."""
+
+    def __init__(self, alpha: float = 0.2, half_life: float = 5.0):
+        self.alpha = alpha
+        self.half_life = half_life
+        self.waiters = 0
+        self._average = 0.0
+        self._updated = time.monotonic()
+
+    def average_wait(self) -> float:
+        # Без новых выдач соединений среднее затухает, иначе после пика оно осталось бы высоким навсегда
+        return self._average * 0.5 ** ((time.monotonic() - self._updated) / self.half_life)
+
+    def observe(self, wait: float) -> None:
+        self._average = self.average_wait() * (1 - self.alpha) + wait * self.alpha
+        self._updated = time.monotonic()
+
+
+pool_pressure = PoolPressure()
+POOL_WAITERS = Gauge("db_pool_waiters", "Checkouts waiting for a pooled connection",
+                     callback=lambda: pool_pressure.waiters)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        pool_pressure.waiters += 1
+        try:
+            return super()._do_get()
+        finally:
+            pool_pressure.waiters -= 1
+            wait = time.perf_counter() - started
+            pool_pressure.observe(wait)
+            POOL_WAIT.observe(wait)
+
+
+def instrument_engine(engine, slow_query_ms: float, max_connections: int, track_pool: bool = True) -> None:
+    """Count and time every statement; log the ones slower than ``slow_query_ms``."""
+    global _pool, _max_connections
+    sync_engine = engine.sync_engine
+    if track_pool:
+        # Пул основной БД; пулы реплик в db_pool_* не попадают
+        _pool = sync_engine.pool
+        _max_connections = max_connections
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        QUERY_LATENCY.observe(elapsed)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_time += elapsed
+        if elapsed * 1000 >= slow_query_ms:
+            SLOW_QUERIES.inc()
+            slow_query_logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency, status counts, in-flight requests and DB usage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stats = RequestStats()
+        token = request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            request_stats.reset(token)
+            # Шаблон пути, а не сам путь — иначе метрики разрастаются по id
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.inc(scope["method"], route, str(status))
+            REQUEST_LATENCY.observe(elapsed, scope["method"], route)
+            QUERIES_PER_REQUEST.observe(stats.queries, route)
+            QUERY_TIME_PER_REQUEST.observe(stats.query_time, route)
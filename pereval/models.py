@@ -1,20 +1,43 @@
-from sqlalchemy import Column, String, Integer, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, Index, Enum, DateTime, LargeBinary, \
+    UniqueConstraint, Computed, DDL, event, func, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.sql.functions import FunctionElement
 
 
 from pydantic import BaseModel, conint, Field
-from typing import List, Union, Optional
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Literal, Union, Optional
 
 from database import Base
 
 
 class ImagePydantic(BaseModel):
-    data: str
+    # Либо ссылка на уже загруженный файл (POST /images), либо base64 в data
     title: str
+    hash: Optional[str] = None
+    data: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class ImageRefPydantic(BaseModel):
+    title: str
+    hash: str
+    size: int
+    mime_type: str
+    # pending — варианты ещё готовятся, url указывает на оригинал
+    status: str
+    url: str
+    thumbnail_url: Optional[str] = None
+    full_url: str
+
+class BlobInfoPydantic(BaseModel):
+    hash: str
+    size: int
+    mime_type: str
+
 class LevelPydantic(BaseModel):
     winter: str
     summer: str
@@ -22,8 +45,8 @@ class LevelPydantic(BaseModel):
     spring: str
 
 class CoordsPydantic(BaseModel):
-    latitude: str
-    longitude: str
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
     height: int
 
 class UserPydantic(BaseModel):
@@ -44,11 +67,71 @@ class PerevalAddedPydantic(BaseModel):
     images: List[ImagePydantic]
 
 
+class PerevalResponse(BaseModel):
+    id: int
+    beauty_title: str
+    title: str
+    other_titles: str
+    connect: str
+    user: UserPydantic
+    coords: CoordsPydantic
+    level: LevelPydantic
+    images: List[ImageRefPydantic]
+    status: str
+
+
+class PerevalUpdatePydantic(BaseModel):
+    """Editable part of a pass; user data cannot be changed."""
+    beauty_title: Optional[str] = None
+    title: Optional[str] = None
+    other_titles: Optional[str] = None
+    connect: Optional[str] = None
+    coords: Optional[CoordsPydantic] = None
+    level: Optional[LevelPydantic] = None
+    images: Optional[List[ImagePydantic]] = None
+
+
+class ModerationDecisionPydantic(BaseModel):
+    # new возвращает перевал в очередь
+    status: Literal["accepted", "rejected", "new"]
+
+
 class DetailItem(BaseModel):
     loc: str
     msg: str
     type: str
 
+class BatchItemResult(BaseModel):
+    index: int
+    # ok, invalid (ошибка в данных) или error (ошибка записи в БД)
+    status: str
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BatchItemResult]
+
+class PerevalGeoItem(BaseModel):
+    id: int
+    title: Optional[str] = None
+    latitude: float
+    longitude: float
+    height: Optional[int] = None
+    distance_km: Optional[float] = None
+
+class PerevalSearchItem(BaseModel):
+    id: int
+    beauty_title: Optional[str] = None
+    title: Optional[str] = None
+    other_titles: Optional[str] = None
+    score: float
+
+class PerevalListResponse(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[int] = None
+
 class ErrorResponse(BaseModel):
     error_code: str = Field(..., description="Error code")
     additional_message: str = Field(..., description="Additional error message")
@@ -57,6 +140,9 @@ class ErrorResponse(BaseModel):
 
 class User(Base):
     __tablename__ = 'user'
+    __table_args__ = (
+        Index('uq_user_email', 'email', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     email = Column(String)
     fam = Column(String)
@@ -67,12 +153,28 @@ class User(Base):
 class Coords(Base):
     __tablename__ = 'coords'
     id = Column(Integer, primary_key=True)
-    latitude = Column(String)
-    longitude = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
     height = Column(Integer)
 
+    __table_args__ = (
+        Index('uq_coords_position', 'latitude', 'longitude', 'height', unique=True),
+        Index('ix_coords_height_id', 'height', 'id'),
+        # GiST по встроенному типу point — bbox (<@) и ближайшие (<->) без PostGIS
+        Index('ix_coords_point', func.point(longitude, latitude), postgresql_using='gist').ddl_if(dialect='postgresql'),
+    )
+
 class Level(Base):
     __tablename__ = 'level'
+    __table_args__ = (
+        # Уровень может быть указан не для всех сезонов; NULL должен совпадать с NULL
+        Index('uq_level_seasons', 'winter', 'summer', 'autumn', 'spring', unique=True,
+              postgresql_nulls_not_distinct=True),
+        Index('ix_level_winter_id', 'winter', 'id'),
+        Index('ix_level_summer_id', 'summer', 'id'),
+        Index('ix_level_autumn_id', 'autumn', 'id'),
+        Index('ix_level_spring_id', 'spring', 'id'),
+    )
     id = Column(Integer, primary_key=True)
     winter = Column(String)
     summer = Column(String)
@@ -81,17 +183,86 @@ class Level(Base):
 
 class Image(Base):
     __tablename__ = 'image'
+    __table_args__ = (
+        # Очередь обработки: в индексе только необработанные изображения
+        Index('ix_image_status_unprocessed', 'id', postgresql_where=text("status IN ('pending', 'processing')"),
+              sqlite_where=text("status IN ('pending', 'processing')")),
+    )
     id = Column(Integer, primary_key=True)
-    data = Column(String)
     title = Column(String)
+    hash = Column(String(64), index=True)
+    size = Column(Integer)
+    mime_type = Column(String)
+    pereval_id = Column(Integer, ForeignKey('pereval.id'), index=True)
+
+    # Результат фоновой обработки (pereval/imaging.py)
+    # pending -> processing (захвачено воркером, claimed_at) -> ready / failed
+    status = Column(String, nullable=False, default='pending', server_default=text("'pending'"))
+    claimed_at = Column(DateTime)
+    width = Column(Integer)
+    height = Column(Integer)
+    thumbnail_hash = Column(String(64))
+    medium_hash = Column(String(64))
+    full_hash = Column(String(64))
+    exif_latitude = Column(Float)
+    exif_longitude = Column(Float)
+    exif_altitude = Column(Float)
+    exif_distance_km = Column(Float)
+
+class SearchDocument(FunctionElement):
+    """Expression of ``pereval.search_vector``: a tsvector on Postgres, the plain text elsewhere."""
+    type = String()
+    name = "search_document"
+    inherit_cache = True
+
+
+@compiles(SearchDocument)
+def _search_document(element, compiler, **kw):
+    return "coalesce(search_text, '')"
+
+
+@compiles(SearchDocument, "postgresql")
+def _search_document_postgresql(element, compiler, **kw):
+    return "to_tsvector('simple', coalesce(search_text, ''))"
+
+
+# Статусы модерации: new -> pending (взят модератором) -> accepted / rejected
+PEREVAL_STATUSES = ("new", "pending", "accepted", "rejected")
+
 
 class PerevalAdded(Base):
     __tablename__ = 'pereval'
+    __table_args__ = (
+        Index('ix_pereval_user_id_id', 'user_id', 'id'),
+        Index('ix_pereval_coords_id_id', 'coords_id', 'id'),
+        Index('ix_pereval_level_id_id', 'level_id', 'id'),
+        # Очередь модерации: в индексе только новые перевалы, он остаётся маленьким
+        Index('ix_pereval_status_new', 'id', postgresql_where=text("status = 'new'"),
+              sqlite_where=text("status = 'new'")),
+        # Полнотекстовый и нечёткий (pg_trgm) поиск по названиям; расширение создаётся перед таблицей
+        Index('ix_pereval_search_vector', 'search_vector', postgresql_using='gin').ddl_if(dialect='postgresql'),
+        Index('ix_pereval_search_trgm', 'search_text', postgresql_using='gin',
+              postgresql_ops={'search_text': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        UniqueConstraint('ingest_key', name='uq_pereval_ingest_key'),
+    )
     id = Column(Integer, primary_key=True)
     beauty_title = Column(String)
     title = Column(String)
     other_titles = Column(String)
     connect = Column(String)
+    # Нормализованные и транслитерированные названия (pereval/search.py)
+    search_text = Column(String)
+    # Генерируется БД из search_text; в карточку не входит, поэтому не загружается вместе с объектом
+    search_vector = deferred(Column(String().with_variant(TSVECTOR(), 'postgresql'),
+                                    Computed(SearchDocument(), persisted=True)))
+    status = Column(Enum(*PEREVAL_STATUSES, name='pereval_status'), nullable=False, default='new',
+                    server_default=text("'new'"))
+    # Растёт при каждом изменении карточки перевала (правка, модерация, обработка фото) — основа ETag
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))
+    updated_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None),
+                        server_default=func.now())
+    # Временный id записи из журнала приёма (pereval/ingest.py); уникален, повторное проигрывание не дублирует
+    ingest_key = Column(String(64))
 
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship("User")
@@ -103,4 +274,18 @@ class PerevalAdded(Base):
     level = relationship("Level")
 
     images = relationship("Image", backref="pereval")
-    image_id = Column(Integer, ForeignKey('image.id'))
+
+
+event.listen(PerevalAdded.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+class IdempotencyKey(Base):
+    """Response stored for a client ``Idempotency-Key``; ``status_code`` is NULL while the request runs."""
+    __tablename__ = 'idempotency_key'
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,107 @@
+from typing import List, Optional
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from pereval.batch import _row, _image_rows
+from pereval.conditional import version_bump
+from pereval.identity import upsert_ids, remember_ids
+from pereval.search import search_text
+from pereval.models import PerevalAdded, Coords, Level, Image, PerevalUpdatePydantic
+from pereval.serializer import coords_pydantic_to_sqlalchemy, level_pydantic_to_sqlalchemy
+
+
+EDITABLE_FIELDS = ("beauty_title", "title", "other_titles", "connect")
+TITLE_FIELDS = ("beauty_title", "title", "other_titles")
+
+
+async def update_pereval(db: AsyncSession, pereval_id: int, data: PerevalUpdatePydantic) -> Optional[str]:
+    """
+    Apply an edit to a pass that is still ``new``.
+
+    Returns ``None`` on success, ``"not_found"`` or ``"not_editable"``
+    otherwise. The status check and the update are one conditional
+    ``UPDATE``, so an edit cannot slip in after a moderator claimed the pass.
+    Conversion errors raise ``ValueError`` before anything is written.
+    """
+    values = {field: getattr(data, field) for field in EDITABLE_FIELDS if getattr(data, field) is not None}
+    if any(field in values for field in TITLE_FIELDS):
+        current = (await db.execute(
+            select(*(getattr(PerevalAdded, field) for field in TITLE_FIELDS)).where(PerevalAdded.id == pereval_id)
+        )).first()
+        if current is not None:
+            titles = {**current._asdict(), **values}
+            values["search_text"] = search_text(*(titles[field] for field in TITLE_FIELDS))
+    coords = _row(coords_pydantic_to_sqlalchemy(data.coords)) if data.coords is not None else None
+    level = _row(level_pydantic_to_sqlalchemy(data.level)) if data.level is not None else None
+    # Изображения проверяются и сохраняются в хранилище блобов в пуле потоков
+    images = await run_in_threadpool(_image_rows, data.images) if data.images is not None else None
+
+    new_coords = new_levels = []
+    if coords is not None:
+        [values["coords_id"]], new_coords = await upsert_ids(db, Coords, [coords])
+    if level is not None:
+        [values["level_id"]], new_levels = await upsert_ids(db, Level, [level])
+
+    if values or images is not None:
+        values.update(version_bump())
+    else:
+        values["status"] = "new"  # пустая правка: только проверка статуса
+    updated = await db.scalar(
+        update(PerevalAdded)
+        .where(PerevalAdded.id == pereval_id, PerevalAdded.status == "new")
+        .values(**values)
+        .returning(PerevalAdded.id)
+    )
+    if updated is None:
+        await db.rollback()
+        exists = await db.scalar(select(PerevalAdded.id).where(PerevalAdded.id == pereval_id))
+        return "not_found" if exists is None else "not_editable"
+
+    if images is not None:
+        # Сами файлы остаются в хранилище: оно адресуется по содержимому
+        await db.execute(delete(Image).where(Image.pereval_id == pereval_id))
+        if images:
+            await db.execute(insert(Image), [{**image, "pereval_id": pereval_id} for image in images])
+    await db.commit()
+    remember_ids(Coords, new_coords)
+    remember_ids(Level, new_levels)
+    return None
+
+
+async def claim_new(db: AsyncSession, limit: int) -> List[int]:
+    """
+    Move up to ``limit`` of the oldest ``new`` passes to ``pending`` and return their ids.
+
+    Rows are picked with ``FOR UPDATE SKIP LOCKED`` over the partial index on
+    ``status = 'new'``, so concurrent moderators each get a different set of
+    passes without waiting on one another.
+    """
+    candidates = (
+        select(PerevalAdded.id)
+        .where(PerevalAdded.status == "new")
+        .order_by(PerevalAdded.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    ids = list(await db.scalars(
+        update(PerevalAdded)
+        .where(PerevalAdded.id.in_(candidates.scalar_subquery()))
+        .values(status="pending", **version_bump())
+        .returning(PerevalAdded.id)
+    ))
+    await db.commit()
+    return sorted(ids)
+
+
+async def decide(db: AsyncSession, pereval_id: int, status: str) -> bool:
+    """Finish moderation of a claimed pass; ``False`` if it is not ``pending``."""
+    updated = await db.scalar(
+        update(PerevalAdded)
+        .where(PerevalAdded.id == pereval_id, PerevalAdded.status == "pending")
+        .values(status=status, **version_bump())
+        .returning(PerevalAdded.id)
+    )
+    await db.commit()
+    return updated is not None
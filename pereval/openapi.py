@@ -0,0 +1,61 @@
+"""
+Build-time OpenAPI schema.
+
+    python -m pereval.openapi
+
+writes ``static/openapi.json``. GET /openapi.json serves that file as is,
+so workers never walk the routes to build the schema. Run it as part of
+the build, after any change to routes or models; without the file the
+schema is built from the routes on the first request.
+"""
+import os
+from typing import Any, Dict, List, Type
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from pereval.render import dumps
+
+OPENAPI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "openapi.json")
+REF_TEMPLATE = "#/components/schemas/{model}"
+
+# Модели тел, которые обработчик читает сам (потоково), а не через параметр FastAPI
+_body_models: List[Type[BaseModel]] = []
+
+
+def request_body(model: Type[BaseModel]) -> Dict[str, Any]:
+    """``openapi_extra`` documenting ``model`` as the JSON body of a handler that parses the body itself."""
+    _body_models.append(model)
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"$ref": REF_TEMPLATE.format(model=model.__name__)}}
+    }}}
+
+
+def build_openapi(app: FastAPI) -> dict:
+    # fastapi.openapi.utils тянет весь генератор схем — только при сборке или без готового файла
+    from fastapi.openapi.utils import get_openapi
+    schema = get_openapi(
+        title="FastAPI_Project",
+        version="1.0.0",
+        description="This is a fantastic project",
+        routes=app.routes,
+    )
+    schemas = schema.setdefault("components", {}).setdefault("schemas", {})
+    for model in _body_models:
+        model_schema = model.model_json_schema(ref_template=REF_TEMPLATE)
+        schemas.update(model_schema.pop("$defs", {}))
+        schemas[model.__name__] = model_schema
+    return schema
+
+
+def write_openapi(app: FastAPI, path: str = OPENAPI_PATH) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(build_openapi(app)))
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    from main import app
+    write_openapi(app)
+    print(f"OpenAPI schema written to {OPENAPI_PATH}")
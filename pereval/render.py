@@ -0,0 +1,77 @@
+import json
+from operator import attrgetter
+from typing import Any, Callable, Dict, Sequence
+
+from starlette.responses import JSONResponse
+
+from pereval.models import UserPydantic, CoordsPydantic, LevelPydantic, PerevalResponse
+
+try:
+    import orjson
+except ImportError:  # без orjson работает медленнее, но так же
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _compile(fields: Sequence[str]) -> Callable[[Any], Dict[str, Any]]:
+    """Build a serializer that reads ``fields`` from an ORM object or Row in one attrgetter call."""
+    fields = tuple(fields)
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda obj: {fields[0]: getter(obj)}
+    return lambda obj: dict(zip(fields, getter(obj)))
+
+
+# Поля берутся из Pydantic-схем ответа, поэтому формат JSON совпадает с PerevalResponse;
+# вложенные объекты собираются отдельно
+PEREVAL_RELATIONS = ("user", "coords", "level", "images")
+PEREVAL_FIELDS = tuple(name for name in PerevalResponse.model_fields if name not in PEREVAL_RELATIONS)
+USER_FIELDS = tuple(UserPydantic.model_fields)
+COORDS_FIELDS = tuple(CoordsPydantic.model_fields)
+LEVEL_FIELDS = tuple(LevelPydantic.model_fields)
+render_user = _compile(USER_FIELDS)
+render_coords = _compile(COORDS_FIELDS)
+render_level = _compile(LEVEL_FIELDS)
+_render_pereval = _compile(PEREVAL_FIELDS)
+IMAGE_COLUMNS = ("title", "hash", "size", "mime_type", "status", "thumbnail_hash", "medium_hash", "full_hash")
+_render_image = _compile(IMAGE_COLUMNS)
+
+
+def image_urls(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace variant hashes with URLs; ``url`` is the medium variant once it exists."""
+    original = f"/images/{data['hash']}"
+    thumbnail, medium, full = data.pop("thumbnail_hash"), data.pop("medium_hash"), data.pop("full_hash")
+    data["url"] = f"/images/{medium}" if medium else original
+    data["thumbnail_url"] = f"/images/{thumbnail}" if thumbnail else None
+    data["full_url"] = f"/images/{full}" if full else original
+    return data
+
+
+def render_image(image) -> Dict[str, Any]:
+    return image_urls(_render_image(image))
+
+
+def render_pereval(pereval) -> Dict[str, Any]:
+    """Detail payload straight from a loaded ``PerevalAdded`` without Pydantic validation."""
+    data = _render_pereval(pereval)
+    data["user"] = render_user(pereval.user) if pereval.user is not None else None
+    data["coords"] = render_coords(pereval.coords) if pereval.coords is not None else None
+    data["level"] = render_level(pereval.level) if pereval.level is not None else None
+    data["images"] = [render_image(image) for image in pereval.images]
+    return data
+
+
+def render_pereval_bytes(pereval) -> bytes:
+    return dumps(render_pereval(pereval))
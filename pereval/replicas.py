@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import secrets
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection, Request
+
+import database
+from config import settings
+from pereval.metrics import Gauge
+
+
+logger = logging.getLogger(__name__)
+
+READ_PRIMARY_COOKIE = "read_primary"
+READ_PRIMARY_HEADER = "X-Read-Primary"
+WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+CHECK_TIMEOUT = 2.0
+# Допуск на округление срока в маркере и расхождение часов серверов за балансировщиком
+CLOCK_SKEW = 1.0
+
+# Отставание реплики в секундах; 0, если она применила всё полученное от основной БД
+# (иначе простаивающая основная БД выглядела бы как растущее отставание)
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replication lag measured by the last health check", ("replica",))
+REPLICA_HEALTHY = Gauge("db_replica_healthy", "1 if the replica is in the read rotation", ("replica",))
+REPLICA_SESSIONS = Gauge("db_replica_sessions", "Sessions currently open on the replica", ("replica",))
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine: Optional[AsyncEngine] = None
+        self.sessions = 0
+        self.healthy = False
+
+
+class ReplicaRouter:
+    """
+    Chooses the database for read-only handlers.
+
+    Reads go to a healthy replica, by round-robin or to the one with the
+    fewest open sessions; without healthy replicas, and for clients that
+    wrote recently, they go to the primary. A background loop measures the
+    replay lag of every replica and keeps it out of rotation while the lag
+    exceeds ``max_lag`` or the check fails.
+    """
+
+    def __init__(self, urls: str, strategy: str, max_lag: float, check_interval: float):
+        self.replicas = [Replica(url.strip()) for url in urls.split(",") if url.strip()]
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def pick(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.strategy == "least_connections":
+            return min(healthy, key=lambda replica: replica.sessions)
+        return healthy[next(self._counter) % len(healthy)]
+
+    @asynccontextmanager
+    async def session(self, primary: bool = False) -> AsyncIterator[AsyncSession]:
+        replica = None if primary else self.pick()
+        if replica is None:
+            async with database.Session() as session:
+                yield session
+            return
+        replica.sessions += 1
+        REPLICA_SESSIONS.inc(replica.name)
+        try:
+            async with database.Session(bind=replica.engine) as session:
+                yield session
+        finally:
+            replica.sessions -= 1
+            REPLICA_SESSIONS.dec(replica.name)
+
+    async def _measure_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            if conn.dialect.name != "postgresql":
+                await conn.execute(text("SELECT 1"))
+                return 0.0
+            return float(await conn.scalar(LAG_QUERY))
+
+    async def check(self, replica: Replica) -> None:
+        try:
+            lag = await asyncio.wait_for(self._measure_lag(replica), CHECK_TIMEOUT)
+        except Exception as e:
+            healthy, lag = False, None
+            reason = f"health check failed: {e!r}"
+        else:
+            healthy = lag <= self.max_lag
+            reason = f"lag {lag:.1f}s"
+            REPLICA_LAG.set(lag, replica.name)
+        if healthy != replica.healthy:
+            if healthy:
+                logger.info("Replica %s back in rotation (%s)", replica.name, reason)
+            else:
+                logger.warning("Replica %s out of rotation: %s", replica.name, reason)
+        replica.healthy = healthy
+        REPLICA_HEALTHY.set(1 if healthy else 0, replica.name)
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    async def start(self) -> None:
+        if not self.replicas or self._task is not None:
+            return
+        for replica in self.replicas:
+            replica.engine = database.create_engine(replica.url, primary=False)
+        await self.check_all()
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            if replica.engine is not None:
+                await replica.engine.dispose()
+                replica.engine = None
+            replica.healthy = False
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
+
+
+# Без общего секрета маркер, выданный одним процессом, не примут остальные (serve.py раздаёт свой воркерам)
+_read_primary_secret = settings.DB_READ_PRIMARY_SECRET.encode() or secrets.token_bytes(32)
+
+
+def _sign(until: str) -> str:
+    return hmac.new(_read_primary_secret, until.encode(), hashlib.sha256).hexdigest()
+
+
+def read_primary_marker(ttl: float) -> str:
+    """Signed read-your-writes marker: expiry time (Unix seconds) and its HMAC."""
+    until = f"{time.time() + ttl:.3f}"
+    return f"{until}.{_sign(until)}"
+
+
+def reads_from_primary(conn: HTTPConnection) -> bool:
+    """True while the read-your-writes marker set after the client's last write has not expired."""
+    value = conn.headers.get(READ_PRIMARY_HEADER) or conn.cookies.get(READ_PRIMARY_COOKIE)
+    if not value:
+        return False
+    until, _, signature = value.rpartition(".")
+    # Клиент не может продлить себе чтение с основной БД: срок подписан и не дальше TTL от текущего момента
+    if not hmac.compare_digest(signature, _sign(until)):
+        return False
+    try:
+        expires = float(until)
+    except ValueError:
+        return False
+    now = time.time()
+    return now < expires <= now + settings.DB_READ_PRIMARY_TTL + CLOCK_SKEW
+
+
+async def get_read_session(request: Request) -> AsyncIterator[AsyncSession]:
+    """Session for read-only handlers: a replica, or the primary for read-your-writes requests."""
+    async with replica_router.session(primary=reads_from_primary(request)) as session:
+        yield session
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware: after a successful write, keep the client on the primary.
+
+    The response carries a ``read_primary`` cookie and an ``X-Read-Primary``
+    header with the signed time (Unix seconds) until which reads are served
+    by the primary; clients without cookies send the header back.
+    """
+
+    def __init__(self, app, ttl: float):
+        self.app = app
+        self.ttl = ttl
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS or not replica_router.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                marker = read_primary_marker(self.ttl)
+                headers = MutableHeaders(scope=message)
+                headers.append("Set-Cookie", f"{READ_PRIMARY_COOKIE}={marker}; Max-Age={int(self.ttl)}; Path=/; "
+                                             f"HttpOnly; SameSite=Lax")
+                headers[READ_PRIMARY_HEADER] = marker
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+replica_router = ReplicaRouter(settings.DB_REPLICA_URLS, settings.DB_REPLICA_STRATEGY, settings.DB_REPLICA_MAX_LAG,
+                               settings.DB_REPLICA_CHECK_INTERVAL)
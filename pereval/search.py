@@ -0,0 +1,160 @@
+import asyncio
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from pereval.models import PerevalAdded
+
+
+# Транслитерация кириллицы, чтобы "Дятлова" и "Dyatlova" давали одинаковые токены
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y",
+    "ь": "", "э": "e", "ю": "yu", "я": "ya", "і": "i", "ї": "yi", "є": "ye", "ґ": "g",
+}
+_TRANSLIT = str.maketrans(CYRILLIC_TO_LATIN)
+
+# Разные латинские написания одного звука сводятся к одному
+SPELLING_VARIANTS = (("shch", "sch"), ("kh", "h"), ("ia", "ya"), ("iu", "yu"), ("j", "y"), ("w", "v"), ("x", "ks"))
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase, transliterate and fold spelling variants; words separated by single spaces."""
+    if not text:
+        return ""
+    text = text.lower().translate(_TRANSLIT)
+    for variant, canonical in SPELLING_VARIANTS:
+        text = text.replace(variant, canonical)
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def search_text(beauty_title: Optional[str], title: Optional[str], other_titles: Optional[str]) -> str:
+    """Normalized text stored in ``pereval.search_text`` and indexed for search."""
+    return " ".join(part for part in map(normalize, (beauty_title, title, other_titles)) if part)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of every word, padded the way pg_trgm does it."""
+    result = set()
+    for word in text.split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class SearchIndex:
+    """
+    In-memory trigram index for deployments without Postgres.
+
+    Candidates are taken only from the rarest query trigrams — any document
+    with the required share of matches must contain at least one of them —
+    and the common trigrams are then only counted for those candidates.
+    """
+
+    def __init__(self, min_similarity: float = 0.5):
+        self.min_similarity = min_similarity
+        self.postings: Optional[Dict[str, Set[int]]] = None
+        self.texts: Dict[int, str] = {}
+        self._lock = asyncio.Lock()
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        if self.postings is not None:
+            return
+        async with self._lock:
+            if self.postings is None:
+                self.postings = {}
+                rows = await db.execute(select(PerevalAdded.id, PerevalAdded.search_text))
+                for pereval_id, text in rows:
+                    self._index(pereval_id, text or "")
+
+    def _index(self, pereval_id: int, text: str) -> None:
+        self.texts[pereval_id] = text
+        for gram in trigrams(text):
+            self.postings.setdefault(gram, set()).add(pereval_id)
+
+    def add(self, pereval_id: int, text: str) -> None:
+        if self.postings is None:
+            # Ещё не загружен — документ попадёт в индекс при первой загрузке
+            return
+        old = self.texts.get(pereval_id)
+        if old is not None:
+            for gram in trigrams(old):
+                self.postings[gram].discard(pereval_id)
+        self._index(pereval_id, text)
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        grams = trigrams(query)
+        if not grams:
+            return []
+        required = max(1, int(len(grams) * self.min_similarity + 0.999))
+        by_rarity = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+
+        counts = Counter()
+        prefix = len(grams) - required + 1
+        for gram in by_rarity[:prefix]:
+            counts.update(self.postings.get(gram, ()))
+        # Остальные (частые) триграммы только досчитываются у уже найденных кандидатов
+        for gram in by_rarity[prefix:]:
+            posting = self.postings.get(gram)
+            if posting:
+                counts.update(counts.keys() & posting)
+
+        words = query.split()
+        ranked = []
+        for pereval_id, matched in counts.items():
+            if matched < required:
+                continue
+            score = matched / len(grams)
+            # Все слова запроса встречаются как есть — поднимаем выше нечётких совпадений
+            if all(word in self.texts[pereval_id] for word in words):
+                score += 1.0
+            ranked.append((score, pereval_id))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [(pereval_id, score) for score, pereval_id in ranked[:limit]]
+
+
+search_index = SearchIndex()
+
+
+def use_postgres(db: AsyncSession) -> bool:
+    if settings.SEARCH_BACKEND == "auto":
+        return db.bind.dialect.name == "postgresql"
+    return settings.SEARCH_BACKEND == "postgres"
+
+
+_TITLE_COLUMNS = (PerevalAdded.id, PerevalAdded.beauty_title, PerevalAdded.title, PerevalAdded.other_titles)
+
+
+async def search_perevals(db: AsyncSession, q: str, limit: int) -> List[Tuple[float, object]]:
+    """Passes matching ``q`` by words or by trigram similarity, best first, as ``(score, row)``."""
+    query = normalize(q)
+    if not query:
+        return []
+
+    if use_postgres(db):
+        vector = PerevalAdded.search_vector
+        ts_query = func.plainto_tsquery("simple", query)
+        score = (func.ts_rank(vector, ts_query) + func.word_similarity(query, PerevalAdded.search_text)).label("score")
+        rows = await db.execute(
+            select(*_TITLE_COLUMNS, score)
+            .where(vector.op("@@")(ts_query) | literal(query).op("<%")(PerevalAdded.search_text))
+            .order_by(score.desc(), PerevalAdded.id)
+            .limit(limit)
+        )
+        return [(row.score, row) for row in rows]
+
+    await search_index.ensure_loaded(db)
+    ranked = search_index.search(query, limit)
+    if not ranked:
+        return []
+    rows = {row.id: row for row in await db.execute(
+        select(*_TITLE_COLUMNS).where(PerevalAdded.id.in_([pereval_id for pereval_id, _ in ranked]))
+    )}
+    return [(score, rows[pereval_id]) for pereval_id, score in ranked if pereval_id in rows]
@@ -1,3 +1,7 @@
+import base64
+import binascii
+
+from pereval.blobstore import get_blob_store
 from pereval.models import User, Coords, Level, Image, PerevalAdded
 from pereval.models import UserPydantic, CoordsPydantic, LevelPydantic, ImagePydantic, PerevalAddedPydantic
 
@@ -9,21 +13,40 @@ def user_pydantic_to_sqlalchemy(user_pydantic: UserPydantic) -> User:
 
 def coords_pydantic_to_sqlalchemy(coords_pydantic: CoordsPydantic) -> Coords:
     coords_data = coords_pydantic.dict()
-    if not all(coords_data.values()):
+    # 0 — допустимая широта, долгота и высота, поэтому проверяем только на None
+    if any(value is None for value in coords_data.values()):
         raise ValueError("Missing required fields in CoordsPydantic")
     return Coords(latitude=coords_data['latitude'], longitude=coords_data['longitude'], height=coords_data['height'])
 
 def level_pydantic_to_sqlalchemy(level_pydantic: LevelPydantic) -> Level:
     level_data = level_pydantic.dict()
-    if not all(level_data.values()):
+    # Пустая строка — категория сложности для сезона не указана
+    if any(value is None for value in level_data.values()):
         raise ValueError("Missing required fields in LevelPydantic")
     return Level(winter=level_data['winter'], summer=level_data['summer'], autumn=level_data['autumn'], spring=level_data['spring'])
 
 def image_pydantic_to_sqlalchemy(image_pydantic: ImagePydantic) -> Image:
     image_data = image_pydantic.dict()
-    if not all(image_data.values()):
+    if not image_data['title'] or not (image_data['hash'] or image_data['data']):
         raise ValueError("Missing required fields in ImagePydantic")
-    return Image(data=image_data['data'], title=image_data['title'])
+
+    blob_store = get_blob_store()
+    if image_data['hash']:
+        blob = blob_store.stat(image_data['hash'])
+        if blob is None:
+            raise ValueError(f"Unknown image hash: {image_data['hash']}")
+    else:
+        # Старые клиенты присылают изображение целиком в base64 — кладём его в хранилище
+        data = image_data['data']
+        if data.startswith("data:"):
+            data = data.partition(",")[2]
+        try:
+            payload = base64.b64decode(data, validate=True)
+        except binascii.Error:
+            raise ValueError("Image data is not valid base64")
+        blob = blob_store.put_bytes(payload)
+
+    return Image(title=image_data['title'], hash=blob.hash, size=blob.size, mime_type=blob.mime_type)
 
 def perevaladded_pydantic_to_sqlalchemy(perevaladded_pydantic: PerevalAddedPydantic) -> PerevalAdded:
     user = user_pydantic_to_sqlalchemy(perevaladded_pydantic.user)
@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import math
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from pereval.lazy import optional_module
+from pereval.models import PerevalAdded, Coords
+
+# numpy нужен только для резервного индекса в памяти и загружается при его построении
+np = optional_module("numpy")
+
+
+EARTH_RADIUS_KM = 6371.0088
+# Оба индекса ищут соседей по приближённому расстоянию в градусах: кандидатов берётся с запасом
+# и они пересортировываются по расстоянию по большому кругу
+NEAREST_CANDIDATES = 4
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _str_order(x, y, capacity: int):
+    """Sort-Tile-Recursive order: vertical slices by x, then by y inside each slice."""
+    n = len(x)
+    slice_count = math.ceil(math.sqrt(math.ceil(n / capacity)))
+    slice_size = slice_count * capacity
+    by_x = np.argsort(x, kind="stable")
+    order = [chunk[np.argsort(y[chunk], kind="stable")] for chunk in np.split(by_x, range(slice_size, n, slice_size))]
+    return np.concatenate(order) if order else by_x
+
+
+class STRTree:
+    """
+    Static R-tree packed with STR over NumPy arrays (x = longitude, y = latitude).
+
+    Every level is a set of arrays; the children of a node are a contiguous
+    range in the level below, so traversal is vectorised level by level.
+    """
+
+    def __init__(self, ids, lats, lons, capacity: int = 16):
+        ids = np.asarray(ids, dtype=np.int64)
+        x = np.asarray(lons, dtype=np.float64)
+        y = np.asarray(lats, dtype=np.float64)
+        order = _str_order(x, y, capacity)
+        self.ids, self.x, self.y = ids[order], x[order], y[order]
+        self.capacity = capacity
+        # Уровни снизу вверх: (minx, miny, maxx, maxy, start, end)
+        self.levels = []
+        if len(self.ids) == 0:
+            return
+
+        starts = np.arange(0, len(self.ids), capacity)
+        ends = np.minimum(starts + capacity, len(self.ids))
+        level = (np.minimum.reduceat(self.x, starts), np.minimum.reduceat(self.y, starts),
+                 np.maximum.reduceat(self.x, starts), np.maximum.reduceat(self.y, starts), starts, ends)
+        while True:
+            cx = (level[0] + level[2]) / 2
+            cy = (level[1] + level[3]) / 2
+            order = _str_order(cx, cy, capacity)
+            level = tuple(column[order] for column in level)
+            self.levels.append(level)
+            count = len(level[0])
+            if count <= capacity:
+                break
+            starts = np.arange(0, count, capacity)
+            ends = np.minimum(starts + capacity, count)
+            level = (np.minimum.reduceat(level[0], starts), np.minimum.reduceat(level[1], starts),
+                     np.maximum.reduceat(level[2], starts), np.maximum.reduceat(level[3], starts), starts, ends)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _expand(starts, ends):
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            return np.empty(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        if not self.levels:
+            return np.empty(0, dtype=np.int64)
+        nodes = np.arange(len(self.levels[-1][0]))
+        for minx, miny, maxx, maxy, starts, ends in reversed(self.levels):
+            hit = nodes[(minx[nodes] <= max_lon) & (maxx[nodes] >= min_lon) &
+                        (miny[nodes] <= max_lat) & (maxy[nodes] >= min_lat)]
+            nodes = self._expand(starts[hit], ends[hit])
+        inside = ((self.x[nodes] >= min_lon) & (self.x[nodes] <= max_lon) &
+                  (self.y[nodes] >= min_lat) & (self.y[nodes] <= max_lat))
+        return self.ids[nodes[inside]]
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[float, int]]:
+        """k nearest points by local equirectangular distance (degrees), best-first."""
+        if not self.levels:
+            return []
+        scale = math.cos(math.radians(lat))
+
+        def box_distances(level, nodes):
+            minx, miny, maxx, maxy = level[0][nodes], level[1][nodes], level[2][nodes], level[3][nodes]
+            dx = np.maximum(np.maximum(minx - lon, lon - maxx), 0) * scale
+            dy = np.maximum(np.maximum(miny - lat, lat - maxy), 0)
+            return dx * dx + dy * dy
+
+        top = len(self.levels) - 1
+        nodes = np.arange(len(self.levels[top][0]))
+        heap = [(float(d), top, int(n)) for d, n in zip(box_distances(self.levels[top], nodes), nodes)]
+        heapq.heapify(heap)
+        result = []
+        while heap and len(result) < k:
+            distance, depth, index = heapq.heappop(heap)
+            if depth < 0:
+                result.append((distance, int(self.ids[index])))
+                continue
+            start, end = self.levels[depth][4][index], self.levels[depth][5][index]
+            children = np.arange(start, end)
+            if depth == 0:
+                dx = (self.x[children] - lon) * scale
+                dy = self.y[children] - lat
+                distances = dx * dx + dy * dy
+            else:
+                distances = box_distances(self.levels[depth - 1], children)
+            for d, child in zip(distances, children):
+                heapq.heappush(heap, (float(d), depth - 1, int(child)))
+        return result
+
+
+class SpatialIndex:
+    """
+    In-memory fallback for deployments without a GiST index.
+
+    The packed tree is immutable, so new points go to a small pending list
+    that is scanned linearly and merged into a rebuilt tree once it grows.
+    """
+
+    def __init__(self, rebuild_threshold: int = 1024):
+        self.rebuild_threshold = rebuild_threshold
+        self.tree: Optional[STRTree] = None
+        self.pending: List[Tuple[int, float, float]] = []
+        self._lock = asyncio.Lock()
+
+    async def ensure_loaded(self, db: AsyncSession) -> None:
+        if self.tree is not None:
+            return
+        if np is None:
+            raise RuntimeError("numpy is required for the in-memory spatial index")
+        async with self._lock:
+            if self.tree is None:
+                rows = (await db.execute(
+                    select(PerevalAdded.id, Coords.latitude, Coords.longitude)
+                    .join(Coords, PerevalAdded.coords_id == Coords.id)
+                    .where(Coords.latitude.isnot(None), Coords.longitude.isnot(None))
+                )).all()
+                self.tree = STRTree([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+    def add(self, pereval_id: int, lat: float, lon: float) -> None:
+        if self.tree is None:
+            # Ещё не загружен — точка попадёт в индекс при первой загрузке
+            return
+        self.pending.append((pereval_id, lat, lon))
+        if len(self.pending) >= self.rebuild_threshold:
+            ids, lats, lons = zip(*self.pending)
+            self.tree = STRTree(np.concatenate([self.tree.ids, ids]), np.concatenate([self.tree.y, lats]),
+                                np.concatenate([self.tree.x, lons]))
+            self.pending = []
+
+    def reset(self) -> None:
+        """Drop the index after a point moved; it is reloaded on the next query."""
+        self.tree = None
+        self.pending = []
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[int]:
+        ids = [int(i) for i in self.tree.bbox(min_lat, min_lon, max_lat, max_lon)]
+        ids += [i for i, lat, lon in self.pending if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon]
+        return sorted(ids)
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[int]:
+        scale = math.cos(math.radians(lat))
+        candidates = self.tree.nearest(lat, lon, k)
+        candidates += [(((p_lon - lon) * scale) ** 2 + (p_lat - lat) ** 2, i) for i, p_lat, p_lon in self.pending]
+        return [i for _, i in sorted(candidates)[:k]]
+
+
+spatial_index = SpatialIndex()
+
+
+def use_postgres(db: AsyncSession) -> bool:
+    if settings.SPATIAL_BACKEND == "auto":
+        return db.bind.dialect.name == "postgresql"
+    return settings.SPATIAL_BACKEND == "postgres"
+
+
+def _point():
+    return func.point(Coords.longitude, Coords.latitude)
+
+
+def _geo_query():
+    return (select(PerevalAdded.id, PerevalAdded.title, Coords.latitude, Coords.longitude, Coords.height)
+            .join(Coords, PerevalAdded.coords_id == Coords.id))
+
+
+async def _rows_by_ids(db: AsyncSession, ids: Sequence[int]) -> list:
+    if not ids:
+        return []
+    rows = {row[0]: row for row in await db.execute(_geo_query().where(PerevalAdded.id.in_(ids)))}
+    return [rows[i] for i in ids if i in rows]
+
+
+async def find_in_bbox(db: AsyncSession, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                       limit: int) -> list:
+    if use_postgres(db):
+        box = func.box(func.point(min_lon, min_lat), func.point(max_lon, max_lat))
+        query = _geo_query().where(_point().op("<@")(box)).order_by(PerevalAdded.id).limit(limit)
+        return (await db.execute(query)).all()
+
+    await spatial_index.ensure_loaded(db)
+    return await _rows_by_ids(db, spatial_index.bbox(min_lat, min_lon, max_lat, max_lon)[:limit])
+
+
+async def find_nearest(db: AsyncSession, lat: float, lon: float, limit: int) -> list:
+    """
+    Nearest passes with great-circle distance in km, closest first.
+
+    Candidates are found in plain longitude/latitude, so points across the
+    ±180° meridian from the query are not treated as close.
+    """
+    candidates = limit * NEAREST_CANDIDATES
+    if use_postgres(db):
+        query = _geo_query().order_by(_point().op("<->")(func.point(lon, lat))).limit(candidates)
+        rows = (await db.execute(query)).all()
+    else:
+        await spatial_index.ensure_loaded(db)
+        rows = await _rows_by_ids(db, spatial_index.nearest(lat, lon, candidates))
+
+    ranked = [(haversine_km(lat, lon, row.latitude, row.longitude), row) for row in rows]
+    ranked.sort(key=lambda item: item[0])
+    return ranked[:limit]
@@ -0,0 +1,329 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from pereval.blobstore import get_blob_store, sniff_mime_type
+
+
+# Внутри строки интересны только конец строки и экранирование
+STRING_SPECIAL = re.compile(rb'["\\]')
+# Вне строк: начало строки и структурные символы; числа и литералы копируются как есть
+STRUCTURAL = re.compile(rb'["{}\[\],:]')
+BLOB_MARKER = "$blob"
+# Не base64: сериализатор вернёт для такого изображения обычную ошибку "Image data is not valid base64"
+INVALID_DATA = "!"
+MAX_DATA_URL_PREFIX = 256
+
+
+class ImageSpool:
+    """Decodes one base64 ``data`` string piece by piece into a temporary file."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="pereval-image-")
+        self.file = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.valid = True
+        self._prefix = b""  # начало строки, пока не ясно, data:-URL это или нет
+        self._started = False
+        self._pending = b""  # символы base64 сверх кратного 4
+        self._padded = False
+
+    def invalidate(self) -> None:
+        self.valid = False
+        self._pending = b""
+
+    def write(self, data: bytes) -> None:
+        if not self.valid:
+            return
+        if not self._started:
+            # Как и в сериализаторе, "data:image/png;base64,..." допускается и отбрасывается до запятой
+            self._prefix += data
+            if self._prefix.startswith(b"data:"):
+                _, comma, data = self._prefix.partition(b",")
+                if not comma:
+                    if len(self._prefix) > MAX_DATA_URL_PREFIX:
+                        self.invalidate()
+                    return
+            elif b"data:".startswith(self._prefix):
+                return
+            else:
+                data = self._prefix
+            self._started = True
+            self._prefix = b""
+        self._decode(self._pending + data)
+
+    def _decode(self, data: bytes) -> None:
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if not usable:
+            return
+        block = data[:usable]
+        padding = block.find(b"=")
+        # "=" допустимо только в последней четвёрке всей строки
+        if self._padded or (padding != -1 and padding < usable - 2):
+            self.invalidate()
+            return
+        try:
+            decoded = base64.b64decode(block, validate=True)
+        except binascii.Error:
+            self.invalidate()
+            return
+        self._padded = padding != -1
+        if len(self.head) < 16:
+            self.head += decoded[:16 - len(self.head)]
+        self.digest.update(decoded)
+        self.size += len(decoded)
+        self.file.write(decoded)
+
+    def finish(self, images: "SpooledImages") -> Any:
+        """Replacement for the string in the parsed document: ``{"$blob": hash}``, ``""`` or an invalid marker."""
+        if not self._started and self.valid:
+            if self._prefix.startswith(b"data:"):
+                self.invalidate()
+            else:
+                self._decode(self._prefix)
+        if self._pending:
+            self.invalidate()
+        self.file.close()
+        if not self.valid or not self.size:
+            os.unlink(self.path)
+            return INVALID_DATA if not self.valid or self._started else ""
+        blob_hash = self.digest.hexdigest()
+        images.add(blob_hash, self.path, self.size, sniff_mime_type(self.head, "application/octet-stream"))
+        return {BLOB_MARKER: blob_hash}
+
+    def discard(self) -> None:
+        self.file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class SpooledImages:
+    """
+    Images decoded from one request body into temporary files, by hash.
+
+    Nothing reaches the blob store until ``commit``: the request may still
+    fail validation or turn out to be an idempotent replay. ``discard``
+    deletes whatever was not committed and is safe to call in ``finally``.
+    """
+
+    def __init__(self):
+        self._files: Dict[str, Tuple[str, int, str]] = {}  # hash -> (путь, размер, MIME-тип)
+
+    def add(self, blob_hash: str, path: str, size: int, mime_type: str) -> None:
+        if blob_hash in self._files:
+            # То же изображение второй раз в том же теле
+            os.unlink(path)
+        else:
+            self._files[blob_hash] = (path, size, mime_type)
+
+    async def commit(self, hashes: Optional[Iterable[str]] = None) -> None:
+        """Move the files into the blob store: all of them, or only those with the given hashes."""
+        wanted = list(self._files) if hashes is None else [h for h in set(hashes) if h in self._files]
+        blob_store = get_blob_store()
+        for blob_hash in wanted:
+            path, size, mime_type = self._files.pop(blob_hash)
+            await run_in_threadpool(blob_store.put_file, path, blob_hash, size, mime_type)
+
+    async def discard(self) -> None:
+        files, self._files = self._files, {}
+        if files:
+            await run_in_threadpool(_unlink_all, [path for path, _, _ in files.values()])
+
+
+def _unlink_all(paths: List[str]) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+class SpoolingJSONParser:
+    """
+    Incremental JSON parser that keeps image payloads out of memory.
+
+    ``feed`` takes the body chunk by chunk and returns the top-level values
+    completed so far. Everything except ``images[].data`` is kept as JSON
+    text and parsed with ``json.loads`` once its top-level value is complete;
+    image data strings are base64-decoded as they arrive into temporary
+    files collected in ``images`` and referenced by hash, so memory per
+    request no longer grows with the size of the images.
+    """
+
+    def __init__(self, images: SpooledImages):
+        self.images = images
+        self._out = bytearray()
+        # ["{", текущий ключ] или ["[", ключ, под которым лежит массив]
+        self._stack: List[list] = []
+        self._expect_key = False
+        self._string: Optional[str] = None  # "key", "value" или "spool"
+        self._escape = False
+        self._key = bytearray()
+        self._spool: Optional[ImageSpool] = None
+        self._values: List[Any] = []
+
+    def _is_image_data(self) -> bool:
+        # Только images[].data самого перевала — объекта верхнего уровня или элемента массива пачки;
+        # поля "images" глубже остаются обычными строками, как их и ждёт _emit
+        stack = self._stack
+        depth = 4 if stack and stack[0][0] == "[" else 3
+        return (len(stack) == depth and stack[-1][0] == "{" and stack[-1][1] == "data"
+                and stack[-2][0] == "[" and stack[-2][1] == "images" and stack[-3][0] == "{")
+
+    def _emit(self) -> None:
+        value = json.loads(bytes(self._out))
+        self._out.clear()
+        for item in value if isinstance(value, list) else [value]:
+            images = item.get("images") if isinstance(item, dict) else None
+            for image in images if isinstance(images, list) else []:
+                data = image.get("data") if isinstance(image, dict) else None
+                if isinstance(data, dict) and set(data) == {BLOB_MARKER}:
+                    image["hash"] = image.get("hash") or data[BLOB_MARKER]
+                    image["data"] = None
+        self._values.append(value)
+
+    def _feed_string(self, chunk: bytes, pos: int) -> int:
+        end = len(chunk)
+        while pos < end:
+            if self._escape:
+                self._escape = False
+                byte = chunk[pos:pos + 1]
+                pos += 1
+                if self._string == "spool":
+                    # В base64 экранируют разве что "/" (как "\/")
+                    if byte == b"/":
+                        self._spool.write(byte)
+                    else:
+                        self._spool.invalidate()
+                    continue
+                self._out += byte
+                if self._string == "key":
+                    self._key += byte
+                continue
+
+            match = STRING_SPECIAL.search(chunk, pos)
+            stop = match.start() if match else end
+            piece = chunk[pos:stop]
+            if self._string == "spool":
+                self._spool.write(piece)
+            else:
+                self._out += piece
+                if self._string == "key":
+                    self._key += piece
+            if match is None:
+                return end
+            pos = stop + 1
+            if chunk[stop] == 0x5C:  # обратная косая черта
+                self._escape = True
+                if self._string != "spool":
+                    self._out.append(0x5C)
+                    if self._string == "key":
+                        self._key.append(0x5C)
+                continue
+
+            # Закрывающая кавычка
+            if self._string == "spool":
+                self._out += json.dumps(self._spool.finish(self.images)).encode()
+                self._spool = None
+            else:
+                self._out.append(0x22)
+                if self._string == "key":
+                    self._stack[-1][1] = json.loads(b'"' + bytes(self._key) + b'"')
+            self._string = None
+            return pos
+        return pos
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        pos, end = 0, len(chunk)
+        while pos < end:
+            if self._string is not None:
+                pos = self._feed_string(chunk, pos)
+                continue
+            match = STRUCTURAL.search(chunk, pos)
+            if match is None:
+                self._out += chunk[pos:]
+                break
+            start = match.start()
+            self._out += chunk[pos:start]
+            char = chunk[start]
+            pos = start + 1
+            top = self._stack[-1] if self._stack else None
+
+            if char == 0x22:  # "
+                if top is None:
+                    raise ValueError("Expected a JSON object or array")
+                if top[0] == "{" and self._expect_key:
+                    self._string = "key"
+                    self._key.clear()
+                    self._out.append(char)
+                elif self._is_image_data():
+                    self._string = "spool"
+                    self._spool = ImageSpool()
+                else:
+                    self._string = "value"
+                    self._out.append(char)
+            elif char in b"{[":
+                if top is None and self._out.strip():
+                    raise ValueError("Unexpected data before a JSON value")
+                parent_key = top[1] if top is not None and top[0] == "{" else None
+                self._stack.append(["{", None] if char == 0x7B else ["[", parent_key])
+                self._expect_key = char == 0x7B
+                self._out.append(char)
+            elif char in b"}]":
+                if top is None or top[0] != ("{" if char == 0x7D else "["):
+                    raise ValueError("Unbalanced brackets")
+                self._stack.pop()
+                self._expect_key = False
+                self._out.append(char)
+                if not self._stack:
+                    self._emit()
+            elif char == 0x2C:  # ,
+                self._expect_key = top is not None and top[0] == "{"
+                self._out.append(char)
+            else:  # :
+                self._expect_key = False
+                self._out.append(char)
+
+        values, self._values = self._values, []
+        return values
+
+    def finish(self) -> None:
+        if self._string is not None or self._stack:
+            raise ValueError("Unexpected end of JSON")
+        if self._out.strip():
+            raise ValueError("Expected a JSON object or array")
+
+    def close(self) -> None:
+        """Remove the temporary file of an image that was still being received."""
+        if self._spool is not None:
+            self._spool.discard()
+            self._spool = None
+
+
+async def read_json_spooled(chunks: AsyncIterator[bytes], images: SpooledImages) -> List[Any]:
+    """
+    Top-level JSON values of a streamed body; image data goes to ``images``.
+
+    Decoding and spool writes run in the threadpool, chunk by chunk, like
+    ``LocalBlobStore.write_stream``. On error the spooled files are deleted.
+    """
+    parser = SpoolingJSONParser(images)
+    values = []
+    try:
+        async for chunk in chunks:
+            values += await run_in_threadpool(parser.feed, chunk)
+        parser.finish()
+    except BaseException:
+        await images.discard()
+        raise
+    finally:
+        parser.close()
+    return values
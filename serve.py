@@ -0,0 +1,237 @@
+"""
+Production entry point: several uvicorn workers sharing one listening socket.
+
+    python serve.py --workers 8 --port 8000
+
+The supervisor binds the socket once and starts ``WEB_WORKERS`` processes
+(one per core by default), each running ``main:app`` on uvloop and httptools
+when they are installed. ``DB_POOL_TOTAL`` connections are divided between
+the workers, so adding workers does not exhaust the database; the
+``IMAGE_WORKERS`` image processing processes are divided the same way.
+
+On SIGTERM or SIGINT every worker stops accepting connections, finishes its
+in-flight requests within ``WEB_GRACEFUL_TIMEOUT`` and runs the lifespan
+shutdown (ingest log, image pipeline, engine disposal). A worker whose RSS
+exceeds ``WEB_MAX_MEMORY_MB`` is drained the same way and replaced; a worker
+that dies is restarted.
+
+With more than one worker the in-process response cache is switched off,
+since an invalidation would reach only one worker (use ``CACHE_BACKEND=redis``),
+and in-memory spatial and search indexes are reported at startup. Each worker
+gets its own ingest log directory, ``INGEST_LOG_PATH/worker-<n>``, replayed by
+the worker with the same number, so keep the worker count when restarting
+with entries still in the log.
+"""
+import argparse
+import importlib.util
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import settings
+
+
+logger = logging.getLogger("pereval.serve")
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# Запас сверх WEB_GRACEFUL_TIMEOUT на остановку lifespan (запись журнала, закрытие пула)
+SHUTDOWN_MARGIN = 15.0
+# Ключ подписи маркера read-your-writes, если DB_READ_PRIMARY_SECRET не задан: один на все воркеры
+_READ_PRIMARY_SECRET = secrets.token_hex(32)
+
+
+def worker_pool(total: int, workers: int) -> Tuple[int, int]:
+    """``pool_size`` and ``max_overflow`` of one worker when ``total`` connections are shared."""
+    per_worker = max(1, total // workers)
+    # Соотношение постоянных и временных соединений берётся из DB_POOL_SIZE / DB_MAX_OVERFLOW
+    configured = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    pool_size = max(1, min(per_worker, round(per_worker * settings.DB_POOL_SIZE / configured)))
+    return pool_size, per_worker - pool_size
+
+
+def worker_env(index: int, workers: int) -> Dict[str, str]:
+    """Settings overridden for worker ``index``; passed through the environment."""
+    # Процессы обработки изображений (IMAGE_WORKERS) делятся между воркерами по номеру
+    env = {"WEB_WORKER_INDEX": str(index), "WEB_WORKER_COUNT": str(workers)}
+    if settings.DB_POOL_TOTAL:
+        pool_size, max_overflow = worker_pool(settings.DB_POOL_TOTAL, workers)
+        env["DB_POOL_SIZE"] = str(pool_size)
+        env["DB_MAX_OVERFLOW"] = str(max_overflow)
+    if workers > 1:
+        # Два процесса в одном каталоге журнала перепутали бы номера записей
+        env["INGEST_LOG_PATH"] = os.path.join(settings.INGEST_LOG_PATH, f"worker-{index}")
+        if settings.CACHE_BACKEND == "memory":
+            # Сброс кэша после записи дошёл бы только до одного воркера, остальные отдавали бы старое
+            env["CACHE_BACKEND"] = "none"
+        if not settings.DB_READ_PRIMARY_SECRET:
+            # Маркер чтения с основной БД, подписанный одним воркером, должны принимать все
+            env["DB_READ_PRIMARY_SECRET"] = _READ_PRIMARY_SECRET
+    return env
+
+
+def process_local_state(workers: int) -> List[str]:
+    """Settings that keep state in each process and go stale with more than one worker."""
+    if workers <= 1:
+        return []
+    problems = []
+    if settings.CACHE_BACKEND == "memory":
+        problems.append("CACHE_BACKEND=memory: the response cache is disabled, use CACHE_BACKEND=redis")
+    for name in ("SPATIAL_BACKEND", "SEARCH_BACKEND"):
+        if getattr(settings, name) == "memory":
+            problems.append(f"{name}=memory: each worker sees only the writes it made itself, use postgres")
+    return problems
+
+
+@contextmanager
+def _environ(overrides: Dict[str, str]) -> Iterator[None]:
+    # Процесс, запущенный через spawn, получает окружение родителя на момент start()
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app: str, sock: socket.socket, graceful_timeout: float) -> None:
+    import uvicorn
+
+    # uvicorn сам ставит обработчики SIGTERM/SIGINT: перестаёт принимать соединения,
+    # дожидается текущих запросов и выполняет shutdown lifespan
+    config = uvicorn.Config(app, loop=event_loop(), http=http_protocol(), lifespan="on",
+                            timeout_graceful_shutdown=graceful_timeout)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Keeps ``workers`` processes serving ``app`` on a shared socket."""
+
+    def __init__(self, app: str, sock: socket.socket, workers: int, graceful_timeout: float,
+                 max_memory: int, check_interval: float):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.max_memory = max_memory
+        self.check_interval = check_interval
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self._context = multiprocessing.get_context("spawn")
+        self._stopping = threading.Event()
+
+    def spawn(self, index: int) -> None:
+        with _environ(worker_env(index, self.workers)):
+            process = self._context.Process(target=run_worker, name=f"pereval-worker-{index}",
+                                            args=(self.app, self.sock, self.graceful_timeout))
+            process.start()
+        self.processes[index] = process
+        logger.info("Started worker %s (pid %s)", index, process.pid)
+
+    def _join(self, processes) -> None:
+        deadline = time.monotonic() + self.graceful_timeout + SHUTDOWN_MARGIN
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker pid %s did not stop in time, killing it", process.pid)
+                process.kill()
+                process.join()
+
+    def recycle(self, index: int) -> None:
+        # Сначала остановка, потом замена: новый процесс получает тот же каталог журнала приёма
+        process = self.processes[index]
+        process.terminate()
+        self._join([process])
+        if not self._stopping.is_set():
+            self.spawn(index)
+
+    def check(self) -> None:
+        for index, process in list(self.processes.items()):
+            if not process.is_alive():
+                logger.warning("Worker %s (pid %s) exited with code %s, restarting", index, process.pid,
+                               process.exitcode)
+                self.spawn(index)
+                continue
+            rss = rss_bytes(process.pid) if self.max_memory else None
+            if rss is not None and rss > self.max_memory:
+                logger.info("Worker %s (pid %s) uses %.0f MB, recycling", index, process.pid, rss / 2 ** 20)
+                self.recycle(index)
+
+    def stop(self, *_) -> None:
+        self._stopping.set()
+
+    def run(self) -> None:
+        for index in range(self.workers):
+            self.spawn(index)
+        while not self._stopping.wait(self.check_interval):
+            self.check()
+        logger.info("Stopping %s workers", len(self.processes))
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        self._join(self.processes.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--host", default=settings.WEB_HOST)
+    parser.add_argument("--port", type=int, default=settings.WEB_PORT)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS, help="0 — one per CPU core")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    workers = args.workers or os.cpu_count() or 1
+    if settings.DB_POOL_TOTAL:
+        pool_size, max_overflow = worker_pool(settings.DB_POOL_TOTAL, workers)
+        if workers * (pool_size + max_overflow) > settings.DB_POOL_TOTAL:
+            logger.warning("DB_POOL_TOTAL=%s is less than one connection per worker", settings.DB_POOL_TOTAL)
+        logger.info("Database pool per worker: %s + %s overflow", pool_size, max_overflow)
+    for problem in process_local_state(workers):
+        logger.warning("%s workers with %s", workers, problem)
+    logger.info("Serving %s on %s:%s with %s workers (%s, %s)", args.app, args.host, args.port, workers,
+                event_loop(), http_protocol())
+
+    supervisor = Supervisor(args.app, bind_socket(args.host, args.port), workers, settings.WEB_GRACEFUL_TIMEOUT,
+                            settings.WEB_MAX_MEMORY_MB * 2 ** 20, settings.WEB_MEMORY_CHECK_INTERVAL)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
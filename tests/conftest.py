@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.Settings требует параметры БД, хотя эти тесты к ней не подключаются
+for name in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASSWORD"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("BLOB_STORAGE_PATH", tempfile.mkdtemp(prefix="pereval-blobs-"))
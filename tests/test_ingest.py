@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import zlib
+
+import pytest
+from sqlalchemy import func, select
+
+import database
+from pereval import ingest
+from pereval.identity import IdentityCache, identity_caches
+from pereval.ingest import CHECKPOINT_FILE, DEAD_LETTER_FILE, RECORD_HEADER, SEGMENT_SUFFIX, IngestLog
+from pereval.models import BatchItemResult, PerevalAdded, PerevalAddedPydantic
+
+
+ITEM = {
+    "beauty_title": "пер.", "title": "Пхия", "other_titles": "Триев", "connect": "",
+    "user": {"email": "a@example.com", "fam": "Пупкин", "name": "Василий", "otc": "Иванович", "phone": "+7 555 55 55"},
+    "coords": {"latitude": "45.3842", "longitude": "7.1525", "height": 1200},
+    "level": {"winter": "", "summer": "1А", "autumn": "1А", "spring": ""},
+    "images": [],
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(ingest, "RETRY_DELAY", 0.0)
+    # id из кэша прошлого теста указывали бы на строки другой БД
+    for model in list(identity_caches):
+        monkeypatch.setitem(identity_caches, model, IdentityCache(100))
+
+
+def item(title: str) -> PerevalAddedPydantic:
+    return PerevalAddedPydantic.model_validate(dict(ITEM, title=title))
+
+
+def record(seq: int, title: str = "t") -> bytes:
+    payload = json.dumps({"seq": seq, "item": dict(ITEM, title=title)}).encode()
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def write_segment(path, first_seq: int, data: bytes) -> str:
+    os.makedirs(path, exist_ok=True)
+    segment = os.path.join(path, f"{first_seq:020d}{SEGMENT_SUFFIX}")
+    with open(segment, "wb") as f:
+        f.write(data)
+    return segment
+
+
+def new_log(path, segment_bytes: int = 1 << 20, batch_size: int = 50, max_attempts: int = 3) -> IngestLog:
+    return IngestLog(str(path), segment_bytes, 0.001, batch_size, 0.01, max_attempts)
+
+
+def run_with_db(tmp_path, test):
+    async def main():
+        database.init_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+        try:
+            async with database.engine.begin() as conn:
+                await conn.run_sync(database.Base.metadata.create_all)
+            await test()
+        finally:
+            await database.dispose_engine()
+
+    asyncio.run(main())
+
+
+async def count_perevals() -> int:
+    async with database.Session() as db:
+        return await db.scalar(select(func.count()).select_from(PerevalAdded))
+
+
+def test_recover_truncates_torn_tail(tmp_path):
+    log_dir = tmp_path / "log"
+    complete = record(1) + record(2) + record(3)
+    segment = write_segment(log_dir, 1, complete + record(4)[:-5])
+
+    log = new_log(log_dir)
+    replay = log._recover()
+
+    assert [seq for seq, _ in replay] == [1, 2, 3]
+    assert os.path.getsize(segment) == len(complete)
+    assert log._next_seq == 4
+
+
+def test_recover_stops_at_corrupted_record(tmp_path):
+    log_dir = tmp_path / "log"
+    corrupted = bytearray(record(2))
+    corrupted[-2] ^= 0xFF
+    write_segment(log_dir, 1, record(1) + bytes(corrupted) + record(3))
+
+    replay = new_log(log_dir)._recover()
+
+    assert [seq for seq, _ in replay] == [1]
+
+
+def test_recover_skips_records_behind_checkpoint(tmp_path):
+    log_dir = tmp_path / "log"
+    write_segment(log_dir, 1, record(1) + record(2))
+    write_segment(log_dir, 3, record(3) + record(4))
+    (log_dir / CHECKPOINT_FILE).write_text("2")
+
+    log = new_log(log_dir)
+    replay = log._recover()
+
+    assert [seq for seq, _ in replay] == [3, 4]
+    assert log._next_seq == 5
+
+
+def test_gap_in_seq_does_not_hold_checkpoint(tmp_path):
+    log_dir = tmp_path / "log"
+    # Запись 3 не попала в журнал (ошибка записи) — её подтверждения никто не ждёт
+    write_segment(log_dir, 1, record(1) + record(2) + record(4))
+
+    log = new_log(log_dir)
+    replay = log._recover()
+
+    assert [seq for seq, _ in replay] == [1, 2, 4]
+    assert log._contiguous_checkpoint([2]) == 0
+    assert log._contiguous_checkpoint([1]) == 3
+    log._checkpoint = 3
+    assert log._contiguous_checkpoint([4]) == 4
+
+
+def test_checkpoint_advances_and_old_segments_are_deleted(tmp_path):
+    log_dir = tmp_path / "log"
+
+    async def test():
+        log = new_log(log_dir, segment_bytes=1, batch_size=4)
+        await log.start()
+        keys = [await log.append(item(f"p{n}")) for n in range(10)]
+        await log.stop()
+
+        assert keys == [f"{log.log_id}-{seq}" for seq in range(1, 11)]
+        assert (log_dir / CHECKPOINT_FILE).read_text() == "10"
+        # Остаётся только текущий сегмент
+        assert len([name for name in os.listdir(log_dir) if name.endswith(SEGMENT_SUFFIX)]) == 1
+        assert log.depth() == 0
+        assert await count_perevals() == 10
+
+    run_with_db(tmp_path, test)
+
+
+def test_replay_after_crash_is_idempotent(tmp_path, monkeypatch):
+    log_dir = tmp_path / "log"
+
+    async def test():
+        # Падение между записью в БД и записью checkpoint
+        monkeypatch.setattr(IngestLog, "_advance_checkpoint", lambda self, seq: None)
+        log = new_log(log_dir)
+        await log.start()
+        for n in range(5):
+            await log.append(item(f"p{n}"))
+        await log.stop()
+        assert await count_perevals() == 5
+        assert not (log_dir / CHECKPOINT_FILE).exists()
+        monkeypatch.undo()
+        monkeypatch.setattr(ingest, "RETRY_DELAY", 0.0)
+
+        replayed = new_log(log_dir)
+        await replayed.start()
+        await replayed.stop()
+
+        assert replayed.log_id == log.log_id
+        assert await count_perevals() == 5
+        assert (log_dir / CHECKPOINT_FILE).read_text() == "5"
+        async with database.Session() as db:
+            keys = set(await db.scalars(select(PerevalAdded.ingest_key)))
+        assert keys == {f"{log.log_id}-{seq}" for seq in range(1, 6)}
+
+    run_with_db(tmp_path, test)
+
+
+def test_failing_record_goes_to_dead_letter_file(tmp_path, monkeypatch):
+    log_dir = tmp_path / "log"
+    insert = ingest.insert_pereval_batch
+
+    async def failing_insert(db, items, errors, ingest_keys=None):
+        if any(i.title == "bad" for i in items):
+            return [BatchItemResult(index=n, status="error", error="Database error: boom") for n in range(len(items))]
+        return await insert(db, items, errors, ingest_keys=ingest_keys)
+
+    monkeypatch.setattr(ingest, "insert_pereval_batch", failing_insert)
+
+    async def test():
+        log = new_log(log_dir, batch_size=8)
+        await log.start()
+        await asyncio.gather(*(log.append(item("bad" if n == 3 else f"p{n}")) for n in range(8)))
+        await log.stop()
+
+        assert await count_perevals() == 7
+        assert (log_dir / CHECKPOINT_FILE).read_text() == "8"
+        [line] = (log_dir / DEAD_LETTER_FILE).read_text().splitlines()
+        dead = json.loads(line)
+        assert dead["item"]["title"] == "bad"
+        assert dead["error"] == "Database error: boom"
+
+    run_with_db(tmp_path, test)
+
+
+def test_cancelled_append_leaves_no_gap(tmp_path):
+    log_dir = tmp_path / "log"
+
+    async def test():
+        log = new_log(log_dir)
+        await log.start()
+        tasks = [asyncio.create_task(log.append(item(f"p{n}"))) for n in range(3)]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await log.stop()
+
+        assert isinstance(results[1], asyncio.CancelledError)
+        # Отменён только ответ: запись уже в журнале и дошла до БД, checkpoint не застрял
+        assert (log_dir / CHECKPOINT_FILE).read_text() == "3"
+        assert await count_perevals() == 3
+
+    run_with_db(tmp_path, test)
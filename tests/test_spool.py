@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+
+import pytest
+
+from pereval.spool import BLOB_MARKER, INVALID_DATA, SpooledImages, SpoolingJSONParser, read_json_spooled
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 3
+JPEG = b"\xff\xd8\xff\xe0" + b"jpeg body" * 50 + b"\xff\xd9"
+CHUNK_SIZES = [1, 2, 3, 4, 5, 7, 64, 1 << 20]
+
+
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    # Временные файлы ImageSpool создаются в tempfile.gettempdir()
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    return tmp_path
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def expected(body: bytes):
+    """What the parser must return: ``json.loads`` with image data replaced by hashes."""
+    value = json.loads(body)
+    for item in value if isinstance(value, list) else [value]:
+        for image in (item.get("images") if isinstance(item, dict) else None) or []:
+            data = image.get("data")
+            if data:
+                if data.startswith("data:"):
+                    data = data.partition(",")[2]
+                image["hash"] = image.get("hash") or hashlib.sha256(base64.b64decode(data)).hexdigest()
+                image["data"] = None
+    return value
+
+
+def parse(body: bytes, chunk_size: int):
+    images = SpooledImages()
+    parser = SpoolingJSONParser(images)
+    values = []
+    for start in range(0, len(body), chunk_size):
+        values += parser.feed(body[start:start + chunk_size])
+    parser.finish()
+    return values, images
+
+
+def spooled_content(images: SpooledImages):
+    contents = {}
+    for blob_hash, (path, size, _) in images._files.items():
+        with open(path, "rb") as f:
+            contents[blob_hash] = f.read()
+        assert len(contents[blob_hash]) == size
+    return contents
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_matches_json_loads_at_any_chunk_boundary(chunk_size):
+    body = json.dumps({
+        "title": 'Quote " backslash \\ unicode é П newline \n',
+        "other_titles": "\\\"",
+        "images": [
+            {"title": "prefixed", "data": "data:image/png;base64," + b64(PNG)},
+            {"title": "one pad", "data": b64(JPEG[:-1])},
+            {"title": "two pads", "data": b64(JPEG[:-2])},
+            {"title": "no pad", "data": b64(JPEG[:-3])},
+        ],
+        "connect": "",
+    }, ensure_ascii=False).encode()
+
+    values, images = parse(body, chunk_size)
+
+    assert values == [expected(body)]
+    assert sorted(spooled_content(images).values()) == sorted([PNG, JPEG[:-1], JPEG[:-2], JPEG[:-3]])
+    asyncio.run(images.discard())
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_escaped_slash_in_base64(chunk_size):
+    data = b64(b"\xff\xff\xfe" * 40)
+    assert "/" in data
+    body = b'{"images": [{"title": "t", "data": "' + data.replace("/", "\\/").encode() + b'"}]}'
+
+    values, images = parse(body, chunk_size)
+
+    assert values == [expected(body)]
+    assert list(spooled_content(images).values()) == [b"\xff\xff\xfe" * 40]
+    asyncio.run(images.discard())
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_images_at_other_depths_are_plain_strings(chunk_size):
+    body = json.dumps([
+        {"user": {"images": [{"data": b64(PNG)}]}, "images": [{"title": "t", "data": b64(JPEG)}]},
+        {"extra": [{"images": [{"data": "not base64!"}]}]},
+        [{"images": [{"data": b64(PNG)}]}],
+    ]).encode()
+
+    values, images = parse(body, chunk_size)
+
+    assert values == [expected(body)]
+    assert values[0][0]["user"]["images"][0]["data"] == b64(PNG)
+    assert values[0][2][0]["images"][0]["data"] == b64(PNG)
+    assert list(spooled_content(images).values()) == [JPEG]
+    asyncio.run(images.discard())
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_batch_of_top_level_values(chunk_size):
+    body = json.dumps([{"images": [{"title": "a", "data": b64(PNG)}]}, {"images": []}]).encode()
+    values, images = parse(body, chunk_size)
+    assert values == [expected(body)]
+    asyncio.run(images.discard())
+
+
+def test_duplicate_images_are_spooled_once(spool_dir):
+    body = json.dumps({"images": [
+        {"title": "a", "data": b64(PNG)},
+        {"title": "b", "data": "data:image/png;base64," + b64(PNG)},
+    ]}).encode()
+
+    values, images = parse(body, 3)
+
+    assert values == [expected(body)]
+    [first, second] = values[0]["images"]
+    assert first["hash"] == second["hash"] == hashlib.sha256(PNG).hexdigest()
+    assert len(os.listdir(spool_dir)) == 1
+    asyncio.run(images.discard())
+    assert os.listdir(spool_dir) == []
+
+
+@pytest.mark.parametrize("data", ["abc", "ab=c", "abc=dGVz", "YQ==YQ==", "data:image/png", "!!!!"])
+def test_invalid_base64_is_marked_invalid(data, spool_dir):
+    body = json.dumps({"images": [{"title": "t", "data": data}]}).encode()
+    for chunk_size in CHUNK_SIZES:
+        values, images = parse(body, chunk_size)
+        assert values[0]["images"][0]["data"] == INVALID_DATA
+        assert os.listdir(spool_dir) == []
+
+
+def test_empty_image_data_stays_empty():
+    body = b'{"images": [{"title": "t", "hash": "", "data": ""}]}'
+    values, _ = parse(body, 1)
+    assert values == [json.loads(body)]
+
+
+def test_blob_marker_in_user_data_is_not_a_reference():
+    body = json.dumps({"images": [{"title": "t", "data": b64(PNG)}], "connect": {BLOB_MARKER: "x"}}).encode()
+    values, images = parse(body, 5)
+    assert values[0]["connect"] == {BLOB_MARKER: "x"}
+    asyncio.run(images.discard())
+
+
+@pytest.mark.parametrize("tail", [b"", b"]", b"}}", b', "x": }', b"]} garbage"])
+def test_malformed_body_deletes_spooled_files(tail, spool_dir):
+    body = json.dumps({"images": [{"title": "a", "data": b64(PNG)}, {"title": "b", "data": b64(JPEG)}]}).encode()
+    # Тело обрывается или портится после того, как изображения уже записаны во временные файлы
+    body = body[:-2] + tail
+
+    async def chunks():
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+    images = SpooledImages()
+    with pytest.raises(ValueError):
+        asyncio.run(read_json_spooled(chunks(), images))
+    assert os.listdir(spool_dir) == []
+
+
+def test_body_cut_inside_image_data_deletes_partial_file(spool_dir):
+    body = json.dumps({"images": [{"title": "a", "data": b64(PNG)}]}).encode()
+    body = body[:len(body) // 2]
+
+    async def chunks():
+        yield body
+
+    images = SpooledImages()
+    with pytest.raises(ValueError):
+        asyncio.run(read_json_spooled(chunks(), images))
+    assert os.listdir(spool_dir) == []